@@ -0,0 +1,979 @@
+# ==========================================
+# ⏱️ PDR Security Micro-Benchmarks
+# ==========================================
+# ใช้งาน: python benchmark.py [ชื่อ benchmark ...]   (ไม่ใส่ชื่อ = รันทั้งหมด)
+# ใช้ฐานข้อมูลชั่วคราว ไม่แตะ protection.db จริง
+import asyncio
+import copy
+import json
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from types import SimpleNamespace
+
+os.environ.setdefault("DB_FILE", os.path.join(tempfile.mkdtemp(prefix="pdr-bench-"), "bench.db"))
+
+import main
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+def timeit(fn, n):
+    start = time.perf_counter()
+    for _ in range(n): fn()
+    return (time.perf_counter() - start) / n
+
+def fmt_time(seconds):
+    if seconds < 1e-6: return f"{seconds * 1e9:.0f}ns"
+    if seconds < 1e-3: return f"{seconds * 1e6:.2f}µs"
+    return f"{seconds * 1e3:.2f}ms"
+
+def fake_member(uid, guild_id, role_ids):
+    return SimpleNamespace(id=uid, guild=SimpleNamespace(id=guild_id), roles=[SimpleNamespace(id=r) for r in role_ids])
+
+# ------------------------------------------
+# 📋 Whitelist: SQLite + list scan vs in-memory index
+# ------------------------------------------
+def legacy_is_whitelisted(member):
+    wl = main.db.query("SELECT id, type FROM whitelist WHERE guild_id IN (0, ?)", (member.guild.id,))
+    wl_ids = [item[0] for item in wl]
+    if member.id in wl_ids: return True
+    for role in member.roles:
+        if role.id in wl_ids: return True
+    return False
+
+@benchmark("whitelist")
+def bench_whitelist():
+    guild_id = 900
+    for size in (100, 1_000, 10_000):
+        main.db.write("DELETE FROM whitelist").result()
+        rows = [(guild_id, 10_000_000 + i, "user" if i % 2 else "role") for i in range(size)]
+        main.db.write("INSERT INTO whitelist (guild_id, id, type) VALUES (?, ?, ?)", rows, many=True).result()
+        main.whitelist.load(main.db.load_whitelist())
+
+        for n_roles in (5, 50, 250):
+            member = fake_member(42, guild_id, range(1, n_roles + 1))  # worst case: not whitelisted
+            legacy = timeit(lambda: legacy_is_whitelisted(member), 50 if size >= 10_000 else 500)
+            index = timeit(lambda: main.whitelist.contains(guild_id, member), 20_000)
+            print(f"  whitelist={size:>6} roles={n_roles:>3}  legacy={fmt_time(legacy):>10}  index={fmt_time(index):>10}  ({legacy / index:,.0f}x)")
+
+    main.db.write("DELETE FROM whitelist").result()
+    main.whitelist.load([])
+
+# ------------------------------------------
+# 🔍 Content scanner: one re.search per rule vs single-pass scanner
+# ------------------------------------------
+WORDS = ["scam", "freenitro", "giveaway", "airdrop", "cheap", "robux", "crypto", "hack", "leak", "nsfw"]
+FILLER = "hey everyone does anyone know when the event starts tonight? i think it's at 8pm "
+
+LEGACY_INVITE_PATTERN = r'(discord\.(gg|io|me|li)|discordapp\.com/invite|discord\.com/invite)'
+
+def legacy_scan(config, text):
+    # แบบเดิม: แต่ละ module เดินข้อความใหม่ทุกรอบ
+    hits = set()
+    if re.search(LEGACY_INVITE_PATTERN, text, re.IGNORECASE): hits.add("anti_invite")
+    for word in config["banned_words"]:
+        if re.search(re.escape(word), text, re.IGNORECASE): hits.add("banned_word")
+    for domain in config["blocked_domains"]:
+        if re.search(re.escape(domain), text, re.IGNORECASE): hits.add("blocked_domain")
+    return hits
+
+@benchmark("scanner")
+def bench_scanner():
+    for n_rules in (0, 10, 100, 1_000):
+        config = copy.deepcopy(main.default_conf)
+        config["banned_words"] = [f"{WORDS[i % len(WORDS)]}{i}" for i in range(n_rules)]
+        config["blocked_domains"] = [f"bad-site-{i}.com" for i in range(n_rules // 10)]
+        scanner = main.ContentScanner(config)
+        for size in (40, 200, 2_000):
+            text = (FILLER * (size // len(FILLER) + 1))[:size]
+            n = max(200, 200_000 // max(size, n_rules))
+            legacy = timeit(lambda: legacy_scan(config, text), n)
+            single = timeit(lambda: scanner.scan_message(text), n)
+            print(f"  rules={n_rules:>5} chars={size:>5}  legacy={1 / legacy:>12,.0f} msg/s  scanner={1 / single:>12,.0f} msg/s")
+
+# ------------------------------------------
+# ⏳ Rate tracker: 1M distinct users
+# ------------------------------------------
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    state = fn()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return state, elapsed, size
+
+@benchmark("rate_tracker")
+def bench_rate_tracker():
+    users, hits_per_user = 1_000_000, 3
+    threshold, window = main.SPAM_THRESHOLD, main.SPAM_TIME
+    keys = [(1, uid) for uid in range(users)]  # key ชุดเดียวกันทั้งสองแบบ -> memory ที่วัดคือตัว window + dict เท่านั้น
+
+    def legacy():
+        tracker = defaultdict(list)
+        for i in range(hits_per_user):
+            for key in keys:
+                now = main.datetime.datetime.now()
+                tracker[key].append(now)
+                tracker[key] = [t for t in tracker[key] if (now - t).total_seconds() < window]
+        return tracker
+
+    def ring():
+        tracker = main.RateTracker(max_keys=2 * users)
+        now = 0.0
+        for i in range(hits_per_user):
+            for key in keys:
+                now += 0.000001
+                tracker.hit(key, threshold, window, now)
+        return tracker
+
+    for name, fn in (("legacy", legacy), ("ring", ring)):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        tracker, _, size = measure(fn)
+        total = users * hits_per_user
+        print(f"  {name:<7} {total / elapsed:>12,.0f} hits/s  memory={size / 1024 / 1024:>8.1f}MB  ({size / users:.0f} B/user)")
+        if name == "ring":
+            start = time.perf_counter()
+            evicted = tracker.sweep(now=tracker.idle_after + 10)
+            print(f"  sweep   evicted {evicted:,} idle keys in {fmt_time(time.perf_counter() - start)}")
+        del tracker
+
+# ------------------------------------------
+# ☢️ Anti-nuke detector: sustained load
+# ------------------------------------------
+@benchmark("nuke")
+def bench_nuke():
+    events = list(main.NUKE_WEIGHTS)
+    detector = main.NukeDetector()
+    for n_actors in (100, 10_000, 1_000_000):
+        now, total, tripped = 0.0, 500_000, 0
+        start = time.perf_counter()
+        for i in range(total):
+            now += 0.0001
+            event = events[i % len(events)]
+            tripped += detector.record(i % 50, i % n_actors, event, main.NUKE_WEIGHTS[event], main.NUKE_THRESHOLD, main.NUKE_TIME, now)[0]
+        elapsed = time.perf_counter() - start
+        print(f"  actors={n_actors:>9,}  {total / elapsed:>12,.0f} events/s  tracked={len(detector):>7,} (cap {detector.max_actors:,})  tripped={tripped:,}")
+
+# ------------------------------------------
+# 📜 Audit correlation: sleep + REST vs gateway stream
+# ------------------------------------------
+def fake_entry(guild_id, action, target_id):
+    return SimpleNamespace(guild=SimpleNamespace(id=guild_id), action=action, target=SimpleNamespace(id=target_id))
+
+@benchmark("audit")
+def bench_audit():
+    async def run():
+        feed = main.AuditCorrelator()
+        rest_rtt, gateway_lag = 0.120, 0.015
+        action = main.discord.AuditLogAction.role_delete
+
+        async def legacy(i):
+            start = time.perf_counter()
+            await asyncio.sleep(0.5)       # sleep-then-fetch
+            await asyncio.sleep(rest_rtt)  # guild.audit_logs(limit=1)
+            return time.perf_counter() - start
+
+        async def streamed(i, audit_first):
+            start = time.perf_counter()
+            entry = fake_entry(1, action, i)
+            if audit_first: feed.push(entry)
+            else: asyncio.get_running_loop().call_later(gateway_lag, feed.push, entry)
+            assert await feed.wait(1, action, i) is entry
+            return time.perf_counter() - start
+
+        n = 200
+        old = await asyncio.gather(*(legacy(i) for i in range(n)))
+        new = await asyncio.gather(*(streamed(i, i % 2 == 0) for i in range(n)))
+        for name, lat in (("sleep+REST", old), ("gateway", new)):
+            lat = sorted(lat)
+            print(f"  {name:<11} p50={fmt_time(lat[n // 2]):>9}  p99={fmt_time(lat[int(n * 0.99)]):>9}")
+        print(f"  REST calls: sleep+REST={n}  gateway={feed.fallbacks}")
+    asyncio.run(run())
+
+# ------------------------------------------
+# 🗄️ Database: event-loop lag under write-heavy load
+# ------------------------------------------
+@benchmark("db")
+def bench_db():
+    writes, interval = 2_000, 0.0005
+    config = json.dumps([main.default_conf] * 40)  # ~ขนาด backup ของเซิร์ฟกลางๆ
+
+    async def probe(stop, lags):
+        # วัดว่า loop ตื่นช้ากว่าที่ควรเท่าไร
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    async def run(write):
+        stop, lags = asyncio.Event(), []
+        task = asyncio.create_task(probe(stop, lags))
+        start = time.perf_counter()
+        pending = []
+        for i in range(writes):
+            pending.append(asyncio.ensure_future(write(i)))
+            await asyncio.sleep(interval)
+        await asyncio.gather(*pending)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await task
+        lags.sort()
+        return elapsed, lags
+
+    # แบบเดิม: sqlite3 บน event loop + commit ทุกคำสั่ง (journal แบบ default)
+    legacy_conn = sqlite3.connect(os.path.join(os.path.dirname(main.DB_FILE), "legacy.db"))
+    legacy_conn.execute("CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT)")
+    async def legacy_write(i):
+        legacy_conn.execute("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", (f"k{i % 50}", config))
+        legacy_conn.commit()
+
+    async def async_write(i):
+        await main.db.execute("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", (f"bench{i % 50}", config))
+
+    # tail บนเครื่องเดียวแกว่งมาก -> รันสลับกันหลายรอบแล้วรายงาน median ของแต่ละค่า (ดูทั้ง p99 / max ไม่ใช่แค่ p50)
+    stats = {"sync": [], "async": []}
+    for _ in range(5):
+        for name, write in (("sync", legacy_write), ("async", async_write)):
+            elapsed, lags = asyncio.run(run(write))
+            n = len(lags)
+            stats[name].append((writes / elapsed, lags[n // 2], lags[int(n * 0.99)], lags[-1]))
+    for name, rows in stats.items():
+        rate, p50, p99, worst = (statistics.median(col) for col in zip(*rows))
+        print(f"  {name:<6} {rate:>8,.0f} writes/s  loop lag p50={fmt_time(p50):>9}  p99={fmt_time(p99):>9}  max={fmt_time(worst):>9}  (median of {len(rows)} runs)")
+    legacy_conn.close()
+    main.db.write("DELETE FROM config WHERE key LIKE 'bench%'").result()
+
+# ------------------------------------------
+# ⚙️ Per-guild config: cache hit vs first load
+# ------------------------------------------
+@benchmark("config")
+def bench_config():
+    async def run():
+        store = main.ConfigStore(main.default_conf, max_guilds=500)
+        guilds = range(1, 1_001)
+        start = time.perf_counter()
+        for gid in guilds: await store.get(gid)
+        miss = (time.perf_counter() - start) / len(guilds)
+
+        hot = list(range(501, 1_001))  # ยังอยู่ใน cache
+        start = time.perf_counter()
+        for _ in range(200):
+            for gid in hot: await store.get(gid)
+        hit = (time.perf_counter() - start) / (200 * len(hot))
+        print(f"  first load={fmt_time(miss):>9}/guild  cached={fmt_time(hit):>9}/event  cached guilds={len(store)} (cap {store.max_guilds})")
+    asyncio.run(run())
+
+# ------------------------------------------
+# 💾 Backups: 250 roles + 500 channels
+# ------------------------------------------
+class FakeRole(SimpleNamespace):
+    def is_default(self): return self.position == 0
+
+def fake_guild(guild_id, n_roles=250, n_channels=500):
+    D = main.discord
+    roles = [FakeRole(id=guild_id * 10_000 + i, name=f"role-{i}", permissions=D.Permissions(1 << (i % 40)), color=D.Colour(i * 997),
+                      hoist=i % 7 == 0, mentionable=i % 3 == 0, position=i) for i in range(n_roles + 1)]
+    channels, n_categories = [], n_channels // 20
+    for i in range(n_channels):
+        is_category = i < n_categories
+        overwrites = {D.Object(roles[(i + k) % n_roles + 1].id, type=D.Role): D.PermissionOverwrite(send_messages=k % 2 == 0, view_channel=True) for k in range(3)}
+        channels.append(SimpleNamespace(
+            id=guild_id * 100_000 + i, name=f"channel-{i}", position=i,
+            type=D.ChannelType.category if is_category else (D.ChannelType.voice if i % 10 == 0 else D.ChannelType.text),
+            category_id=None if is_category else guild_id * 100_000 + i % n_categories, overwrites=overwrites,
+            topic=None if is_category else f"topic for channel {i}", nsfw=False, slowmode_delay=0))
+    return SimpleNamespace(id=guild_id, roles=roles, channels=channels)
+
+@benchmark("backup")
+def bench_backup():
+    async def run():
+        guild = fake_guild(7)
+        legacy = json.dumps({"roles": [{"name": r.name, "permissions": r.permissions.value, "color": r.color.value, "hoist": r.hoist, "mentionable": r.mentionable} for r in guild.roles[1:]]})
+        print(f"  legacy row (roles only, plain JSON): {len(legacy) / 1024:.1f}KB")
+
+        for label, mutate in (("first snapshot", None), ("unchanged", None), ("1 role + 2 channels edited", True)):
+            if mutate:
+                guild.roles[5].name = "renamed"
+                guild.channels[40].name, guild.channels[41].topic = "renamed", "new topic"
+            start = time.perf_counter()
+            res = await main.backups.create(guild, keep=20, max_age_days=30)
+            print(f"  {label:<28} {res['status']:<9} {fmt_time(time.perf_counter() - start):>9}  stored={res['bytes'] / 1024:>6.1f}KB  raw={res['raw'] / 1024:.1f}KB")
+
+        for i in range(60):
+            guild.channels[100 + i].name = f"edit-{i}"
+            await main.backups.create(guild, keep=20, max_age_days=30)
+        rows = await main.db.fetch("SELECT COUNT(*), SUM(length(data)) FROM snapshots WHERE guild_id=?", (guild.id,))
+        print(f"  after 63 snapshots (keep=20): rows={rows[0][0]}  total={rows[0][1] / 1024:.1f}KB  vs legacy {63 * len(legacy) / 1024:.1f}KB")
+
+        main.backups.latest.clear()
+        start = time.perf_counter()
+        state = await main.backups.get(guild.id)
+        assert state == main.snapshot_guild(guild)
+        print(f"  restore latest from disk (full + deltas): {fmt_time(time.perf_counter() - start)}")
+        await main.db.execute("DELETE FROM snapshots WHERE guild_id=?", (guild.id,))
+    asyncio.run(run())
+
+# ------------------------------------------
+# ♻️ Role recovery: 100 roles deleted in one burst
+# ------------------------------------------
+class FakeHTTP:
+    # จำลอง REST ของ Discord: latency คงที่ + นับจำนวน call
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.calls = defaultdict(int)
+
+    async def call(self, route):
+        self.calls[route] += 1
+        await asyncio.sleep(self.latency)
+
+@benchmark("restore")
+def bench_restore():
+    async def run():
+        http = FakeHTTP()
+        guild = fake_guild(8, n_roles=100, n_channels=0)
+        members = {1_000 + i: SimpleNamespace(id=1_000 + i, _roles=[]) for i in range(300)}
+        for i, role in enumerate(guild.roles):
+            role.managed = False
+            for k in range(20): members[1_000 + (i * 7 + k) % 300]._roles.append(role.id)
+        guild.members = list(members.values())
+        for m in members.values():
+            async def add_roles(*roles, reason=None): await http.call("PATCH member")
+            m.add_roles = add_roles
+
+        async def create_role(**kwargs):
+            await http.call("POST role")
+            return main.discord.Object(random.getrandbits(60))
+        async def edit_role_positions(positions, reason=None): await http.call("PATCH role positions")
+        guild.create_role, guild.edit_role_positions = create_role, edit_role_positions
+        guild.get_member, guild.me = members.get, SimpleNamespace(top_role=SimpleNamespace(position=500))
+
+        await main.role_restorer.index(guild)
+        deleted = [r.id for r in guild.roles[1:]]
+        guild.roles = guild.roles[:1]  # nuke: ลบยศทั้งหมด
+
+        start = time.perf_counter()
+        res = await main.role_restorer.restore(guild, deleted)
+        elapsed = time.perf_counter() - start
+        sequential = sum(http.calls.values()) * http.latency
+        print(f"  restored {res['created']} roles, {res['members']} members in {elapsed:.2f}s (sequential would be ~{sequential:.1f}s)")
+        print(f"  API calls: {dict(http.calls)}")
+        await main.db.execute("DELETE FROM role_snapshots WHERE guild_id=?", (guild.id,))
+    asyncio.run(run())
+
+# ------------------------------------------
+# 🔒 Lockdown: 380 channels + threads under a global rate limit
+# ------------------------------------------
+class RateLimitedHTTP(FakeHTTP):
+    # เพิ่ม global rate limit แบบ bucket ของ Discord (รีเซ็ตทุกวินาที) -> เกินแล้วโยน 429 พร้อม retry_after
+    def __init__(self, latency=0.05, per_second=50):
+        super().__init__(latency)
+        self.per_second = per_second
+        self.reset_at, self.remaining = 0.0, per_second
+        self.limited = 0
+
+    async def call(self, route):
+        now = time.perf_counter()
+        if now >= self.reset_at: self.reset_at, self.remaining = now + 1, self.per_second
+        if not self.remaining:
+            self.limited += 1
+            e = main.discord.HTTPException(SimpleNamespace(status=429, reason="Too Many Requests"), "rate limited")
+            e.retry_after = self.reset_at - now
+            raise e
+        self.remaining -= 1
+        await super().call(route)
+
+class FakeChannel:
+    def __init__(self, channel_id, ctype, http):
+        self.id, self.type, self.http = channel_id, ctype, http
+        self.overwrites = {}
+
+    def overwrites_for(self, target):
+        ow = self.overwrites.get(target)
+        return main.discord.PermissionOverwrite.from_pair(*ow.pair()) if ow else main.discord.PermissionOverwrite()
+
+    async def set_permissions(self, target, overwrite=None, reason=None):
+        await self.http.call("PUT channel permissions")
+        if overwrite is None: self.overwrites.pop(target, None)
+        else: self.overwrites[target] = overwrite
+
+class FakeThread(SimpleNamespace):
+    async def edit(self, locked=None, reason=None):
+        await self.http.call("PATCH thread")
+        self.locked = locked
+
+@benchmark("lockdown")
+def bench_lockdown():
+    async def run():
+        Type = main.discord.ChannelType
+        http = RateLimitedHTTP()
+        everyone = main.discord.Object(9)
+        layout = [Type.category] * 20 + [Type.text] * 250 + [Type.voice] * 80 + [Type.forum] * 30 + [Type.stage_voice] * 10 + [Type.news] * 10
+        channels = [FakeChannel(10_000 + i, t, http) for i, t in enumerate(layout)]
+        for c in channels[::3]:  # บางห้องมี overwrite เดิมอยู่แล้ว
+            c.overwrites[everyone] = main.discord.PermissionOverwrite(view_channel=True, send_messages=True)
+        threads = [FakeThread(id=20_000 + i, locked=i % 10 == 0, archived=False, http=http) for i in range(60)]
+        guild = SimpleNamespace(id=9, default_role=everyone, channels=channels, threads=threads)
+        lookup = {x.id: x for x in channels + threads}
+        guild.get_channel_or_thread = lookup.get
+        before = {c.id: (everyone in c.overwrites, c.overwrites_for(everyone).pair()) for c in channels}
+        before_threads = {t.id: t.locked for t in threads}
+
+        updates = 0
+        async def progress(done, total):
+            nonlocal updates
+            updates += 1
+
+        res = await main.lockdown.lock(guild, progress=progress)
+        locked = sum(1 for c in channels if c.type != Type.category and c.overwrites_for(everyone).send_messages is False)
+        legacy = sum(1 for c in channels if c.type == Type.text) * http.latency
+        print(f"  lock: {res['ok']}/{res['total']} targets in {res['seconds']:.2f}s, 429s: {res['rate_limited']}, progress callbacks: {updates}")
+        print(f"  locked channels: {locked}, legacy sequential (text only, no 429s) would be ~{legacy:.1f}s")
+
+        res = await main.lockdown.unlock(guild)
+        exact = all((everyone in c.overwrites, c.overwrites_for(everyone).pair()) == before[c.id] for c in channels) and all(t.locked == before_threads[t.id] for t in threads)
+        print(f"  unlock: {res['ok']}/{res['total']} in {res['seconds']:.2f}s, exact restore: {exact}")
+        print(f"  API calls: {dict(http.calls)}")
+    asyncio.run(run())
+
+# ------------------------------------------
+# 📨 Log dispatcher: 300-account raid into one log channel
+# ------------------------------------------
+class FakeLogChannel(SimpleNamespace):
+    async def send(self, embed=None, embeds=None):
+        await self.http.call("POST message")
+        self.delivered.append(embeds or [embed])
+
+@benchmark("logs")
+def bench_logs():
+    async def run():
+        http = RateLimitedHTTP(latency=0.1, per_second=1)  # ~5 ข้อความ / 5 วิ ต่อห้อง แบบ Discord
+        log_channel = FakeLogChannel(id=77, http=http, delivered=[])
+        guild = SimpleNamespace(id=11, get_channel=lambda cid: log_channel if cid == 77 else None)
+        cfg = main.merge_config({}, main.default_conf)
+        cfg["log_channel"] = 77
+        main.configs.put(guild.id, cfg)
+        channels = [SimpleNamespace(mention=f"<#{500 + i}>") for i in range(3)]
+
+        latencies = []
+        for i in range(300):
+            user = SimpleNamespace(id=10_000 + i, mention=f"<@{10_000 + i}>", avatar=None)
+            if i % 6 == 5: title, res = "🚫 Invite Blocked", "👢 KICKED"
+            else: title, res = "🔇 Spam Detected", "🔇 TIMEOUT"
+            channel = channels[i % 3]
+            start = time.perf_counter()
+            await main.send_log(guild, title, f"User: {user.mention}\nAction: **{res}**", user=user, group=f"{channel.mention} · **{res}**")
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.01)  # raid ~3 วิ
+        await asyncio.gather(*list(main.log_dispatcher.workers.values()))
+
+        latencies.sort()
+        stats = main.log_dispatcher.stats
+        embeds = sum(len(m) for m in log_channel.delivered)
+        print(f"  incidents={stats['incidents']}  messages={stats['messages']}  embeds={embeds}  dropped={stats['dropped']}  429s={http.limited}")
+        print(f"  messages/incident={stats['messages'] / stats['incidents']:.3f} (inline send_log: 1.000)")
+        print(f"  handler latency p50={fmt_time(latencies[len(latencies) // 2])}  p99={fmt_time(latencies[int(len(latencies) * 0.99)])}  (inline send_log: >= {http.latency * 1000:.0f}ms each, 300 messages at ~1/s)")
+    asyncio.run(run())
+
+# ------------------------------------------
+# ⚖️ Punishment executor: 2,000-bot raid + repeat spammers + rogue admins
+# ------------------------------------------
+class FakePunishGuild(SimpleNamespace):
+    async def ban(self, user, reason=None): await self.http.call("PUT ban")
+    async def kick(self, user, reason=None): await self.http.call("DELETE member")
+    async def bulk_ban(self, users, reason=None, delete_message_seconds=0):
+        await self.http.call("POST bulk-ban")
+        return SimpleNamespace(banned=[main.discord.Object(u.id) for u in users], failed=[])
+
+@benchmark("punish")
+def bench_punish():
+    async def run():
+        http = RateLimitedHTTP(latency=0.05, per_second=50)
+        guild = FakePunishGuild(id=12, http=http)
+        executor = main.PunishmentExecutor()
+
+        def member(uid):
+            async def timeout(duration, reason=None): await http.call("PATCH member")
+            return SimpleNamespace(id=uid, bot=False, timeout=timeout)
+
+        async def timed(target, action, reason, priority=main.PRIORITY_NORMAL):
+            # handler จ่ายแค่ submit (คืน Future ทันที) ส่วน done = กว่าโทษจะลงจริง
+            start = time.perf_counter()
+            fut = executor.submit(guild, target, action, reason, priority)
+            queued = time.perf_counter() - start
+            res = await fut
+            return res, time.perf_counter() - start, queued
+
+        raiders = [timed(member(100_000 + i), "ban", "Anti-Invite") for i in range(2_000)]
+        spammers = [member(200_000 + i) for i in range(400)]
+        repeats = [timed(m, "timeout", reason) for m in spammers for reason in ("Anti-Spam", "Anti-Invite", "Mass Mention")]
+
+        async def nukers():
+            await asyncio.sleep(0.5)  # กลางๆ raid
+            return await asyncio.gather(*(timed(member(300_000 + i), "ban", "Anti-Nuke: channel_delete", main.PRIORITY_NUKE) for i in range(5)))
+
+        start = time.perf_counter()
+        results, nuke = await asyncio.gather(asyncio.gather(*raiders, *repeats), nukers())
+        elapsed = time.perf_counter() - start
+
+        submitted = len(results) + len(nuke)
+        statuses = defaultdict(int)
+        for res, *_ in results + nuke: statuses[str(res)] += 1
+        normal = sorted(t for _, t, _ in results)
+        handler = sorted(q for *_, q in results + nuke)
+        print(f"  {submitted} submissions ({len(raiders)} raid bans, {len(spammers)} spammers x3, 5 rogue admins) in {elapsed:.2f}s")
+        print(f"  API calls={sum(http.calls.values())} {dict(http.calls)}  429s={http.limited}  stats={executor.stats}")
+        print(f"  results: {dict(statuses)}")
+        print(f"  done latency: anti-nuke max={fmt_time(max(t for _, t, _ in nuke))}  others p50={fmt_time(normal[len(normal) // 2])} p99={fmt_time(normal[int(len(normal) * 0.99)])}")
+        print(f"  handler cost (submit returns): p50={fmt_time(handler[len(handler) // 2])} p99={fmt_time(handler[int(len(handler) * 0.99)])} max={fmt_time(handler[-1])}")
+        print(f"  inline execute_punishment: {submitted} calls -> >= {submitted / http.per_second:.0f}s at {http.per_second} req/s")
+        for w in executor.workers: w.cancel()
+    asyncio.run(run())
+
+# ------------------------------------------
+# 🌊 Join raid: replay 1,000 joins/min on top of normal traffic
+# ------------------------------------------
+def join_trace(guild, start, normal=300, raiders=1_000):
+    # คนปกติ: บัญชีเก่า มี avatar ชื่อหลากหลาย กระจายทั้งชั่วโมง / raid: บัญชีใหม่ ไม่มี avatar ชื่อซ้ำแพทเทิร์นเดียว ใน 60 วิ
+    rng = random.Random(13)
+    day = 86400
+    trace = []
+    for i in range(normal):
+        name = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 10)))
+        trace.append((start + rng.uniform(0, 3600), SimpleNamespace(id=1_000_000 + i, name=name, avatar=object(), bot=False, guild=guild,
+            created_at=main.datetime.datetime.fromtimestamp(start - rng.uniform(30, 2000) * day, main.datetime.timezone.utc))))
+    for i in range(raiders):
+        trace.append((start + 1800 + i * 0.06, SimpleNamespace(id=2_000_000 + i, name=f"{rng.choice(['raid', 'Raid', 'r_a_i_d'])}er{rng.randint(0, 99999)}", avatar=None, bot=False, guild=guild,
+            created_at=main.datetime.datetime.fromtimestamp(start + 1800 - rng.uniform(0, 2) * day, main.datetime.timezone.utc))))
+    trace.sort(key=lambda x: x[0])
+    return trace
+
+@benchmark("raid")
+def bench_raid():
+    guild = SimpleNamespace(id=13)
+    start = time.time()
+    trace = join_trace(guild, start)
+
+    def replay():
+        detector = main.JoinRaidDetector()
+        held = 0
+        for ts, member in trace:
+            started, flagged = detector.record(member, main.RAID_THRESHOLD, main.RAID_TIME, now=ts)
+            if detector.active(guild.id, ts) and flagged: held += 1
+        return detector, held
+
+    (detector, held), elapsed, size = measure(replay)
+    raiders = sum(1 for _, m in trace if m.id >= 2_000_000)
+    flagged_normal = sum(1 for ts, m in trace if m.id < 2_000_000 and main.join_score(m, 0, ts) >= main.RAID_FLAG_SCORE)
+    backlog = len(detector.held.get(guild.id, ()))
+    print(f"  replay {len(trace)} joins: {fmt_time(elapsed / len(trace))}/join  memory={size / 1024:.0f}KB  raids={detector.stats['raids']}")
+    print(f"  raiders={raiders} held={held + backlog} (live {held} + backlog {backlog})  normal users flagged={flagged_normal}")
+
+    async def handle():
+        # ส่วน async: คิวที่ถูก hold -> executor จริง (ban รวมเป็น bulk_ban) บน fake HTTP
+        http = RateLimitedHTTP(latency=0.05, per_second=50)
+        fake = FakePunishGuild(id=14, http=http, get_member=lambda mid: None)
+        main.punisher = main.PunishmentExecutor()
+        detector = main.JoinRaidDetector()
+        begin = time.perf_counter()
+        for i, (ts, member) in enumerate(t for t in trace if t[1].id >= 2_000_000):
+            member.guild = fake
+            started, flagged = detector.record(member, main.RAID_THRESHOLD, main.RAID_TIME, now=start + i * 0.06)
+            if detector.active(fake.id, start + i * 0.06): detector.hold(fake, "ban", member.id if flagged else None)
+            if i % 17 == 0: await asyncio.sleep(0)  # ~1000 joins/min อัดมาใน ~1 วิ
+        while detector.tasks: await asyncio.gather(*list(detector.tasks.values()))
+        elapsed = time.perf_counter() - begin
+        print(f"  handled {detector.stats['handled']} raiders in {elapsed:.2f}s  API calls={dict(http.calls)}  (serial handler: {detector.stats['handled']} bans)")
+        for w in main.punisher.workers: w.cancel()
+    asyncio.run(handle())
+
+# ------------------------------------------
+# 🗂️ Spam cleanup: history purge vs message index (spam across 4 channels, interleaved)
+# ------------------------------------------
+def snowflake(ts, seq):
+    return (int(ts * 1000) - main.discord.utils.DISCORD_EPOCH) << 22 | seq
+
+class FakeTextChannel(SimpleNamespace):
+    async def purge(self, limit, check):
+        # discord.py: ดึง history ทีละ 100 แล้วกรองฝั่ง client
+        await self.http.call("GET messages")
+        doomed = [m for m in self.messages[-limit:] if check(m)]
+        if doomed: await self.delete_messages(doomed)
+        return doomed
+
+    async def delete_messages(self, messages, reason=None):
+        await self.http.call("POST bulk-delete" if len(messages) > 1 else "DELETE message")
+        ids = {m.id for m in messages}
+        self.messages = [m for m in self.messages if m.id not in ids]
+
+@benchmark("cleanup")
+def bench_cleanup():
+    async def run():
+        now = time.time()
+        for name in ("purge", "index"):
+            http = FakeHTTP(latency=0.05)
+            channels = {30 + i: FakeTextChannel(id=30 + i, http=http, messages=[]) for i in range(4)}
+            guild = SimpleNamespace(id=15, get_channel_or_thread=channels.get)
+            index = main.MessageIndex()
+            seq = 0
+            for i in range(20):  # สแปม 20 ข้อความวนทุกห้อง แทรกด้วยคนอื่นคุยปกติ
+                for author in (666, 1, 2, 3):
+                    if author != 666 and random.random() < 0.5: continue
+                    seq += 1
+                    channel = channels[30 + (i + author) % 4]
+                    msg = SimpleNamespace(id=snowflake(now - 20 + i, seq), author=SimpleNamespace(id=author))
+                    channel.messages.append(msg)
+                    if author == 666: index.add(guild.id, 666, channel.id, msg.id)
+            spam = sum(1 for c in channels.values() for m in c.messages if m.author.id == 666)
+
+            start = time.perf_counter()
+            if name == "purge":
+                await channels[30 + 19 % 4].purge(limit=main.SPAM_THRESHOLD, check=lambda m: m.author.id == 666)
+            else:
+                main.message_index = index
+                await main.cleanup_messages(guild, 666, "Anti-Spam")
+            elapsed = time.perf_counter() - start
+            left = sum(1 for c in channels.values() for m in c.messages if m.author.id == 666)
+            print(f"  {name:<6} removed {spam - left}/{spam} spam messages in {elapsed * 1000:.0f}ms  API calls={dict(http.calls)}")
+
+        index = main.MessageIndex(max_users=100_000)
+        def fill():
+            for i in range(1_000_000):
+                index.add(15, i % 100_000, 30 + i % 4, snowflake(now + i / 1000, i))
+            return index
+        _, elapsed, size = measure(fill)
+        start = time.perf_counter()
+        evicted = index.sweep(now=now + 1_000 + index.ttl + 1)
+        print(f"  index add={fmt_time(elapsed / 1_000_000)}  100k users x 10 msgs memory={size / 1024 / 1024:.1f}MB  sweep evicted {evicted:,} in {fmt_time(time.perf_counter() - start)}")
+    asyncio.run(run())
+
+# ------------------------------------------
+# 📈 Metrics: recording overhead per event
+# ------------------------------------------
+@benchmark("metrics")
+def bench_metrics():
+    m = main.Metrics()
+    labels = ("anti_spam",)
+    n = 1_000_000
+    base = timeit(lambda: None, n)
+    inc = timeit(lambda: m.inc("pdr_detections_total", labels), n) - base
+    counter, hist = m.counter("pdr_detections_total", labels), m.histogram("pdr_module_seconds", labels)
+    child_inc = timeit(counter.inc, n) - timeit(lambda: None, n)
+    observe = timeit(lambda: hist.observe(0.0003), n) - base
+
+    async def handler(x): return x
+    async def run(fn, n):
+        start = time.perf_counter()
+        for i in range(n): await fn(i)
+        return (time.perf_counter() - start) / n
+
+    timed = m.timed("pdr_handler_seconds", "bench")(handler)
+    bare = asyncio.run(run(handler, n))
+    wrapped = asyncio.run(run(timed, n)) - bare
+    m.enabled = False
+    disabled = asyncio.run(run(timed, n)) - bare
+    disabled_inc = timeit(lambda: m.inc("pdr_detections_total", labels), n) - base
+    m.enabled = True
+    # wrapper = coroutine ชั้นเพิ่ม (มีแม้ตอนปิด) + การบันทึก (เฉพาะตอนเปิด)
+    print(f"  bound inc={fmt_time(child_inc)}  bound observe={fmt_time(observe)}  inc by labels={fmt_time(inc)}  timed: record={fmt_time(wrapped - disabled)} + wrapper frame={fmt_time(disabled)}  (disabled inc={fmt_time(disabled_inc)})")
+
+    for i in range(20): m.inc("pdr_actions_total", (f"Anti-{i}", "ban", "ok"))
+    m.gauge("pdr_example", lambda: 1)
+    start = time.perf_counter()
+    text = m.render()
+    print(f"  render {text.count(chr(10))} lines in {fmt_time(time.perf_counter() - start)}")
+
+# ------------------------------------------
+# 🧩 Cluster: events/s per core + total RSS at 1 / 2 / 4 workers, change feed poll cost
+# ------------------------------------------
+@benchmark("cluster")
+def bench_cluster():
+    # โหลดรวมเท่ากันทุกแบบ (replay "normal" 16 รอบ) แบ่งให้ worker แต่ละโปรเซสเท่าๆ กันแล้วรันพร้อมกัน
+    total_runs, cores = 16, os.cpu_count() or 1
+    tmp = tempfile.mkdtemp(prefix="pdr-cluster-")
+    for workers in (1, 2, 4):
+        procs = []
+        for cluster_id in range(workers):
+            out = os.path.join(tmp, f"w{workers}-{cluster_id}.json")
+            env = {**os.environ, "DB_FILE": os.path.join(tmp, f"w{workers}-{cluster_id}.db"), "METRICS": "0"}
+            cmd = [sys.executable, "replay.py", "normal", "--repeat", str(total_runs // workers), "--quiet", "--json", out]
+            procs.append((subprocess.Popen(cmd, env=env, cwd=os.path.dirname(os.path.abspath(__file__))), out))
+        results = []
+        for proc, out in procs:
+            proc.wait()
+            with open(out) as f: results.append(json.load(f))
+        events = sum(r["events"] for rs in results for r in rs)
+        wall = max(sum(r["seconds"] for r in rs) for rs in results)  # worker ที่ช้าสุดกำหนดเวลารวม
+        rss = sum(max(r["rss_bytes"] for r in rs) for rs in results)
+        rate = events / wall
+        print(f"  {workers} worker(s): {events:,} events -> {rate:,.0f} events/s total, {rate / min(workers, cores):,.0f} events/s per core, total RSS={rss / 1024 / 1024:.0f}MB")
+    if cores < 4: print(f"  (เครื่องนี้มี {cores} core -> worker แย่ง CPU กัน ตัวเลข per core ที่ >1 worker คือค่าต่ำสุด)")
+
+    async def run():
+        feed = main.ChangeFeed()
+        await feed.poll()
+        n = 200
+        start = time.perf_counter()
+        for _ in range(n): await feed.poll()
+        empty = (time.perf_counter() - start) / n
+        # worker 1 เพิ่ม whitelist / แก้ config 100 guild -> worker 0 poll รอบเดียว
+        main.CLUSTER_ID = 1
+        for guild_id in range(100):
+            await main.db.manage_whitelist(guild_id, 9_000 + guild_id, "user", "add")
+            await main.configs.save(guild_id, copy.deepcopy(main.default_conf))
+        main.CLUSTER_ID = 0
+        start = time.perf_counter()
+        applied = await feed.poll()
+        ok = all(main.whitelist.users.get(g) == {9_000 + g} for g in range(100))
+        main.CLUSTER_ID = -1
+        print(f"  change feed: empty poll={fmt_time(empty)} (ทุก {main.CHANGE_POLL:.0f}s)  apply {applied} changes in {fmt_time(time.perf_counter() - start)}  whitelist synced={ok}")
+    asyncio.run(run())
+
+# ------------------------------------------
+# 🪶 Low-memory mode: RSS of synthetic guilds (10k / 100k / 1M members), full cache vs lean
+# ------------------------------------------
+def member_payload(guild_id, i, n_roles):
+    return {"guild_id": str(guild_id), "user": {"id": str(10**17 + i), "username": f"user{i}", "discriminator": "0", "avatar": "a" * 32, "global_name": None},
+            "roles": [str(guild_id + 1 + i % n_roles), str(guild_id + 1 + (i * 7) % n_roles)], "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0}
+
+def lowmem_child(low, n_members, out, n_roles=50):
+    # โปรเซสแยก (fork) ต่อกรณี -> RSS ไม่ปนกัน, สมาชิกเข้าผ่าน parser ของ discord.py จริง (GUILD_MEMBER_ADD)
+    D = main.discord
+    main.LOW_MEMORY = low
+    opts = {"member_cache_flags": D.MemberCacheFlags.none(), "max_messages": None, "chunk_guilds_at_startup": False} if low else {}
+    state = main.commands.Bot(command_prefix="!", intents=main.lean_intents([]) if low else D.Intents.all(), **opts)._connection
+    guild_id = 1
+    roles = [{"id": str(guild_id + i), "name": f"role-{i}", "permissions": "0", "position": i, "color": 0, "hoist": False, "managed": False, "mentionable": False, "flags": 0} for i in range(n_roles + 1)]
+    guild = state._add_guild_from_data({"id": str(guild_id), "name": "bench", "roles": roles, "channels": [], "members": [], "member_count": n_members, "features": [], "emojis": [], "stickers": []})
+    proc = main.psutil.Process()  # main.PROCESS คือโปรเซสแม่ (ก่อน fork)
+    before = proc.memory_info().rss
+    for i in range(n_members): state.parse_guild_member_add(member_payload(guild_id, i, n_roles))
+    res = {"cached": len(guild.members), "rss": proc.memory_info().rss - before}
+    if not low:
+        # index ยศ: รอบเดียวผ่านสมาชิก vs role.members ทีละยศ (ของเดิม)
+        start = time.perf_counter()
+        holders = asyncio.run(main.role_members(guild))
+        res["index"] = time.perf_counter() - start
+        res["holders_bytes"] = sum(ids.itemsize * len(ids) for ids in holders.values())
+        if n_members <= 100_000:
+            start = time.perf_counter()
+            for role in guild.roles: [m.id for m in role.members]
+            res["legacy_index"] = time.perf_counter() - start
+    with open(out, "w") as f: json.dump(res, f)
+
+@benchmark("lowmem")
+def bench_lowmem():
+    lean = [name for name, on in main.lean_intents([]) if on]
+    print(f"  lean intents (default config): {', '.join(lean)}  ({len(lean)} of {sum(on for _, on in main.discord.Intents.all())} flags, no presences)")
+    tmp = tempfile.mkdtemp(prefix="pdr-lowmem-")
+    ctx = multiprocessing.get_context("fork")
+    for n in (10_000, 100_000, 1_000_000):
+        res = {}
+        for low in (False, True):
+            out = os.path.join(tmp, f"{n}-{low}.json")
+            proc = ctx.Process(target=lowmem_child, args=(low, n, out))
+            proc.start()
+            proc.join()
+            with open(out) as f: res[low] = json.load(f)
+        full, lean = res[False], res[True]
+        legacy = f" (role.members ทีละยศ {fmt_time(full['legacy_index'])})" if "legacy_index" in full else ""
+        print(f"  {n:>9,} members: full cache RSS +{full['rss'] / 1024 / 1024:7.1f}MB ({full['cached']:,} cached)  lean RSS +{lean['rss'] / 1024 / 1024:5.1f}MB ({lean['cached']:,} cached)"
+              f"  role index {fmt_time(full['index'])}{legacy}, compact ids={full['holders_bytes'] / 1024 / 1024:.1f}MB")
+
+# ------------------------------------------
+# 🚀 Startup: cold start / reconnect with many guilds (legacy on_ready vs pipeline)
+# ------------------------------------------
+@benchmark("startup")
+def bench_startup():
+    n_guilds, sync_latency = 1_000, 0.5
+
+    async def run():
+        syncs = []
+        async def fake_sync(guild=None):
+            syncs.append(guild)
+            await asyncio.sleep(sync_latency)
+        main.bot.tree.sync = fake_sync
+        state = main.bot._connection
+        state.application_id = 1
+
+        def make_guilds(base):
+            guilds = {}
+            for i in range(n_guilds):
+                guild = fake_guild(base + i, n_roles=20, n_channels=40)
+                for role in guild.roles: role.managed = False
+                guild.members = []
+                guilds[guild.id] = guild
+            return guilds
+
+        async def lag_probe(stop):
+            # event loop ว่างพอให้ event จริงได้รันไหม (p99 ของดีเลย์ sleep 10ms)
+            lags = []
+            while not stop.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - start - 0.01)
+            lags.sort()
+            return lags[int(len(lags) * 0.99)] if lags else 0.0
+
+        async def legacy_on_ready():
+            await main.bot.tree.sync()
+            for guild in main.bot.guilds: await main.create_backup(guild)
+
+        async def measure(fn):
+            stop = asyncio.Event()
+            probe = asyncio.create_task(lag_probe(stop))
+            start = time.perf_counter()
+            await fn()
+            ready = time.perf_counter() - start
+            while main.startup.backups_pending or len(asyncio.all_tasks()) > 2: await asyncio.sleep(0.01)
+            done = time.perf_counter() - start
+            stop.set()
+            return ready, done, await probe
+
+        state._guilds = make_guilds(1_000_000)
+        syncs.clear()
+        cold = await measure(legacy_on_ready)
+        again = await measure(legacy_on_ready)
+        print(f"  legacy   cold: ready {cold[0]:.2f}s  loop lag p99 {cold[2] * 1000:.1f}ms  | reconnect: ready {again[0]:.2f}s  syncs={len(syncs)}")
+
+        state._guilds = make_guilds(2_000_000)
+        syncs.clear()
+        main.configs.cache.clear()
+        main.startup = main.StartupPipeline()
+        cold = await measure(main.startup.ready)
+        main.startup.disconnected()
+        again = await measure(main.startup.ready)
+        print(f"  pipeline cold: ready {cold[0]:.2f}s  backups done {cold[1]:.2f}s  loop lag p99 {cold[2] * 1000:.1f}ms  | reconnect: ready {again[0] * 1000:.2f}ms  syncs={len(syncs)}")
+
+        # รีสตาร์ทโปรเซส (hash ของ tree เก็บใน DB แล้ว) -> ไม่ sync ซ้ำ
+        syncs.clear()
+        main.configs.cache.clear()
+        main.startup = main.StartupPipeline()
+        restart = await measure(main.startup.ready)
+        print(f"  pipeline restart (tree unchanged): ready {restart[0]:.2f}s  syncs={len(syncs)}  configs preloaded={len(main.configs)}")
+    asyncio.run(run())
+
+# ------------------------------------------
+# 🌊 Flood guard: per-message cost for webhook / bot traffic
+# ------------------------------------------
+@benchmark("flood")
+def bench_flood():
+    cfg = main.default_conf["modules"]["anti_flood"]
+    n, now = 1_000_000, time.time()
+    for sources in (10, 1_000, 50_000):
+        guard = main.FloodGuard()
+        ids = [snowflake(now + i / 1000, i) for i in range(4096)]
+        start = time.perf_counter()
+        tripped = 0
+        for i in range(n):
+            # บอท / webhook ปกติ: แต่ละแหล่งโพสต์วินาทีละครั้ง (ไม่ล้น) กระจาย 100 ห้อง
+            tripped += guard.hit(1, 10_000 + i % sources, 500 + i % 100, ids[i & 4095], cfg, now=i / sources)
+        elapsed = (time.perf_counter() - start) / n
+        print(f"  {sources:>6,} sources: hit={fmt_time(elapsed)}/msg  buckets={len(guard.buckets):,}  tripped={tripped}")
+
+    guard = main.FloodGuard()
+    flood = [guard.hit(1, 77, 500, snowflake(now, i), cfg, now=i * 0.002) for i in range(200)]  # webhook ยิง 500 msg/วิ
+    print(f"  flood 500 msg/s: tripped at message #{flood.index(True) + 1}, then handled once (tripped total={sum(flood)})")
+
+# ------------------------------------------
+# 📓 Incident journal: batched appends + indexed cursor queries at scale
+# ------------------------------------------
+@benchmark("incidents")
+def bench_incidents():
+    n = int(os.getenv("BENCH_INCIDENTS", 10_000_000))
+    n_guilds, n_users, span = 1_000, 100_000, 180 * 86400
+    modules = list(main.default_conf["modules"])
+    actions = ("ban", "kick", "timeout", "channel_delete", "role_delete", "webhook_delete")
+    rng = random.Random(21)
+    path = os.path.join(tempfile.mkdtemp(prefix="pdr-incidents-"), "incidents.db")
+    saved, main.db = main.db, main.Database(path)
+    journal = main.IncidentJournal()
+
+    # handler ฝั่งเดียวที่จ่าย: ต่อท้าย buffer (ไม่ให้ flush ระหว่างวัด)
+    batch, main.JOURNAL_BATCH = main.JOURNAL_BATCH, float("inf")
+    record = timeit(lambda: journal.record(1, "anti_spam", None, 2, "timeout", "ok", "Anti-Spam"), 100_000)
+    main.JOURNAL_BATCH = batch
+    journal.buffer.clear()
+
+    # เขียนผ่านทางเดียวกับ journal.flush (executemany ชุดละ JOURNAL_BATCH) จำกัดงานค้างไม่ให้คิวบวม
+    # id ไล่ตามเวลาเหมือนของจริง, มีคนทำ (actor) แค่ ~10% (event nuke) ที่เหลือคือบอทลงโทษ
+    start_ts = time.time() - span
+    start = time.perf_counter()
+    pending = deque()
+    for base in range(0, n, main.JOURNAL_BATCH):
+        journal.buffer = [(rng.randrange(n_guilds), start_ts + i * span / n, rng.choice(modules), rng.randrange(n_users) if i % 10 == 0 else None,
+                           rng.randrange(n_users), rng.choice(actions), "ok", "Anti-Spam") for i in range(base, min(n, base + main.JOURNAL_BATCH))]
+        pending.append(journal.flush())
+        if len(pending) > 32: pending.popleft().result()
+    for fut in pending: fut.result()
+    insert = time.perf_counter() - start
+    size = os.path.getsize(path)
+    print(f"  record()={fmt_time(record)}/call  insert {n:,} rows in {insert:.1f}s -> {n / insert:,.0f} rows/s  file={size / 1024 / 1024:,.0f}MB")
+
+    async def run():
+        async def latency(fn, k=200):
+            times = []
+            for _ in range(k):
+                t = time.perf_counter()
+                await fn()
+                times.append(time.perf_counter() - t)
+            times.sort()
+            return f"p50={fmt_time(times[len(times) // 2])} p99={fmt_time(times[int(len(times) * 0.99)])}"
+
+        page = main.JOURNAL_PAGE + 1
+        g, u, m = (lambda: rng.randrange(n_guilds)), (lambda: rng.randrange(n_users)), (lambda: rng.choice(modules))
+        day = lambda: start_ts + rng.random() * (span - 86400)
+        async def walk():
+            cursor = None
+            for _ in range(10):
+                rows = await main.db.incidents(7, before_id=cursor, limit=page)
+                cursor = rows[-2][0]
+        async def window():
+            since = day()
+            await main.db.incidents(g(), since=since, until=since + 86400, limit=page)
+        for name, fn in (("latest page", lambda: main.db.incidents(g(), limit=page)),
+                         ("user filter", lambda: main.db.incidents(g(), user_id=u(), limit=page)),
+                         ("module filter", lambda: main.db.incidents(g(), module=m(), limit=page)),
+                         ("1-day range", window),
+                         ("deep cursor", lambda: main.db.incidents(g(), before_id=rng.randrange(n), limit=page)),
+                         ("10-page walk", walk)):
+            print(f"  {name:<14} {await latency(fn)}")
+
+        t = time.perf_counter()
+        main.db.query("SELECT id FROM incidents NOT INDEXED WHERE guild_id=? AND target_id=? ORDER BY id DESC LIMIT ?", (g(), u(), page))
+        print(f"  user filter without index: {fmt_time(time.perf_counter() - t)} (full scan)")
+
+        t = time.perf_counter()
+        purged = await journal.purge(days=90)
+        print(f"  retention 90d: purged {purged:,} rows + compact in {time.perf_counter() - t:.1f}s  file={os.path.getsize(path) / 1024 / 1024:,.0f}MB")
+        print(f"  latest page after purge {await latency(lambda: main.db.incidents(g(), limit=page))}")
+    try: asyncio.run(run())
+    finally:
+        main.db.close()
+        main.db = saved
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"❌ Unknown benchmark: {name} (available: {', '.join(BENCHMARKS)})")
+            continue
+        print(f"⏱️ {name}")
+        BENCHMARKS[name]()
@@ -2,16 +2,33 @@ import discord
 from discord.ext import commands, tasks
 from discord import app_commands
 import datetime
+import functools
+import copy
+import hashlib
+import heapq
 import json
+import math
 import os
 import re
+import signal
 import sqlite3
+import subprocess
+import sys
 import asyncio
+import atexit
 import psutil
 import logging
+import queue
 import threading
+import time
+import urllib.request
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from array import array
+from bisect import bisect_left
 from flask import Flask
-from collections import defaultdict
+from collections import deque, OrderedDict
+from itertools import islice
 from dotenv import load_dotenv
 
 # ==========================================
@@ -24,17 +41,41 @@ load_dotenv()
 TOKEN = os.getenv('TOKEN')
 OWNER_ID = 1228316351945506847 # ⚠️ แก้เป็น ID ของคุณ
 
-DB_FILE = "protection.db"
+DB_FILE = os.getenv('DB_FILE', "protection.db")
+
+# Cluster (ดู 🧩 CLUSTER MODE) -> CLUSTER_WORKERS > 1 = โปรเซสนี้เป็น supervisor,
+# CLUSTER_ID >= 0 = โปรเซสนี้เป็น worker ที่ถือ shard ตาม SHARD_IDS
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', "1"))
+CLUSTER_ID = int(os.getenv('CLUSTER_ID', "-1"))
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', "0")) or None
+SHARD_IDS = [int(x) for x in os.getenv('SHARD_IDS', "").split(",") if x.strip()]
+
+# Low-memory (ดู 🪶 LOW MEMORY MODE) -> intent เท่าที่ใช้, ไม่ cache สมาชิก / ข้อความ
+LOW_MEMORY = os.getenv('LOW_MEMORY', "0") == "1"
 
 # Limits & Thresholds
 SPAM_THRESHOLD = 5      # 5 ข้อความ
 SPAM_TIME = 5           # ภายใน 5 วินาที
-NUKE_THRESHOLD = 3      # 3 การกระทำ
+NUKE_THRESHOLD = 3      # 3 คะแนน (ตาม NUKE_WEIGHTS)
 NUKE_TIME = 10          # ภายใน 10 วินาที
+RAID_THRESHOLD = 10     # 10 คนเข้า
+RAID_TIME = 10          # ภายใน 10 วินาที
+FLOOD_THRESHOLD = 10    # ข้อความจาก webhook / บอทตัวเดียว (รัวได้ทีเดียว แล้วเติมคืนตามเวลา)
+FLOOD_CHANNEL_THRESHOLD = 30  # ข้อความจาก webhook / บอททุกตัวรวมกันในห้องเดียว
+FLOOD_TIME = 5          # เติมถังเต็มใน 5 วินาที
+
+# สิทธิ์ที่ถือว่าอันตราย (Anti-Role)
+DANGEROUS_PERMS = ("administrator", "manage_guild", "ban_members")
+
+# น้ำหนักของแต่ละการกระทำ (>= NUKE_THRESHOLD = โดนทันทีตั้งแต่ครั้งแรก)
+NUKE_WEIGHTS = {
+    "ban": 1, "kick": 1, "channel_delete": 1,
+    "role_delete": 3, "webhook_create": 3, "bot_add": 3, "role_grant": 3
+}
 
-# Regex Patterns
-URL_PATTERN = r'(https?://|www\.|discord\.(gg|io|me|li)|discordapp\.com/invite)'
-DISCORD_INVITE_PATTERN = r'(discord\.(gg|io|me|li)|discordapp\.com/invite|discord\.com/invite)'
+# Link / Invite (ContentScanner รวมทุก rule เป็น regex เดียว)
+INVITE_LINKS = ("discord.gg", "discord.io", "discord.me", "discord.li", "discordapp.com/invite", "discord.com/invite")
+URL_PREFIXES = ("http://", "https://", "www.", "discord.gg", "discord.io", "discord.me", "discord.li", "discordapp.com/invite")
 
 # Colors
 COLOR_SUCCESS = 0x00ff00
@@ -51,98 +92,2125 @@ app = Flask('')
 def home():
     return "<h1>🛡️ PDR Security is Running...</h1>"
 
-def run_web_server():
-    # Render จะส่ง PORT มาให้ หรือใช้ 8080
-    port = int(os.environ.get('PORT', 8080))
+def run_web_server(port=None):
+    # Render จะส่ง PORT มาให้ หรือใช้ 8080 (worker ของ cluster ใช้ PORT + 1 + CLUSTER_ID สำหรับ /metrics)
+    port = port or int(os.environ.get('PORT', 8080))
     app.run(host='0.0.0.0', port=port)
 
-def keep_alive():
-    t = threading.Thread(target=run_web_server)
+def keep_alive(port=None):
+    # ใน cluster เป็น daemon -> supervisor / worker ปิดตัวได้โดยไม่ค้างที่ Flask
+    t = threading.Thread(target=run_web_server, args=(port,), daemon=CLUSTER_WORKERS > 1 or CLUSTER_ID >= 0)
     t.start()
 
+# ==========================================
+# 📈 METRICS (Prometheus)
+# ==========================================
+# series ที่ label ตายตัวผูก child ไว้ล่วงหน้า (metrics.counter / histogram) -> ตอนบันทึกไม่ต้องสร้าง tuple / หา key ใน dict
+# ปิด/เปิดได้ตอนรัน (/metrics_toggle หรือ METRICS=0) -> ตอนปิดเหลือแค่เช็ค flag ตัวเดียว
+METRIC_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+METRIC_LABELS = {
+    "pdr_detections_total": ("module",),
+    "pdr_actions_total": ("module", "action", "status"),
+    "pdr_handler_seconds": ("handler",),
+    "pdr_module_seconds": ("module",),
+}
+
+def label_str(names, values):
+    return ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in zip(names, values))
+
+class Counter:
+    __slots__ = ("metrics", "value")
+
+    def __init__(self, metrics):
+        self.metrics, self.value = metrics, 0
+
+    def inc(self, n=1):
+        if self.metrics.enabled: self.value += n
+
+class Histogram:
+    __slots__ = ("metrics", "counts", "sum")
+
+    def __init__(self, metrics):
+        self.metrics, self.counts, self.sum = metrics, [0] * (len(METRIC_BUCKETS) + 1), 0.0
+
+    def observe(self, seconds):
+        if self.metrics.enabled:
+            self.counts[bisect_left(METRIC_BUCKETS, seconds)] += 1
+            self.sum += seconds
+
+class Metrics:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.counters = {}  # (name, labels) -> Counter
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.gauges = {}  # name -> fn() อ่านค่าตอน scrape
+
+    def counter(self, name, labels):
+        c = self.counters.get((name, labels))
+        if c is None: c = self.counters[(name, labels)] = Counter(self)
+        return c
+
+    def histogram(self, name, labels):
+        h = self.histograms.get((name, labels))
+        if h is None: h = self.histograms[(name, labels)] = Histogram(self)
+        return h
+
+    def inc(self, name, labels, n=1):
+        # label เปลี่ยนตามผล (เช่น action/status) -> หา child ทุกครั้ง
+        if self.enabled: self.counter(name, labels).value += n
+
+    def observe(self, name, labels, seconds):
+        self.histogram(name, labels).observe(seconds)
+
+    def timed(self, name, label):
+        # ผูก histogram + bucket + clock เป็นตัวแปร local ตั้งแต่ตอน wrap -> ตอนบันทึกไม่มี lookup เลย
+        h, clock, buckets, bucket = self.histogram(name, (label,)), time.perf_counter, METRIC_BUCKETS, bisect_left
+        counts = h.counts
+        def wrap(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                if not self.enabled: return await fn(*args, **kwargs)
+                start = clock()
+                try: return await fn(*args, **kwargs)
+                finally:
+                    elapsed = clock() - start
+                    counts[bucket(buckets, elapsed)] += 1
+                    h.sum += elapsed
+            return wrapper
+        return wrap
+
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def render(self):
+        # เรียกจาก thread ของ Flask -> copy ก่อนวน (list(dict.items()) ไม่ปล่อย GIL ระหว่างทาง)
+        lines, typed = [], set()
+        for (name, labels), c in sorted(list(self.counters.items()), key=lambda item: item[0]):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{{{label_str(METRIC_LABELS[name], labels)}}} {c.value}")
+        for (name, labels), h in sorted(list(self.histograms.items()), key=lambda item: item[0]):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            counts, base, total = list(h.counts), label_str(METRIC_LABELS[name], labels), 0
+            for le, n in zip(METRIC_BUCKETS + ("+Inf",), counts):
+                total += n
+                lines.append(f'{name}_bucket{{{base},le="{le}"}} {total}')
+            lines.append(f"{name}_sum{{{base}}} {h.sum}")
+            lines.append(f"{name}_count{{{base}}} {total}")
+        for name, fn in list(self.gauges.items()):
+            try: value = fn()
+            except Exception: continue
+            if not math.isfinite(value): continue
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics(enabled=os.getenv("METRICS", "1") != "0")
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
 # ==========================================
 # 🗄️ DATABASE MANAGER (SQLite)
 # ==========================================
+# งานเขียนทั้งหมดวิ่งบน writer thread ตัวเดียว (รวมหลายคำสั่งเป็น transaction เดียว)
+# งานอ่านวิ่งบน thread pool (แต่ละ thread มี connection ของตัวเอง) -> event loop ไม่ต้องรอ disk
+DB_BATCH_MAX = 500       # คำสั่งต่อ 1 transaction
+DB_BATCH_WINDOW = 0.005  # รอรวม batch (วินาที)
+DB_READERS = 4
+DB_VACUUM_PAGES = 2048   # compact() คืนพื้นที่ทีละกี่หน้า ต่อหนึ่งรอบบน writer (write อื่นแทรกระหว่างรอบได้)
+
 class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self.local = threading.local()
+        self.conn = self.connect()
         self.cursor = self.conn.cursor()
         self.create_tables()
+        if CLUSTER_ID < 0: self.convert_auto_vacuum()  # ใน cluster ให้ supervisor ทำก่อนแตก worker
+
+        self.queue = queue.SimpleQueue()
+        self.writer = threading.Thread(target=self.writer_loop, name="db-writer", daemon=True)
+        self.writer.start()
+        self.read_pool = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix="db-read")
+        self.closed = False
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        # มีผลเฉพาะไฟล์ใหม่ และต้องมาก่อน WAL -> compact() คืนพื้นที่หลังลบ incident เก่าได้ (ไฟล์เก่าดู convert_auto_vacuum)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA busy_timeout=10000")
+        return conn
 
     def create_tables(self):
         self.cursor.execute("CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT)")
-        self.cursor.execute("CREATE TABLE IF NOT EXISTS whitelist (id INTEGER PRIMARY KEY, type TEXT)")
-        self.cursor.execute("CREATE TABLE IF NOT EXISTS backups (guild_id INTEGER, data TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)")
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS guild_config (guild_id INTEGER PRIMARY KEY, value TEXT)")
+        self.migrate_config()
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS whitelist (guild_id INTEGER, id INTEGER, type TEXT, PRIMARY KEY (guild_id, id))")
+        self.migrate_whitelist()
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS snapshots (id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, hash TEXT, base_id INTEGER, data BLOB, created_at REAL)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_snapshots_guild ON snapshots (guild_id, id)")
+        self.migrate_backups()
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS role_snapshots (guild_id INTEGER, role_id INTEGER, hash TEXT, data TEXT, members BLOB, updated_at REAL, PRIMARY KEY (guild_id, role_id))")
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS lockdown_state (guild_id INTEGER, channel_id INTEGER, kind TEXT, allow INTEGER, deny INTEGER, existed INTEGER, PRIMARY KEY (guild_id, channel_id))")
+        # incident journal: append-only, id ไล่ตามเวลาที่เขียน -> ใช้เป็น cursor ของการแบ่งหน้า
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS incidents (id INTEGER PRIMARY KEY, guild_id INTEGER, created_at REAL, module TEXT, actor_id INTEGER, target_id INTEGER, action TEXT, result TEXT, detail TEXT)")
+        # rowid (id) ต่อท้ายทุก index อยู่แล้ว -> "guild นี้ ใหม่สุดก่อน" ไล่ index ได้เลยไม่ต้อง sort
+        # index ยิ่งเยอะ insert ยิ่งช้า: module กรองบน idx guild พอ (ไม่กี่ค่า), actor มีแค่ event nuke -> partial index
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_incidents_guild ON incidents (guild_id)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_incidents_target ON incidents (guild_id, target_id)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_incidents_actor ON incidents (guild_id, actor_id) WHERE actor_id IS NOT NULL")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_incidents_time ON incidents (created_at)")
+        # change feed ของ cluster: worker ที่แก้ข้อมูลเขียนแถวลงที่นี่ -> worker อื่น poll แล้วล้าง cache
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS changes (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, guild_id INTEGER, origin INTEGER, created_at REAL)")
         self.conn.commit()
 
-    def get_config(self, default):
-        self.cursor.execute("SELECT value FROM config WHERE key='main_config'")
-        res = self.cursor.fetchone()
-        if not res: return default
-        
-        # Merge Config (ป้องกัน Key หาย)
-        data = json.loads(res[0])
-        for k, v in default.items():
-            if k not in data: data[k] = v
-        for k, v in default["modules"].items():
-            if k not in data["modules"]: data["modules"][k] = v
-        return data
-
-    def save_config(self, data):
-        self.cursor.execute("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", ('main_config', json.dumps(data)))
-        self.conn.commit()
+    def convert_auto_vacuum(self):
+        # ไฟล์ที่สร้างก่อนเปิด auto_vacuum (ค่า 0) -> incremental_vacuum ไม่มีผล ต้อง VACUUM แปลงครั้งเดียว
+        # ทำตอนเปิดไฟล์ ก่อน writer เริ่ม -> ไม่มีใครถือ write lock แข่ง (ไฟล์ใหญ่ = บูตช้าลงครั้งเดียว)
+        if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 0: return
+        print("🗜️ Converting database to auto_vacuum=INCREMENTAL (one-time VACUUM)")
+        self.conn.executescript("PRAGMA auto_vacuum=INCREMENTAL; VACUUM;")
+
+    # ---------- Writer (thread เดียว) ----------
+    def writer_loop(self):
+        self.conn.isolation_level = None  # จัดการ BEGIN/COMMIT เอง
+        cur = self.conn.cursor()
+        while True:
+            job = self.queue.get()
+            if job is None: break
+            if job[0] is None:  # งาน compact ไม่รวม batch
+                self.compact_step(cur, job[3])
+                continue
+            # คนรอถูก cancel (wrap_future cancel ต่อมาถึง Future นี้) -> ข้าม; ที่เหลือล็อกเป็น RUNNING แล้ว cancel ไม่ได้อีก
+            batch = [job] if job[3].set_running_or_notify_cancel() else []
+            deadline = time.monotonic() + DB_BATCH_WINDOW
+            while len(batch) < DB_BATCH_MAX:
+                try: job = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty: break
+                if job is None or job[0] is None:
+                    self.queue.put(job)  # sentinel / compact รอรอบหน้า
+                    break
+                if job[3].set_running_or_notify_cancel(): batch.append(job)
+            if not batch: continue
+
+            results = []
+            try:
+                cur.execute("BEGIN")
+                for sql, params, many, fut in batch:
+                    try:
+                        if many: cur.executemany(sql, params)
+                        else: cur.execute(sql, params)
+                        results.append((fut, cur.lastrowid if sql.startswith("INSERT") else cur.rowcount, None))
+                    except sqlite3.Error as e:
+                        results.append((fut, None, e))
+                cur.execute("COMMIT")
+            except sqlite3.Error as e:
+                if self.conn.in_transaction: self.conn.rollback()
+                results = [(fut, None, e) for *_, fut in batch]
+
+            for fut, res, err in results:
+                if err is not None: fut.set_exception(err)
+                else: fut.set_result(res)
+        # ที่ค้างหลัง sentinel (compact ที่วนกลับเข้าคิว) -> ไม่ให้ใครรอค้าง
+        while True:
+            try: job = self.queue.get_nowait()
+            except queue.Empty: break
+            if job is not None and not job[3].done(): job[3].set_exception(sqlite3.ProgrammingError("Database is closed"))
+        self.conn.close()
+
+    def write(self, sql, params=(), many=False):
+        # คืน concurrent Future (ใช้นอก event loop ได้ด้วย .result())
+        fut = Future()
+        if self.closed: fut.set_exception(sqlite3.ProgrammingError("Database is closed"))
+        else: self.queue.put((sql, params, many, fut))
+        return fut
+
+    async def execute(self, sql, params=(), many=False):
+        return await asyncio.wrap_future(self.write(sql, params, many))
+
+    # ---------- Reader (thread pool) ----------
+    def query(self, sql, params=(), one=False):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = self.connect()
+            conn.execute("PRAGMA query_only=1")
+        cur = conn.execute(sql, params)
+        return cur.fetchone() if one else cur.fetchall()
+
+    async def fetch(self, sql, params=(), one=False):
+        return await asyncio.get_running_loop().run_in_executor(self.read_pool, self.query, sql, params, one)
+
+    def close(self):
+        if self.closed: return
+        self.closed = True
+        self.queue.put(None)
+        self.writer.join()  # รอเขียนที่ค้างในคิวให้หมดก่อน
+        self.read_pool.shutdown(wait=True)
+
+    # ---------- Config (ต่อ guild) ----------
+    def migrate_config(self):
+        # config เก่าเป็นก้อนเดียวทั้งบอท -> ย้ายไปเป็นแม่แบบ guild_id = 0 (ใช้กับเซิร์ฟที่ยังไม่เคยตั้งค่า)
+        res = self.cursor.execute("SELECT value FROM config WHERE key='main_config'").fetchone()
+        if not res: return
+        self.cursor.execute("INSERT OR IGNORE INTO guild_config (guild_id, value) VALUES (0, ?)", (res[0],))
+        self.cursor.execute("DELETE FROM config WHERE key='main_config'")
+
+    async def get_setting(self, key):
+        res = await self.fetch("SELECT value FROM config WHERE key=?", (key,), one=True)
+        return res[0] if res else None
+
+    async def set_setting(self, key, value):
+        await self.execute("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", (key, value))
 
-    def manage_whitelist(self, tid, ttype, action):
+    async def get_guild_configs(self, guild_ids):
+        # {guild_id: json} รวมแม่แบบ (0) -> ทีละ 900 id (ต่ำกว่า limit ของ parameter)
+        ids, rows = [0, *guild_ids], {}
+        for i in range(0, len(ids), 900):
+            chunk = ids[i:i + 900]
+            rows.update(await self.fetch(f"SELECT guild_id, value FROM guild_config WHERE guild_id IN ({','.join('?' * len(chunk))})", chunk))
+        return rows
+
+    async def get_guild_config(self, guild_id):
+        res = await self.fetch("SELECT value FROM guild_config WHERE guild_id IN (?, 0) ORDER BY guild_id DESC LIMIT 1", (guild_id,), one=True)
+        return json.loads(res[0]) if res else None
+
+    async def save_guild_config(self, guild_id, data):
+        await self.execute("INSERT OR REPLACE INTO guild_config (guild_id, value) VALUES (?, ?)", (guild_id, json.dumps(data)))
+        await self.notify("config", guild_id)
+
+    # ---------- Incident journal ----------
+    def append_incidents(self, rows):
+        return self.write("INSERT INTO incidents (guild_id, created_at, module, actor_id, target_id, action, result, detail) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows, many=True)
+
+    async def incident_id_at(self, ts, after=False):
+        # เวลา -> id แรกที่ created_at >= ts (> ts ถ้า after) ผ่าน index เวลา O(log n)
+        res = await self.fetch(f"SELECT id FROM incidents WHERE created_at {'>' if after else '>='} ? ORDER BY created_at LIMIT 1", (ts,), one=True)
+        return res[0] if res else None
+
+    async def incidents(self, guild_id, user_id=None, module=None, since=None, until=None, before_id=None, limit=10):
+        # ใหม่ -> เก่า, cursor = id ตัวสุดท้ายของหน้าก่อน; ช่วงเวลาแปลงเป็นช่วง id ก่อน
+        where, params = ["guild_id=?"], [guild_id]
+        if module: where, params = where + ["module=?"], params + [module]
+        if before_id: where, params = where + ["id<?"], params + [before_id]
+        if until is not None:
+            hi = await self.incident_id_at(until, after=True)
+            if hi is not None: where, params = where + ["id<?"], params + [hi]
+        if since is not None:
+            lo = await self.incident_id_at(since)
+            if lo is None: return []
+            where, params = where + ["id>=?"], params + [lo]
+        sql = f"SELECT id, created_at, module, actor_id, target_id, action, result, detail FROM incidents WHERE {{}}{' AND '.join(where)} ORDER BY id DESC LIMIT ?"
+        if user_id is None: return await self.fetch(sql.format(""), (*params, limit))
+        # คนที่ทำ หรือโดน -> index ละ query แล้วรวม (OR ตรงๆ ทำให้ไล่ทั้ง guild)
+        rows = {}
+        for col in ("target_id", "actor_id"):
+            for row in await self.fetch(sql.format(f"{col}=? AND "), (user_id, *params, limit)): rows[row[0]] = row
+        return sorted(rows.values(), reverse=True)[:limit]
+
+    def compact(self):
+        # คืนพื้นที่หลังลบ + อัปเดตสถิติ -> เข้าคิว writer (connection อื่นจะถือ write lock นานจน COMMIT ของ batch ล้ม)
+        fut = Future()
+        fut.set_running_or_notify_cancel()  # วนกลับเข้าคิวหลายรอบ -> ห้าม cancel กลางทาง
+        if self.closed: fut.set_exception(sqlite3.ProgrammingError("Database is closed"))
+        else: self.queue.put((None, (), False, fut))
+        return fut
+
+    def compact_step(self, cur, fut):
+        # รอบละ DB_VACUUM_PAGES หน้า (fetchall = ทำจนครบ, step เดียวได้แค่หน้าเดียว) แล้วต่อท้ายคิวให้ batch อื่นได้เขียน
+        try:
+            cur.execute(f"PRAGMA incremental_vacuum({DB_VACUUM_PAGES})").fetchall()
+            if cur.execute("PRAGMA freelist_count").fetchone()[0] and not self.closed:
+                self.queue.put((None, (), False, fut))
+                return
+            cur.execute("PRAGMA optimize")
+            fut.set_result(True)
+        except sqlite3.Error as e: fut.set_exception(e)
+
+    # ---------- Change feed (cluster) ----------
+    async def notify(self, kind, guild_id):
+        # โปรเซสเดียวไม่มีใครต้องรู้ -> ไม่เขียน
+        if CLUSTER_ID < 0: return
+        await self.execute("INSERT INTO changes (kind, guild_id, origin, created_at) VALUES (?, ?, ?, ?)", (kind, guild_id, CLUSTER_ID, time.time()))
+
+    async def changes_since(self, last_id):
+        return await self.fetch("SELECT id, kind, guild_id, origin FROM changes WHERE id > ? ORDER BY id", (last_id,))
+
+    def last_change_id(self):
+        return self.query("SELECT COALESCE(MAX(id), 0) FROM changes", one=True)[0]
+
+    # ---------- Whitelist ----------
+    def migrate_whitelist(self):
+        # ตารางเก่าไม่มี guild_id -> ย้ายไปเป็น global (guild_id = 0)
+        cols = [row[1] for row in self.cursor.execute("PRAGMA table_info(whitelist)")]
+        if "guild_id" in cols: return
+        self.cursor.execute("ALTER TABLE whitelist RENAME TO whitelist_old")
+        self.cursor.execute("CREATE TABLE whitelist (guild_id INTEGER, id INTEGER, type TEXT, PRIMARY KEY (guild_id, id))")
+        self.cursor.execute("INSERT INTO whitelist (guild_id, id, type) SELECT 0, id, type FROM whitelist_old")
+        self.cursor.execute("DROP TABLE whitelist_old")
+
+    async def manage_whitelist(self, guild_id, tid, ttype, action):
         if action == "add":
             try:
-                self.cursor.execute("INSERT INTO whitelist (id, type) VALUES (?, ?)", (tid, ttype))
-                self.conn.commit()
+                await self.execute("INSERT INTO whitelist (guild_id, id, type) VALUES (?, ?, ?)", (guild_id, tid, ttype))
+                await self.notify("whitelist", guild_id)
                 return True
-            except: return False
+            except sqlite3.Error: return False
         elif action == "remove":
-            self.cursor.execute("DELETE FROM whitelist WHERE id=?", (tid,))
-            self.conn.commit()
-            return True
+            # ไม่มีในเซิร์ฟนี้ -> ลองแถว global (0) ที่ย้ายมาจาก whitelist เดิม; คืน guild_id ที่ลบได้ (None = ไม่เจอ)
+            for scope in (guild_id, 0):
+                if await self.execute("DELETE FROM whitelist WHERE guild_id=? AND id=?", (scope, tid)) > 0:
+                    await self.notify("whitelist", scope)
+                    return scope
+            return None
         elif action == "list":
-            self.cursor.execute("SELECT id, type FROM whitelist")
-            return self.cursor.fetchall()
+            return await self.fetch("SELECT guild_id, id, type FROM whitelist WHERE guild_id IN (0, ?) ORDER BY guild_id DESC", (guild_id,))
 
-    def backup_guild(self, guild_id, data):
-        self.cursor.execute("INSERT INTO backups (guild_id, data) VALUES (?, ?)", (guild_id, json.dumps(data)))
-        self.conn.commit()
+    def load_whitelist(self):
+        return self.query("SELECT guild_id, id, type FROM whitelist")
 
-    def get_backup(self, guild_id):
-        self.cursor.execute("SELECT data FROM backups WHERE guild_id=? ORDER BY timestamp DESC LIMIT 1", (guild_id,))
-        res = self.cursor.fetchone()
-        return json.loads(res[0]) if res else None
+    async def guild_whitelist(self, guild_id):
+        return await self.fetch("SELECT id, type FROM whitelist WHERE guild_id=?", (guild_id,))
+
+    # ---------- Backup (Snapshots) ----------
+    def migrate_backups(self):
+        # backups แบบเก่า (JSON เต็มทุกครั้ง ไม่เคยลบ) -> อันล่าสุดของแต่ละ guild เป็น snapshot เต็ม
+        # ลบตารางเก่าเมื่อแปลงครบทุก guild เท่านั้น, มีอันพัง -> เก็บไว้เป็น backups_legacy (ทำใน transaction เดียว)
+        if not self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='backups'").fetchone(): return
+        latest, failed = {}, set()
+        for guild_id, data, stamp in self.cursor.execute("SELECT guild_id, data, timestamp FROM backups ORDER BY guild_id, timestamp, rowid"):
+            try: roles = json.loads(data)["roles"]
+            except (TypeError, ValueError, KeyError):
+                failed.add(guild_id)
+                continue
+            latest[guild_id] = (roles, stamp)
+        failed -= latest.keys()  # พังแค่บางอัน แต่มีอันที่อ่านได้ -> ใช้อันนั้น
+        has_snapshots = {row[0] for row in self.cursor.execute("SELECT DISTINCT guild_id FROM snapshots")}
+
+        converted = 0
+        try:
+            for guild_id, (roles, stamp) in latest.items():
+                if guild_id in has_snapshots: continue
+                # แบบเก่าไม่มี role id -> key ตามลำดับ (ใช้เป็นข้อมูลกู้เท่านั้น, backup ถัดไปเป็น delta/เต็มตามปกติ)
+                state = {"roles": {f"legacy-{i}": {**role, "position": None} for i, role in enumerate(roles)}, "channels": {}}
+                raw = json.dumps(state, sort_keys=True, separators=(",", ":")).encode()
+                try: created = datetime.datetime.strptime(stamp, "%Y-%m-%d %H:%M:%S").replace(tzinfo=datetime.timezone.utc).timestamp()
+                except (TypeError, ValueError): created = time.time()
+                self.cursor.execute("INSERT INTO snapshots (guild_id, hash, base_id, data, created_at) VALUES (?, ?, NULL, ?, ?)",
+                                    (guild_id, hashlib.sha256(raw).hexdigest(), zlib.compress(raw, 6), created))
+                converted += 1
+            if failed: self.cursor.execute("ALTER TABLE backups RENAME TO backups_legacy")
+            else: self.cursor.execute("DROP TABLE backups")
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            print(f"⚠️ Backup migration failed, legacy table kept: {e}")
+            return
+        print(f"💾 Migrated {converted} legacy backups to snapshots" + (f" ({len(failed)} unreadable, kept in backups_legacy)" if failed else ""))
+
+    # base_id = NULL คือ snapshot เต็ม, ไม่ NULL คือ delta ต่อจาก snapshot ก่อนหน้าของ guild เดียวกัน
+    async def add_snapshot(self, guild_id, digest, base_id, blob):
+        snapshot_id = await self.execute("INSERT INTO snapshots (guild_id, hash, base_id, data, created_at) VALUES (?, ?, ?, ?, ?)", (guild_id, digest, base_id, blob, time.time()))
+        await self.notify("backup", guild_id)
+        return snapshot_id
+
+    async def legacy_roles(self, guild_id):
+        # snapshot ที่แปลงมาจาก backups แบบเก่า (key legacy-N, ไม่มี role id) = snapshot เต็มอันแรกของ guild จนกว่าจะโดน prune
+        res = await self.fetch("SELECT data FROM snapshots WHERE guild_id=? AND base_id IS NULL ORDER BY id LIMIT 1", (guild_id,), one=True)
+        roles = unpack(res[0])["roles"] if res else {}
+        return {k: v for k, v in roles.items() if k.startswith("legacy-")}
+
+    async def latest_snapshot(self, guild_id):
+        return await self.fetch("SELECT id, hash FROM snapshots WHERE guild_id=? ORDER BY id DESC LIMIT 1", (guild_id,), one=True)
+
+    async def snapshot_chain(self, guild_id, upto_id):
+        # snapshot เต็มตัวล่าสุด (<= upto_id) + delta ทั้งหมดหลังจากนั้น
+        return await self.fetch(
+            "SELECT id, base_id, data FROM snapshots WHERE guild_id=? AND id<=? AND id>=(SELECT MAX(id) FROM snapshots WHERE guild_id=? AND base_id IS NULL AND id<=?) ORDER BY id",
+            (guild_id, upto_id, guild_id, upto_id))
+
+    async def snapshot_index(self, guild_id):
+        return await self.fetch("SELECT id, base_id, created_at, length(data) FROM snapshots WHERE guild_id=? ORDER BY id DESC", (guild_id,))
+
+    # ---------- Role Index (role_id -> ข้อมูลยศ + สมาชิก) ----------
+    async def role_snapshot_hashes(self, guild_id):
+        return dict(await self.fetch("SELECT role_id, hash FROM role_snapshots WHERE guild_id=?", (guild_id,)))
+
+    async def upsert_role_snapshots(self, rows):
+        await self.execute("INSERT OR REPLACE INTO role_snapshots (guild_id, role_id, hash, data, members, updated_at) VALUES (?, ?, ?, ?, ?, ?)", rows, many=True)
+
+    async def get_role_snapshots(self, guild_id, role_ids=None):
+        if role_ids is None:
+            return await self.fetch("SELECT role_id, data, members FROM role_snapshots WHERE guild_id=?", (guild_id,))
+        role_ids = list(role_ids)
+        marks = ",".join("?" * len(role_ids))
+        return await self.fetch(f"SELECT role_id, data, members FROM role_snapshots WHERE guild_id=? AND role_id IN ({marks})", (guild_id, *role_ids))
+
+    async def delete_role_snapshots(self, guild_id, role_ids):
+        await self.execute("DELETE FROM role_snapshots WHERE guild_id=? AND role_id=?", [(guild_id, rid) for rid in role_ids], many=True)
+
+    # ---------- Lockdown (สถานะก่อนล็อก) ----------
+    async def save_lockdown(self, rows):
+        # OR IGNORE: สั่ง lockdown ซ้ำต้องไม่ทับสถานะเดิมก่อนล็อกครั้งแรก
+        await self.execute("INSERT OR IGNORE INTO lockdown_state (guild_id, channel_id, kind, allow, deny, existed) VALUES (?, ?, ?, ?, ?, ?)", rows, many=True)
+
+    async def get_lockdown(self, guild_id):
+        return await self.fetch("SELECT channel_id, kind, allow, deny, existed FROM lockdown_state WHERE guild_id=?", (guild_id,))
+
+    async def clear_lockdown(self, guild_id, channel_ids):
+        await self.execute("DELETE FROM lockdown_state WHERE guild_id=? AND channel_id=?", [(guild_id, cid) for cid in channel_ids], many=True)
 
 db = Database()
+atexit.register(db.close)
+
+# ==========================================
+# 📋 WHITELIST INDEX (In-Memory)
+# ==========================================
+# guild_id = 0 คือ whitelist แบบ global (ใช้ได้ทุกเซิร์ฟ)
+class WhitelistIndex:
+    def __init__(self):
+        self.users = {}  # guild_id -> {user_id}
+        self.roles = {}  # guild_id -> {role_id}
+
+    def load(self, rows):
+        self.users.clear()
+        self.roles.clear()
+        for guild_id, tid, ttype in rows: self.add(guild_id, tid, ttype)
+
+    def load_guild(self, guild_id, rows):
+        self.users.pop(guild_id, None)
+        self.roles.pop(guild_id, None)
+        for tid, ttype in rows: self.add(guild_id, tid, ttype)
+
+    def add(self, guild_id, tid, ttype):
+        bucket = self.roles if ttype == "role" else self.users
+        bucket.setdefault(guild_id, set()).add(tid)
+
+    def remove(self, guild_id, tid):
+        for bucket in (self.users, self.roles):
+            ids = bucket.get(guild_id)
+            if ids is None: continue
+            ids.discard(tid)
+            if not ids: del bucket[guild_id]
+
+    def has_roles(self, guild_id):
+        return bool(self.roles.get(guild_id) or self.roles.get(0))
+
+    def contains(self, guild_id, member):
+        users = self.users
+        if member.id in users.get(guild_id, ()) or member.id in users.get(0, ()): return True
+
+        guild_roles, global_roles = self.roles.get(guild_id), self.roles.get(0)
+        if not guild_roles and not global_roles: return False
+        # member._roles คือ role id ดิบ (member.roles ต้องสร้าง list + sort ใหม่ทุกครั้ง)
+        role_ids = getattr(member, "_roles", None)
+        if role_ids is None: role_ids = (r.id for r in getattr(member, "roles", ()))
+        for rid in role_ids:
+            if (guild_roles and rid in guild_roles) or (global_roles and rid in global_roles): return True
+        return False
+
+whitelist = WhitelistIndex()
+whitelist.load(db.load_whitelist())
 
 # Default Configuration
 default_conf = {
     "modules": {
-        "anti_spam": {"enable": True, "action": "timeout"},
-        "anti_nuke": {"enable": True, "action": "ban"},
+        "anti_spam": {"enable": True, "action": "timeout", "threshold": SPAM_THRESHOLD, "window": SPAM_TIME},
+        "anti_nuke": {"enable": True, "action": "ban", "threshold": NUKE_THRESHOLD, "window": NUKE_TIME, "weights": NUKE_WEIGHTS},
         "anti_bot": {"enable": True, "action": "kick"},
         "anti_role": {"enable": True, "action": "ban"},
         "anti_invite": {"enable": True, "action": "kick"},
         "anti_mention": {"enable": True, "action": "timeout"},
         "anti_link": {"enable": True, "action": "kick"},
-        "anti_webhook": {"enable": True, "action": "ban"}
+        "anti_webhook": {"enable": True, "action": "ban"},
+        "anti_word": {"enable": True, "action": "timeout"},
+        "anti_raid": {"enable": True, "action": "kick", "threshold": RAID_THRESHOLD, "window": RAID_TIME, "lockdown": False},
+        "anti_flood": {"enable": False, "action": "ban", "threshold": FLOOD_THRESHOLD, "window": FLOOD_TIME, "channel_threshold": FLOOD_CHANNEL_THRESHOLD}
     },
-    "log_channel": None
+    "log_channel": None,
+    "backup": {"keep": 20, "max_age_days": 30},
+    "banned_words": [],
+    "blocked_domains": []
+}
+
+# series ของ pdr_detections_total ผูกไว้ล่วงหน้าทุก module (โผล่เป็น 0 ตั้งแต่บูต, บันทึก = บวกเลขตัวเดียว)
+detected = {module: metrics.counter("pdr_detections_total", (module,)) for module in default_conf["modules"]}
+
+# ==========================================
+# 🔍 CONTENT SCANNER (Single-Pass Regex)
+# ==========================================
+# ทุก rule เป็นชุดคำ (literal) -> รวมเป็น trie regex เดียว สแกนข้อความแค่รอบเดียว ได้ทุก rule ที่เจอ
+BOUNDED_RULES = {"blocked_domain"}  # ต้องไม่ติดกับตัวอักษรอื่น (notevil.com != evil.com)
+
+class ContentScanner:
+    def __init__(self, config):
+        mods = config["modules"]
+        message_rules = {}
+        if mods["anti_invite"]["enable"]:
+            message_rules["anti_invite"] = INVITE_LINKS
+        if mods["anti_word"]["enable"]:
+            message_rules["blocked_domain"] = config["blocked_domains"]
+            message_rules["banned_word"] = config["banned_words"]
+        name_rules = {"anti_link": URL_PREFIXES} if mods["anti_link"]["enable"] else {}
+
+        self.message_regex, self.message_lookup, self.message_rules = self.compile(message_rules)
+        self.name_regex, self.name_lookup, self.name_rules = self.compile(name_rules)
+
+    @staticmethod
+    def trie_pattern(words):
+        # prefix เดียวกันเช็คครั้งเดียว + ตัวอักษรแรกเป็น charset ให้ re ข้ามตำแหน่งที่ไม่เกี่ยวได้เร็ว
+        trie = {}
+        for word in words:
+            node = trie
+            for ch in word: node = node.setdefault(ch, {})
+            node[""] = {}
+
+        def build(node):
+            branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+            if not branches: return ""
+            body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+            return f"(?:{body})?" if "" in node else body
+        return build(trie)
+
+    @classmethod
+    def compile(cls, rules):
+        lookup = {}  # literal -> (rule, ...)
+        for rule, literals in rules.items():
+            for literal in literals:
+                literal = literal.strip().lower()
+                if literal: lookup[literal] = lookup.get(literal, ()) + (rule,)
+        if not lookup: return None, lookup, 0
+        total = len({rule for found in lookup.values() for rule in found})
+        return re.compile(cls.trie_pattern(lookup)), lookup, total
+
+    @staticmethod
+    def scan(regex, lookup, total, text):
+        found = set()
+        if regex is None or not text: return found
+        text = text.lower()
+        for match in regex.finditer(text):
+            start, end = match.span()
+            while end is not None:
+                rejected = False
+                for rule in lookup[text[start:end]]:
+                    if rule in BOUNDED_RULES and not ContentScanner.bounded(text, start, end): rejected = True
+                    else: found.add(rule)
+                if not rejected: break
+                # ขอบไม่ผ่าน -> ลองคำที่สั้นกว่าบนเส้นทางเดียวกันของ trie (evil.company: evil.com ไม่ผ่าน แต่ evil ยังนับ)
+                end = next((k for k in range(end - 1, start, -1) if text[start:k] in lookup), None)
+            if len(found) == total: break  # เจอครบทุก rule แล้ว ไม่ต้องสแกนต่อ
+        return found
+
+    @staticmethod
+    def bounded(text, start, end):
+        if start > 0 and (text[start - 1].isalnum() or text[start - 1] in "_-"): return False
+        return end >= len(text) or not (text[end].isalnum() or text[end] in "_-")
+
+    def scan_message(self, text):
+        return self.scan(self.message_regex, self.message_lookup, self.message_rules, text)
+
+    def scan_name(self, text):
+        return self.scan(self.name_regex, self.name_lookup, self.name_rules, text)
+
+# ==========================================
+# ⚙️ GUILD CONFIG STORE (Per-Guild + LRU Cache)
+# ==========================================
+# default_conf คือ schema: key ที่หาย หรือชนิดข้อมูลไม่ตรง -> ใช้ค่า default แทน
+CONFIG_CACHE_SIZE = 1_000
+
+def _type_ok(value, default):
+    if default is None: return True
+    if isinstance(default, bool): return isinstance(value, bool)
+    if isinstance(default, (int, float)): return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, type(default))
+
+def merge_config(data, default):
+    if not isinstance(data, dict): return copy.deepcopy(default)
+    for k, v in default.items():
+        if isinstance(v, dict): data[k] = merge_config(data.get(k), v)
+        elif k not in data or not _type_ok(data[k], v): data[k] = copy.deepcopy(v)
+    return data
+
+# โหลดจาก DB ครั้งแรกที่ guild มี event แล้วเก็บไว้ในแรม -> event ต่อๆ ไปไม่แตะ disk เลย
+class ConfigStore:
+    def __init__(self, default, max_guilds=CONFIG_CACHE_SIZE):
+        self.default = default
+        self.max_guilds = max_guilds
+        self.cache = OrderedDict()  # guild_id -> [config, ContentScanner | None]
+        self.loading = {}  # guild_id -> Task (กันโหลดซ้ำตอน event มาพร้อมกัน)
+
+    def __len__(self):
+        return len(self.cache)
+
+    async def get(self, guild_id):
+        entry = self.cache.get(guild_id)
+        if entry is None: entry = await self.load(guild_id)
+        else: self.cache.move_to_end(guild_id)
+        return entry[0]
+
+    def scanner(self, guild_id):
+        # เรียกหลัง get() เสมอ (ไม่มี await คั่น -> entry ยังอยู่ใน cache)
+        entry = self.cache[guild_id]
+        if entry[1] is None: entry[1] = ContentScanner(entry[0])
+        return entry[1]
+
+    async def load(self, guild_id):
+        task = self.loading.get(guild_id)
+        if task is None:
+            task = self.loading[guild_id] = asyncio.ensure_future(db.get_guild_config(guild_id))
+            task.add_done_callback(lambda _: self.loading.pop(guild_id, None))
+        data = await task
+        return self.cache.get(guild_id) or self.put(guild_id, merge_config(data, self.default))
+
+    async def preload(self, guild_ids):
+        # ตอนบูต: config ทุกเซิร์ฟด้วย query ชุดเดียว -> event แรกของแต่ละเซิร์ฟไม่ต้องรอ DB
+        missing = [g for g in guild_ids if g not in self.cache][:self.max_guilds]
+        if not missing: return 0
+        rows = await db.get_guild_configs(missing)
+        template = rows.get(0)
+        for guild_id in missing:
+            if guild_id in self.cache: continue  # event โหลด/บันทึกไปแล้วระหว่างรอ
+            value = rows.get(guild_id, template)
+            self.put(guild_id, merge_config(json.loads(value) if value else None, self.default))
+        return len(missing)
+
+    def put(self, guild_id, config):
+        entry = self.cache[guild_id] = [config, None]
+        self.cache.move_to_end(guild_id)
+        while len(self.cache) > self.max_guilds: self.cache.popitem(last=False)
+        return entry
+
+    async def save(self, guild_id, config):
+        # write-through: เขียน DB ก่อน แล้วแทนที่ cache (scanner จะ compile ใหม่ตอนใช้ครั้งถัดไป)
+        await db.save_guild_config(guild_id, config)
+        self.put(guild_id, config)
+
+    def invalidate(self, guild_id):
+        self.cache.pop(guild_id, None)
+
+configs = ConfigStore(default_conf)
+
+# ==========================================
+# 💾 BACKUP ENGINE (Snapshot + Delta)
+# ==========================================
+# hash ตรงกับอันล่าสุด = ไม่เขียนซ้ำ, เปลี่ยนนิดเดียว = เก็บแค่ delta, ทุกอย่างบีบอัดด้วย zlib
+BACKUP_FULL_EVERY = 10   # delta ติดกันได้สูงสุดกี่อัน ก่อนบังคับ snapshot เต็ม
+
+def snapshot_guild(guild):
+    roles = {}
+    for role in guild.roles:
+        if role.is_default(): continue
+        roles[str(role.id)] = {
+            "name": role.name, "permissions": role.permissions.value, "color": role.color.value,
+            "hoist": role.hoist, "mentionable": role.mentionable, "position": role.position
+        }
+    channels = {}
+    for ch in guild.channels:
+        overwrites = {}
+        for target, ow in ch.overwrites.items():
+            allow, deny = ow.pair()
+            kind = "role" if isinstance(target, discord.Role) or getattr(target, "type", None) is discord.Role else "member"
+            overwrites[str(target.id)] = [kind, allow.value, deny.value]
+        channels[str(ch.id)] = {
+            "name": ch.name, "type": ch.type.value, "position": ch.position, "category": ch.category_id,
+            "topic": getattr(ch, "topic", None), "nsfw": getattr(ch, "nsfw", False), "slowmode": getattr(ch, "slowmode_delay", 0),
+            "bitrate": getattr(ch, "bitrate", None), "user_limit": getattr(ch, "user_limit", None), "overwrites": overwrites
+        }
+    return {"roles": roles, "channels": channels}
+
+def diff_snapshot(old, new):
+    delta = {}
+    for section, items in new.items():
+        prev = old.get(section, {})
+        changed = {k: v for k, v in items.items() if prev.get(k) != v}
+        removed = [k for k in prev if k not in items]
+        if changed or removed: delta[section] = {"set": changed, "del": removed}
+    return delta
+
+def apply_delta(state, delta):
+    for section, change in delta.items():
+        items = state.setdefault(section, {})
+        items.update(change["set"])
+        for k in change["del"]: items.pop(k, None)
+    return state
+
+def pack(data):
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode(), 6)
+
+def unpack(blob):
+    return json.loads(zlib.decompress(blob))
+
+class BackupEngine:
+    def __init__(self, max_cached=200):
+        self.max_cached = max_cached
+        self.latest = OrderedDict()  # guild_id -> [snapshot_id, hash, state, deltas_since_full]
+
+    async def load_latest(self, guild_id):
+        entry = self.latest.get(guild_id)
+        if entry is not None:
+            self.latest.move_to_end(guild_id)
+            return entry
+        row = await db.latest_snapshot(guild_id)
+        if not row: return None
+        state, deltas = await self.materialize(guild_id, row[0])
+        return self.remember(guild_id, [row[0], row[1], state, deltas])
+
+    async def materialize(self, guild_id, snapshot_id):
+        state, deltas = {}, 0
+        for _, base_id, blob in await db.snapshot_chain(guild_id, snapshot_id):
+            data = unpack(blob)
+            if base_id is None: state, deltas = data, 0
+            else: state, deltas = apply_delta(state, data), deltas + 1
+        return state, deltas
+
+    def remember(self, guild_id, entry):
+        self.latest[guild_id] = entry
+        self.latest.move_to_end(guild_id)
+        while len(self.latest) > self.max_cached: self.latest.popitem(last=False)
+        return entry
+
+    async def get(self, guild_id):
+        entry = await self.load_latest(guild_id)
+        return entry[2] if entry else None
+
+    async def create(self, guild, keep, max_age_days):
+        state = snapshot_guild(guild)
+        raw = json.dumps(state, sort_keys=True, separators=(",", ":")).encode()
+        digest = hashlib.sha256(raw).hexdigest()
+
+        prev = await self.load_latest(guild.id)
+        if prev and prev[1] == digest:
+            return {"status": "unchanged", "bytes": 0, "raw": len(raw), "pruned": 0}
+
+        blob, base_id, deltas = zlib.compress(raw, 6), None, 0
+        if prev and prev[3] < BACKUP_FULL_EVERY:
+            delta_blob = pack(diff_snapshot(prev[2], state))
+            if len(delta_blob) < len(blob): blob, base_id, deltas = delta_blob, prev[0], prev[3] + 1
+
+        snapshot_id = await db.add_snapshot(guild.id, digest, base_id, blob)
+        self.remember(guild.id, [snapshot_id, digest, state, deltas])
+        pruned = await self.prune(guild.id, keep, max_age_days)
+        return {"status": "delta" if base_id else "full", "bytes": len(blob), "raw": len(raw), "pruned": pruned}
+
+    async def prune(self, guild_id, keep, max_age_days):
+        rows = await db.snapshot_index(guild_id)  # ใหม่ -> เก่า
+        min_created = time.time() - max_age_days * 86400
+        kept = [row for i, row in enumerate(rows) if i < keep and (i == 0 or row[2] >= min_created)]
+        if len(kept) == len(rows): return 0
+
+        oldest_id, oldest_base = kept[-1][0], kept[-1][1]
+        if oldest_base is not None:
+            # อันเก่าสุดที่เหลือเป็น delta -> แปลงเป็น snapshot เต็มก่อน ไม่งั้นลบฐานของมันทิ้งไม่ได้
+            state, _ = await self.materialize(guild_id, oldest_id)
+            await db.execute("UPDATE snapshots SET base_id=NULL, data=? WHERE id=?", (pack(state), oldest_id))
+        return await db.execute("DELETE FROM snapshots WHERE guild_id=? AND id<?", (guild_id, oldest_id))
+
+backups = BackupEngine()
+
+# ==========================================
+# ♻️ ROLE RECOVERY (Indexed + Parallel Restore)
+# ==========================================
+# ยศที่โดนลบในช่วง RESTORE_BURST_WINDOW รวมเป็นชุดเดียว -> สร้างคืนพร้อมกัน (จำกัดจำนวน),
+# เรียงตำแหน่งด้วย call เดียว แล้วคืนยศให้สมาชิกเดิม
+RESTORE_BURST_WINDOW = 2.0
+RESTORE_CONCURRENCY = 5
+RESTORE_RETRIES = 3
+RESTORE_HOLD = 86400  # ยศที่ไม่รู้ว่าใครลบ: เก็บ index ไว้ให้ /restore เองได้นานเท่านี้
+EMPTY_MEMBERS = zlib.compress(b"[]")  # ยศจาก backup ไม่มีรายชื่อสมาชิก
+
+def role_index_row(guild_id, role, now, member_ids=()):
+    data = json.dumps({
+        "name": role.name, "permissions": role.permissions.value, "color": role.color.value,
+        "hoist": role.hoist, "mentionable": role.mentionable, "position": role.position
+    }, separators=(",", ":"))
+    members = json.dumps(sorted(member_ids), separators=(",", ":")).encode()
+    digest = hashlib.sha1(data.encode() + members).hexdigest()
+    return (guild_id, role.id, digest, data, zlib.compress(members), now)
+
+async def role_members(guild, chunk=True):
+    # role_id -> array[member_id] ไล่สมาชิกรอบเดียว (role.members ไล่ทั้งเซิร์ฟใหม่ทุกยศ)
+    members = guild.members
+    if LOW_MEMORY and chunk and not guild.chunked:
+        # ไม่มี cache สมาชิก -> chunk แบบไม่เก็บ (cache=False) เอาแค่ id ต่อยศแล้วทิ้ง
+        try: members = await guild.chunk(cache=False)
+        except (discord.ClientException, asyncio.TimeoutError): members = ()
+    holders = {}
+    for member in members:
+        for role_id in member._roles:
+            ids = holders.get(role_id)
+            if ids is None: ids = holders[role_id] = array('q')
+            ids.append(member.id)
+    return holders
+
+class RoleRestorer:
+    def __init__(self):
+        self.pending = {}  # guild_id -> {role_id}
+        self.tasks = {}  # guild_id -> Task
+        self.held = {}  # guild_id -> {role_id: ลบเมื่อ} (ไม่รู้คนลบ -> ไม่กู้เอง แต่ยังไม่ลบ index)
+
+    async def index(self, guild, chunk=True):
+        # เขียนเฉพาะยศที่ข้อมูล/สมาชิกเปลี่ยน + ลบ index ของยศที่ไม่มีแล้ว (ลบตอนบอทออฟไลน์ / ลบโดยตั้งใจ)
+        holders = await role_members(guild, chunk)
+        known = await db.role_snapshot_hashes(guild.id)
+        now = time.time()
+        rows = [row for row in (role_index_row(guild.id, r, now, holders.get(r.id, ())) for r in guild.roles if not r.is_default() and not r.managed) if known.get(row[1]) != row[2]]
+        if rows: await db.upsert_role_snapshots(rows)
+
+        held = self.held.get(guild.id, {})
+        for role_id in [r for r, at in held.items() if now - at > RESTORE_HOLD]: del held[role_id]
+        if not held: self.held.pop(guild.id, None)
+        keep = {r.id for r in guild.roles} | self.pending.get(guild.id, set()) | held.keys()
+        stale = [role_id for role_id in known if role_id not in keep]
+        if stale: await db.delete_role_snapshots(guild.id, stale)
+        return len(rows)
+
+    async def forget(self, guild_id, role_id):
+        await db.delete_role_snapshots(guild_id, [role_id])
+
+    def hold(self, guild_id, role_id):
+        self.held.setdefault(guild_id, {})[role_id] = time.time()
+
+    def schedule(self, guild, role_id):
+        self.pending.setdefault(guild.id, set()).add(role_id)
+        if guild.id not in self.tasks:
+            self.tasks[guild.id] = asyncio.create_task(self.run_burst(guild))
+
+    async def run_burst(self, guild):
+        await asyncio.sleep(RESTORE_BURST_WINDOW)
+        del self.tasks[guild.id]  # ยศที่โดนลบระหว่าง restore จะเริ่มชุดใหม่
+        role_ids = self.pending.pop(guild.id, set())
+        res = await self.restore(guild, role_ids)
+        if res["created"] or res["failed"]:
+            await send_log(guild, "♻️ Roles Restored", f"Created: **{res['created']}** | Failed: **{res['failed']}**\nMembers re-assigned: **{res['members']}** | Channel overwrites: **{res['overwrites']}**", color=COLOR_SUCCESS)
+
+    async def restore(self, guild, role_ids=None, legacy=False):
+        if role_ids is None: self.held.pop(guild.id, None)  # /restore = แอดมินยืนยันแล้ว
+        existing = {r.id for r in guild.roles}
+        rows = [row for row in await db.get_role_snapshots(guild.id, role_ids) if row[0] not in existing]
+        if legacy:
+            # /restore legacy: ยศจาก backup ก่อนอัปเกรด เทียบด้วยชื่อ (ไม่มี id) -> สร้างเฉพาะชื่อที่ยังไม่มีในเซิร์ฟ
+            names = {r.name for r in guild.roles} | {json.loads(row[1])["name"] for row in rows}
+            for key, data in (await db.legacy_roles(guild.id)).items():
+                if data["name"] in names: continue
+                names.add(data["name"])
+                rows.append((key, json.dumps(data, separators=(",", ":")), EMPTY_MEMBERS))
+        # backup ล่าสุด (BackupEngine): ยศที่ยังไม่ทันเข้า index + overwrite ของห้องที่ผูกกับยศเดิม
+        state = await backups.get(guild.id)
+        if state and role_ids:
+            found = {row[0] for row in rows}
+            rows += [(rid, json.dumps(data, separators=(",", ":")), EMPTY_MEMBERS) for rid in role_ids
+                     if rid not in found and rid not in existing and (data := state["roles"].get(str(rid)))]
+        sem = asyncio.Semaphore(RESTORE_CONCURRENCY)
+
+        async def recreate(row):
+            data = json.loads(row[1])
+            async with sem:
+                for attempt in range(RESTORE_RETRIES):
+                    try:
+                        role = await guild.create_role(name=data["name"], permissions=discord.Permissions(data["permissions"]), color=discord.Color(data["color"]), hoist=data["hoist"], mentionable=data["mentionable"], reason="Auto-Recovery")
+                        return row, data, role
+                    except discord.HTTPException as e:
+                        if e.status != 429 and e.status < 500: break
+                        await asyncio.sleep(getattr(e, "retry_after", None) or 2 ** attempt)
+            return row, data, None
+
+        results = await asyncio.gather(*(recreate(row) for row in rows))
+        created = [(row, data, role) for row, data, role in results if role]
+
+        # ตำแหน่ง: call เดียว (ต่ำกว่ายศสูงสุดของบอทเสมอ)
+        if created:
+            top = guild.me.top_role.position - 1 if guild.me else None
+            positions = {role: max(1, min(data["position"], top) if top else data["position"]) for _, data, role in created if data["position"] is not None}
+            try:
+                if positions: await guild.edit_role_positions(positions=positions, reason="Auto-Recovery")
+            except discord.HTTPException: pass
+
+        # สมาชิก: รวมยศของแต่ละคนแล้วให้ทีเดียว
+        assign = {}
+        for row, _, role in created:
+            for member_id in json.loads(zlib.decompress(row[2])): assign.setdefault(member_id, []).append(role)
+
+        async def give(member_id, roles):
+            async with sem:
+                member = guild.get_member(member_id)
+                try:
+                    if member: await member.add_roles(*roles, reason="Auto-Recovery")
+                    else:
+                        for role in roles: await bot.http.add_role(guild.id, member_id, role.id, reason="Auto-Recovery")
+                    return True
+                except discord.HTTPException: return False
+
+        given = await asyncio.gather(*(give(mid, roles) for mid, roles in assign.items()))
+        overwrites = await self.reapply_overwrites(guild, state, {row[0]: role for row, _, role in created}, sem) if state and created else 0
+
+        # ย้าย index ไปที่ role id ใหม่
+        if created:
+            await db.delete_role_snapshots(guild.id, [row[0] for row, _, _ in created])
+            now = time.time()
+            await db.upsert_role_snapshots([(guild.id, role.id, None, row[1], row[2], now) for row, _, role in created])
+        return {"created": len(created), "failed": len(rows) - len(created), "members": sum(given), "overwrites": overwrites}
+
+    async def reapply_overwrites(self, guild, state, roles, sem):
+        # ยศที่สร้างคืนได้ id ใหม่ -> overwrite ของยศเดิมในแต่ละห้องหายไปด้วย, เอาจาก backup มาใส่ให้ยศใหม่
+        jobs = []
+        for channel_id, data in state.get("channels", {}).items():
+            channel = guild.get_channel(int(channel_id))
+            if channel is None: continue
+            for target_id, (kind, allow, deny) in data["overwrites"].items():
+                role = roles.get(int(target_id)) if kind == "role" else None
+                if role: jobs.append((channel, role, discord.PermissionOverwrite.from_pair(discord.Permissions(allow), discord.Permissions(deny))))
+
+        async def put(channel, role, overwrite):
+            async with sem:
+                try:
+                    await channel.set_permissions(role, overwrite=overwrite, reason="Auto-Recovery")
+                    return True
+                except discord.HTTPException: return False
+
+        return sum(await asyncio.gather(*(put(*job) for job in jobs)))
+
+role_restorer = RoleRestorer()
+
+# ==========================================
+# 🔒 LOCKDOWN ENGINE (Snapshot + Concurrent)
+# ==========================================
+# บันทึก overwrite ของ @everyone ทุกห้องลง DB ก่อนแก้ -> ปลดล็อกคืนค่าเดิมเป๊ะ (รวมห้องที่เดิมไม่มี overwrite)
+# ยิง API พร้อมกันแบบ AIMD: สำเร็จค่อยๆ เพิ่ม, โดน 429 ลดครึ่ง
+LOCKDOWN_CONCURRENCY = 8
+LOCKDOWN_MAX_CONCURRENCY = 16
+LOCKDOWN_RETRIES = 5
+LOCK_TEXT = {"send_messages": False, "send_messages_in_threads": False, "create_public_threads": False, "create_private_threads": False, "add_reactions": False}
+LOCK_VOICE = {**LOCK_TEXT, "connect": False, "speak": False}
+VOICE_TYPES = (discord.ChannelType.voice, discord.ChannelType.stage_voice)
+
+class AdaptiveLimiter:
+    def __init__(self, start=LOCKDOWN_CONCURRENCY, maximum=LOCKDOWN_MAX_CONCURRENCY):
+        self.limit = float(start)
+        self.maximum = maximum
+        self.active = 0
+        self.cond = asyncio.Condition()
+        self.rate_limited = 0
+
+    async def run(self, call):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+        try:
+            for attempt in range(LOCKDOWN_RETRIES):
+                try:
+                    await call()
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                    return True
+                except discord.HTTPException as e:
+                    if e.status != 429 and e.status < 500: return False
+                    if e.status == 429:
+                        self.rate_limited += 1
+                        self.limit = max(1.0, self.limit / 2)
+                    await asyncio.sleep(getattr(e, "retry_after", None) or 0.5 * 2 ** attempt)
+            return False
+        finally:
+            async with self.cond:
+                self.active -= 1
+                self.cond.notify_all()
+
+def lockable_channels(guild):
+    # category ไม่ต้องล็อก (ห้องลูกถูกล็อกเองทีละห้อง ไม่พึ่ง sync)
+    return [c for c in guild.channels if c.type != discord.ChannelType.category]
+
+class LockdownEngine:
+    def __init__(self):
+        self.locks = {}  # guild_id -> Lock (กัน lock/unlock ชนกัน)
+        self.stats = {}  # guild_id -> ผลล่าสุด
+
+    async def run_all(self, calls, progress=None):
+        limiter, done, ok = AdaptiveLimiter(), 0, 0
+        total = len(calls)
+
+        async def one(call):
+            nonlocal done, ok
+            success = await limiter.run(call)
+            ok, done = ok + success, done + 1
+            if progress: await progress(done, total)
+
+        await asyncio.gather(*(one(c) for c in calls))
+        return {"total": total, "ok": ok, "failed": total - ok, "rate_limited": limiter.rate_limited}
+
+    async def lock(self, guild, reason="Lockdown", progress=None):
+        async with self.locks.setdefault(guild.id, asyncio.Lock()):
+            everyone = guild.default_role
+            channels = lockable_channels(guild)
+            threads = [t for t in guild.threads if not t.locked and not t.archived]
+
+            # 1. snapshot ก่อนแตะอะไร
+            rows = []
+            for c in channels:
+                allow, deny = c.overwrites_for(everyone).pair()
+                rows.append((guild.id, c.id, "channel", allow.value, deny.value, int(everyone in c.overwrites)))
+            rows += [(guild.id, t.id, "thread", 0, 0, 0) for t in threads]
+            await db.save_lockdown(rows)
+
+            # 2. แก้พร้อมกัน
+            calls = []
+            for c in channels:
+                ow = c.overwrites_for(everyone)
+                ow.update(**(LOCK_VOICE if c.type in VOICE_TYPES else LOCK_TEXT))
+                calls.append(lambda c=c, ow=ow: c.set_permissions(everyone, overwrite=ow, reason=reason))
+            calls += [lambda t=t: t.edit(locked=True, reason=reason) for t in threads]
+
+            start = time.perf_counter()
+            res = await self.run_all(calls, progress)
+            res["seconds"] = time.perf_counter() - start
+            self.stats[guild.id] = res
+            return res
+
+    async def unlock(self, guild, reason="Unlockdown", progress=None):
+        async with self.locks.setdefault(guild.id, asyncio.Lock()):
+            everyone = guild.default_role
+            rows = await db.get_lockdown(guild.id)
+            calls, restored = [], []
+            for channel_id, kind, allow, deny, existed in rows:
+                target = guild.get_channel_or_thread(channel_id)
+                if not target:
+                    restored.append(channel_id)  # ห้องหายไปแล้ว
+                    continue
+                if kind == "thread": call = lambda t=target: t.edit(locked=False, reason=reason)
+                elif existed:
+                    ow = discord.PermissionOverwrite.from_pair(discord.Permissions(allow), discord.Permissions(deny))
+                    call = lambda c=target, ow=ow: c.set_permissions(everyone, overwrite=ow, reason=reason)
+                else: call = lambda c=target: c.set_permissions(everyone, overwrite=None, reason=reason)
+                calls.append((channel_id, call))
+
+            async def tracked(channel_id, call):
+                await call()
+                restored.append(channel_id)
+
+            start = time.perf_counter()
+            res = await self.run_all([lambda cid=cid, call=call: tracked(cid, call) for cid, call in calls], progress)
+            res["seconds"] = time.perf_counter() - start
+            # ห้องที่คืนไม่สำเร็จยังเก็บ snapshot ไว้ -> สั่ง unlockdown ซ้ำได้
+            if restored: await db.clear_lockdown(guild.id, restored)
+            return res
+
+lockdown = LockdownEngine()
+
+# ==========================================
+# ⏳ RATE TRACKER (Sliding Window)
+# ==========================================
+# เก็บแค่ timestamp ล่าสุด threshold ตัวต่อ key อัดเป็น int ตัวเดียว (ช่องละ RATE_BITS บิต, หน่วย ms) -> O(1) ต่อข้อความ
+# dict ธรรมดา (ถอดแล้วใส่ใหม่ = ย้ายไปท้าย) เรียงตามการใช้งานล่าสุด -> ตัด key ที่เงียบไปได้จากหัว
+# ไม่ใช้ OrderedDict: ต่อ key ประหยัด ~50 B (ตัวละเป็นแสน key ตอนโดน raid)
+RATE_BITS = 42  # ms ได้ ~139 ปีนับจากสร้าง tracker
+RATE_FIELD = (1 << RATE_BITS) - 1
+
+class RateTracker:
+    def __init__(self, max_keys=200_000, idle_after=300):
+        self.max_keys = max_keys
+        self.idle_after = idle_after
+        self.epoch = None
+        self.windows = {}  # key -> int [t_old, ..., t_new] (ช่องล่างสุด = ล่าสุด, 0 = ว่าง)
+
+    def __len__(self):
+        return len(self.windows)
+
+    def stamp(self, now):
+        if self.epoch is None: self.epoch = now
+        return max(0, int((now - self.epoch) * 1000)) + 1
+
+    def hit(self, key, threshold, window, now=None):
+        if now is None: now = time.monotonic()
+        windows = self.windows
+        ring = windows.pop(key, 0)
+        if not ring and len(windows) >= self.max_keys:
+            # เต็ม -> ตัดเก่าสุดทีละ 1/16 (next(iter()) ทีละตัวต้องข้ามช่องที่ลบแล้วซ้ำๆ)
+            for old in list(islice(windows, max(1, self.max_keys // 16))): del windows[old]
+
+        # เลื่อนช่องขึ้น ใส่เวลาใหม่ช่องล่าง ตัดช่องที่เกิน threshold ทิ้ง -> ช่องบนสุดคือเก่าสุดของชุด
+        t = self.stamp(now)
+        shift = RATE_BITS * (threshold - 1)
+        ring = ((ring << RATE_BITS) | t) & ((1 << (shift + RATE_BITS)) - 1)
+        windows[key] = ring
+        oldest = ring >> shift
+        return oldest > 0 and t - oldest < window * 1000
+
+    def reset(self, key):
+        self.windows.pop(key, None)
+
+    def sweep(self, now=None):
+        if now is None: now = time.monotonic()
+        if self.epoch is None: return 0
+        cutoff = self.stamp(now - self.idle_after)
+        idle = []
+        for key, ring in self.windows.items():
+            if ring & RATE_FIELD >= cutoff: break
+            idle.append(key)
+        for key in idle: del self.windows[key]
+        return len(idle)
+
+# ==========================================
+# 🗂️ RECENT MESSAGE INDEX
+# ==========================================
+# (guild, user) -> คู่ (ห้อง, message id) ล่าสุดไม่เกิน per_user คู่ ใน array แบบ ring buffer -> anti-spam ลบด้วย id ได้ทุกห้อง ไม่ต้องดึง history
+# เวลาอ่านจาก snowflake ของ message id เอง ไม่ต้องเก็บ timestamp แยก
+def snowflake_ts(snowflake):
+    return ((snowflake >> 22) + discord.utils.DISCORD_EPOCH) / 1000
+
+class MessageIndex:
+    def __init__(self, max_users=20_000, per_user=25, ttl=300):
+        self.max_users = max_users
+        self.per_user = per_user
+        self.ttl = ttl
+        self.users = OrderedDict()  # (guild_id, user_id) -> array('q', [head, ch1, msg1, ch2, msg2, ...])
+
+    def __len__(self):
+        return len(self.users)
+
+    def add(self, guild_id, user_id, channel_id, message_id):
+        key = (guild_id, user_id)
+        buf = self.users.get(key)
+        if buf is None:
+            buf = self.users[key] = array('q', [1])
+            if len(self.users) > self.max_users: self.users.popitem(last=False)
+        else:
+            self.users.move_to_end(key)
+        if len(buf) < 1 + 2 * self.per_user:
+            buf.append(channel_id)
+            buf.append(message_id)
+        else:
+            # เต็มแล้ว -> ring buffer เขียนทับคู่ที่เก่าสุด
+            head = buf[0]
+            buf[head], buf[head + 1] = channel_id, message_id
+            buf[0] = head + 2 if head + 2 < len(buf) else 1
+
+    @staticmethod
+    def last(buf):
+        head = buf[0]
+        return buf[head - 1] if head > 1 else buf[-1]
+
+    def take(self, guild_id, user_id, now=None):
+        # ดึงออกทั้งชุด -> {channel_id: [message_id, ...]} เฉพาะที่ยังไม่หมดอายุ
+        cutoff = (now or time.time()) - self.ttl
+        buf = self.users.pop((guild_id, user_id), None)
+        by_channel = {}
+        if buf is None: return by_channel
+        for i in range(1, len(buf), 2):
+            if snowflake_ts(buf[i + 1]) >= cutoff: by_channel.setdefault(buf[i], []).append(buf[i + 1])
+        return by_channel
+
+    def sweep(self, now=None):
+        cutoff = (now or time.time()) - self.ttl
+        users = self.users
+        evicted = 0
+        while users:
+            key, buf = users.popitem(last=False)
+            if snowflake_ts(self.last(buf)) >= cutoff:
+                users[key] = buf
+                users.move_to_end(key, last=False)
+                break
+            evicted += 1
+        return evicted
+
+# ==========================================
+# 🌊 FLOOD GUARD (Webhook / Bot Messages)
+# ==========================================
+# token bucket ต่อแหล่ง (webhook id / bot id) และต่อห้อง -> ต่อข้อความแค่ dict lookup + บวกลบเลข O(1)
+# ถังแหล่งว่าง = แหล่งนั้นยิงรัว, ถังห้องว่าง = หลายแหล่งรุมห้องเดียว (webhook หลายตัวพร้อมกัน)
+FLOOD_COOLDOWN = 30          # วินาที ไม่จัดการแหล่งเดิมซ้ำระหว่างกำลังลบ
+FLOOD_TRACK_MESSAGES = 100   # จำ id ข้อความล่าสุดต่อแหล่ง (ไว้ bulk-delete)
+
+class TokenBuckets:
+    def __init__(self, max_keys=50_000, idle_after=300):
+        self.max_keys = max_keys
+        self.idle_after = idle_after
+        self.buckets = OrderedDict()  # key -> [tokens, last]
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def take(self, key, rate, burst, now=None):
+        # True = ผ่าน (หยิบได้ 1 token)
+        if now is None: now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [burst, now]
+            if len(self.buckets) > self.max_keys: self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] < 1: return False
+        bucket[0] -= 1
+        return True
+
+    def sweep(self, now=None):
+        if now is None: now = time.monotonic()
+        cutoff = now - self.idle_after
+        evicted = 0
+        while self.buckets:
+            key, bucket = next(iter(self.buckets.items()))
+            if bucket[1] >= cutoff: break
+            del self.buckets[key]
+            evicted += 1
+        return evicted
+
+class FloodGuard:
+    def __init__(self):
+        self.buckets = TokenBuckets()
+        self.index = MessageIndex(max_users=5_000, per_user=FLOOD_TRACK_MESSAGES, ttl=120)
+        self.handling = {}  # (guild_id, source_id) -> จัดการซ้ำได้หลังเวลานี้
+        self.stats = {"messages": 0, "floods": 0}
+
+    def hit(self, guild_id, source_id, channel_id, message_id, cfg, now=None):
+        # True = เพิ่งล้น (ครั้งแรกในรอบ cooldown) -> ผู้เรียกต้องจัดการ
+        if now is None: now = time.monotonic()
+        self.stats["messages"] += 1
+        self.index.add(guild_id, source_id, channel_id, message_id)
+        key, window = (guild_id, source_id), cfg["window"]
+        source_ok = self.buckets.take(key, cfg["threshold"] / window, cfg["threshold"], now)
+        channel_ok = self.buckets.take(channel_id, cfg["channel_threshold"] / window, cfg["channel_threshold"], now)
+        if source_ok and channel_ok: return False
+        # ห้องล้นแต่ถังตัวเองยังเหลือเกินครึ่ง = บอทปกติที่บังเอิญโพสต์ห้องนั้น ไม่ใช่คนรุม
+        if source_ok and self.buckets.buckets.get(key, (0,))[0] >= cfg["threshold"] / 2: return False
+        if self.handling.get(key, 0) > now: return False
+        self.handling[key] = now + FLOOD_COOLDOWN
+        self.stats["floods"] += 1
+        return True
+
+    def sweep(self, now=None):
+        if now is None: now = time.monotonic()
+        self.buckets.sweep(now)
+        self.index.sweep()
+        for key in [k for k, until in self.handling.items() if until <= now]: del self.handling[key]
+
+flood_guard = FloodGuard()
+
+# ==========================================
+# ☢️ ANTI-NUKE ENGINE
+# ==========================================
+# นับคะแนนทุกการกระทำอันตรายต่อ (guild, ผู้กระทำ) ในช่วงเวลา window
+# event หมดอายุออกจากหัว deque ทีละตัว -> O(1) amortized ต่อ event
+NUKE_MODULES = {"webhook_create": "anti_webhook", "bot_add": "anti_bot", "role_grant": "anti_role"}  # นอกนั้น = anti_nuke
+
+class NukeDetector:
+    def __init__(self, max_actors=50_000, max_events=64, idle_after=300):
+        self.max_actors = max_actors
+        self.max_events = max_events
+        self.idle_after = idle_after
+        self.actors = OrderedDict()  # (guild_id, actor_id) -> [score, deque[(t, action, weight)], {action: count}]
+
+    def __len__(self):
+        return len(self.actors)
+
+    def record(self, guild_id, actor_id, action, weight, threshold, window, now=None):
+        if now is None: now = time.monotonic()
+        key = (guild_id, actor_id)
+        state = self.actors.get(key)
+        if state is None:
+            state = self.actors[key] = [0.0, deque(), {}]
+            if len(self.actors) > self.max_actors: self.actors.popitem(last=False)
+        else:
+            self.actors.move_to_end(key)
+
+        events, counts = state[1], state[2]
+        while events and (now - events[0][0] >= window or len(events) >= self.max_events):
+            self._expire(state)
+        events.append((now, action, weight))
+        state[0] += weight
+        counts[action] = counts.get(action, 0) + 1
+
+        if state[0] < threshold: return False, None
+        del self.actors[key]  # โดนแล้ว เริ่มนับใหม่
+        return True, counts
+
+    @staticmethod
+    def _expire(state):
+        _, action, weight = state[1].popleft()
+        state[0] -= weight
+        counts = state[2]
+        counts[action] -= 1
+        if not counts[action]: del counts[action]
+
+    def sweep(self, now=None):
+        if now is None: now = time.monotonic()
+        cutoff = now - self.idle_after
+        evicted = 0
+        while self.actors:
+            key, state = self.actors.popitem(last=False)
+            if state[1] and state[1][-1][0] >= cutoff:
+                self.actors[key] = state
+                self.actors.move_to_end(key, last=False)
+                break
+            evicted += 1
+        return evicted
+
+# ==========================================
+# 📜 AUDIT LOG STREAM (Gateway)
+# ==========================================
+# audit entry มาจาก on_audit_log_entry_create -> จับคู่กับ raw event ด้วย (guild, action, target)
+# มาก่อน = เก็บไว้ใน cache สั้นๆ, มาทีหลัง = ปลุก handler ที่รออยู่ / ไม่มาภายใน deadline = ค่อยยิง REST
+AUDIT_DEADLINE = 2.0    # วินาที
+AUDIT_TTL = 15          # อายุ entry ใน cache
+
+class AuditCorrelator:
+    def __init__(self, ttl=AUDIT_TTL, max_entries=5_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (guild_id, action, target_id) -> (monotonic, entry)
+        self.waiters = {}  # key -> [Future]
+        self.fallbacks = 0  # จำนวนครั้งที่ต้องยิง REST
+
+    def push(self, entry):
+        key = (entry.guild.id, entry.action, getattr(entry.target, "id", None))
+        for fut in self.waiters.pop(key, ()):
+            if not fut.done():
+                fut.set_result(entry)
+                return
+
+        now = time.monotonic()
+        self.entries[key] = (now, entry)
+        self.entries.move_to_end(key)
+        while self.entries:
+            ts, _ = next(iter(self.entries.values()))
+            if now - ts < self.ttl and len(self.entries) <= self.max_entries: break
+            self.entries.popitem(last=False)
+
+    async def wait(self, guild_id, action, target_id, timeout=AUDIT_DEADLINE):
+        key = (guild_id, action, target_id)
+        cached = self.entries.pop(key, None)
+        if cached and time.monotonic() - cached[0] < self.ttl: return cached[1]
+
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(key, []).append(fut)
+        try: return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError: return None
+        finally:
+            waiters = self.waiters.get(key)
+            if waiters and fut in waiters:
+                waiters.remove(fut)
+                if not waiters: del self.waiters[key]
+
+audit_feed = AuditCorrelator()
+
+# ==========================================
+# ⚖️ PUNISHMENT EXECUTOR (Priority Queue)
+# ==========================================
+# handler ส่งงานลงโทษเข้าคิวเดียว: anti-nuke มาก่อนเสมอ, เป้าหมายเดียวกันที่ยังรออยู่รวมเป็นงานเดียว,
+# ทำผิดซ้ำภายใน ESCALATE_WINDOW = หนักขึ้นทีละขั้น, ban หลายคนใน guild เดียวรวมเป็น bulk_ban
+PUNISH_WORKERS = 8
+PUNISH_RETRIES = 5
+PUNISH_DEDUP_TTL = 30  # เพิ่งลงโทษระดับเท่าเดิม/หนักกว่าไปแล้ว -> ไม่ยิงซ้ำ
+ESCALATE_WINDOW = 600
+ESCALATE_EVERY = 2  # ทุกๆ 2 ความผิดที่เพิ่มขึ้น = หนักขึ้น 1 ขั้น
+BULK_BAN_MAX = 200  # limit ของ Discord ต่อ call
+BULK_BAN_LINGER = 0.2  # รอรวม ban ก่อนยิง (ยกเว้น anti-nuke)
+PRIORITY_NUKE, PRIORITY_NORMAL = 0, 1
+SEVERITY = ("none", "timeout", "kick", "ban")
+PUNISH_LABELS = {"ban": "🚫 BANNED", "kick": "👢 KICKED", "timeout": "🔇 TIMEOUT", "none": "⚠️ WARNED"}
+PUNISH_ERRORS = {"forbidden": "No Perms", "not_found": "Not Found", "not_member": "Not Member", "failed": "Error"}
+
+class PunishResult:
+    # status: ok | duplicate | forbidden | not_found | not_member | http_error | failed
+    __slots__ = ("action", "status", "error", "attempts", "note")
+
+    def __init__(self, action, status="ok", error=None, attempts=1, note=None):
+        self.action, self.status, self.error, self.attempts, self.note = action, status, error, attempts, note
+
+    @property
+    def ok(self):
+        return self.status in ("ok", "duplicate")
+
+    def __str__(self):
+        if self.ok: return PUNISH_LABELS[self.action] + (f" ({self.note})" if self.note else "")
+        if self.status == "http_error": return f"❌ FAILED (HTTP {self.error})"
+        return f"❌ FAILED ({PUNISH_ERRORS[self.status]})"
+
+class PunishJob:
+    __slots__ = ("guild", "target", "base", "severity", "reasons", "priority", "futures", "done")
+
+    def __init__(self, guild, target, base, severity, reason, priority):
+        self.guild, self.target, self.base, self.severity, self.priority = guild, target, base, severity, priority
+        self.reasons, self.futures, self.done = [reason], [], False
+
+class PunishmentExecutor:
+    def __init__(self, workers=PUNISH_WORKERS, max_history=50_000):
+        self.heap, self.seq = [], 0
+        self.pending = {}  # (guild_id, target_id) -> PunishJob ที่ยังไม่เริ่ม
+        self.running = {}  # (guild_id, target_id) -> PunishJob ที่กำลังยิง API
+        self.bans = {}  # guild_id -> {target_id: PunishJob} รอรวม bulk ban
+        self.history = OrderedDict()  # (guild_id, target_id) -> [offences, last_offence, PunishResult | None, applied_at]
+        self.max_history = max_history
+        self.n_workers, self.workers, self.wake = workers, [], None
+        self.blocked_until = 0.0  # โดน 429 -> ทุก worker หยุดรอพร้อมกัน
+        self.stats = {"jobs": 0, "merged": 0, "duplicate": 0, "calls": 0, "bulk_calls": 0}
+
+    def offence(self, key, base, now):
+        h = self.history.get(key)
+        if h is None or now - h[1] > ESCALATE_WINDOW: h = self.history[key] = [0, now, None, 0.0]
+        h[0] += 1
+        h[1] = now
+        self.history.move_to_end(key)
+        while len(self.history) > self.max_history: self.history.popitem(last=False)
+        # "none" (log only) ไม่ยกระดับ
+        return h, (min(len(SEVERITY) - 1, base + (h[0] - 1) // ESCALATE_EVERY) if base else 0)
+
+    def sweep(self, now=None):
+        now = now or time.monotonic()
+        while self.history:
+            key, h = next(iter(self.history.items()))
+            if now - h[1] <= ESCALATE_WINDOW: break
+            self.history.popitem(last=False)
+
+    def push(self, job):
+        self.seq += 1
+        heapq.heappush(self.heap, (job.priority, self.seq, job))
+        if SEVERITY[job.severity] == "ban": self.bans.setdefault(job.guild.id, {})[job.target.id] = job
+
+    def submit(self, guild, target, action, reason, priority=PRIORITY_NORMAL):
+        # คืน Future ทันที (ไม่รอคิว / bulk-ban linger / 429) -> handler จะ await หรือผูก callback ก็ได้
+        key = (guild.id, target.id)
+        base = SEVERITY.index(action) if action in SEVERITY else 0
+        h, severity = self.offence(key, base, time.monotonic())
+        fut = asyncio.get_running_loop().create_future()
+
+        job = self.pending.get(key)
+        if job:
+            # ยังไม่เริ่ม -> รวมเข้างานเดิม (เอาโทษที่หนักสุด / priority สูงสุด)
+            self.stats["merged"] += 1
+            if reason not in job.reasons: job.reasons.append(reason)
+            job.base = max(job.base, base)
+            repush = severity > job.severity or priority < job.priority
+            job.severity, job.priority = max(job.severity, severity), min(job.priority, priority)
+            if repush: self.push(job)
+        else:
+            running = self.running.get(key)
+            last = h[2]
+            if running and running.severity >= severity: job = running
+            elif last and last.ok and SEVERITY.index(last.action) >= severity and time.monotonic() - h[3] < PUNISH_DEDUP_TTL:
+                self.stats["duplicate"] += 1
+                fut.set_result(PunishResult(last.action, "duplicate", note="Already"))
+                return fut
+            else:
+                self.stats["jobs"] += 1
+                job = self.pending[key] = PunishJob(guild, target, base, severity, reason, priority)
+                self.push(job)
+        job.futures.append(fut)
+        self.start()
+        return fut
+
+    def start(self):
+        if self.wake is None: self.wake = asyncio.Event()
+        if not self.workers: self.workers = [asyncio.create_task(self.worker()) for _ in range(self.n_workers)]
+        self.wake.set()
+
+    def claim(self, job):
+        key = (job.guild.id, job.target.id)
+        job.done = True
+        self.pending.pop(key, None)
+        self.bans.get(job.guild.id, {}).pop(job.target.id, None)
+        self.running[key] = job
+
+    def finish(self, job, result):
+        key = (job.guild.id, job.target.id)
+        metrics.inc("pdr_actions_total", (reason_module(job.reasons[0]), result.action, result.status))
+        journal.record(job.guild.id, reason_module(job.reasons[0]), None, job.target.id, result.action, result.status, ", ".join(job.reasons))
+        self.running.pop(key, None)
+        h = self.history.get(key)
+        if h is not None and result.ok: h[2], h[3] = result, time.monotonic()
+        for fut in job.futures:
+            if not fut.done(): fut.set_result(result)
+
+    async def worker(self):
+        while True:
+            if not self.heap:
+                self.wake.clear()
+                await self.wake.wait()
+                continue
+            priority, _, job = heapq.heappop(self.heap)
+            if job.done or priority != job.priority: continue  # รวม/ย้าย priority ไปแล้ว
+            if SEVERITY[job.severity] == "ban" and job.priority > PRIORITY_NUKE:
+                # รอรวม ban ก่อน claim -> worker ที่รอครบก่อนเก็บทั้งหมดไปเป็น bulk เดียว
+                await asyncio.sleep(BULK_BAN_LINGER)
+                if job.done: continue
+            action = SEVERITY[job.severity]
+            self.claim(job)
+            try:
+                if action == "ban": await self.run_bans(job)
+                else: self.finish(job, await self.apply(job))
+            except Exception as e:
+                self.finish(job, PunishResult(action, "failed", str(e)))
+
+    async def cooldown(self):
+        delay = self.blocked_until - time.monotonic()
+        if delay > 0: await asyncio.sleep(delay)
+
+    def rate_limited(self, e, attempt):
+        delay = getattr(e, "retry_after", None) or 2 ** (attempt - 1)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+    async def run_bans(self, job):
+        guild = job.guild
+        waiting = self.bans.get(guild.id, {})
+        batch = [job]
+        for other in list(waiting.values())[:BULK_BAN_MAX - 1]:
+            if SEVERITY[other.severity] != "ban" or other.priority != job.priority: continue  # anti-nuke ไม่รอรวมกับ raid
+            self.claim(other)
+            batch.append(other)
+        if not waiting: self.bans.pop(guild.id, None)
+        if len(batch) == 1: return self.finish(job, await self.apply(job))
+
+        reason = ("Bulk: " + ", ".join(sorted({r for j in batch for r in j.reasons})))[:512]
+        for attempt in range(1, PUNISH_RETRIES + 1):
+            await self.cooldown()
+            try:
+                self.stats["bulk_calls"] += 1
+                res = await guild.bulk_ban([j.target for j in batch], reason=reason, delete_message_seconds=0)
+                banned = {u.id for u in res.banned}
+                for j in batch: self.finish(j, PunishResult("ban", "ok" if j.target.id in banned else "failed", None if j.target.id in banned else "bulk_ban", attempt, note="Bulk"))
+                return
+            except discord.Forbidden: break  # bulk_ban ต้องมี Manage Server ด้วย -> ban ทีละคนแทน
+            except discord.HTTPException as e:
+                if e.status != 429 and e.status < 500: break
+                self.rate_limited(e, attempt)
+            except Exception: break
+        results = await asyncio.gather(*(self.apply(j) for j in batch), return_exceptions=True)
+        for j, result in zip(batch, results): self.finish(j, result if isinstance(result, PunishResult) else PunishResult("ban", "failed", str(result)))
+
+    async def apply(self, job):
+        action, guild, target = SEVERITY[job.severity], job.guild, job.target
+        reason = "; ".join(job.reasons)[:512]
+        note = "Escalated" if job.severity > job.base else None
+        if action == "none": return PunishResult(action)
+        if action == "timeout" and getattr(target, "bot", False): action, note = "kick", "Bot"
+        if action == "timeout" and not hasattr(target, "timeout"): return PunishResult(action, "not_member")
+        for attempt in range(1, PUNISH_RETRIES + 1):
+            await self.cooldown()
+            try:
+                self.stats["calls"] += 1
+                if action == "ban": await guild.ban(target, reason=reason)
+                elif action == "kick": await guild.kick(target, reason=reason)
+                else: await target.timeout(datetime.timedelta(minutes=10), reason=reason)
+                return PunishResult(action, attempts=attempt, note=note)
+            except discord.Forbidden as e: return PunishResult(action, "forbidden", e.text, attempt)
+            except discord.NotFound as e: return PunishResult(action, "not_found", e.text, attempt)
+            except discord.HTTPException as e:
+                if e.status != 429 and e.status < 500: return PunishResult(action, "http_error", e.status, attempt)
+                status = e.status
+                self.rate_limited(e, attempt)
+        return PunishResult(action, "http_error", status, PUNISH_RETRIES)
+
+punisher = PunishmentExecutor()
+
+# ==========================================
+# 🌊 JOIN RAID DETECTOR
+# ==========================================
+# นับ join ต่อ guild ใน sliding window (deque) + ให้คะแนนบัญชีใหม่แบบถูกๆ: อายุบัญชี, avatar default,
+# ชื่อคล้ายคนที่เพิ่งเข้ามา (นับ key ของชื่อใน dict -> O(1))
+# เกิน threshold = โหมด raid: คนที่ถูก flag ไม่ผ่าน handler ทีละคน แต่เข้าคิวไปจัดการเป็นชุด
+RAID_MODE_DURATION = 300  # ต่ออายุทุกครั้งที่อัตรา join ยังเกิน
+RAID_FLAG_SCORE = 3
+RAID_NAME_CLUSTER = 2  # มีชื่อ key เดียวกันในหน้าต่างแล้วกี่คน = ชื่อคล้าย
+RAID_BATCH_SIZE = 100
+RAID_BATCH_DELAY = 1.0
+RAID_MAX_RECENT = 2000  # join ที่จำต่อ guild (กัน memory บวมตอน raid ใหญ่)
+
+NAME_NOISE = re.compile(r"[\W\d_]+")  # ตัวเลข / เครื่องหมาย / เว้นวรรค (ทุกภาษา ไม่ใช่แค่ a-z)
+
+def name_key(name):
+    # "raider_123", "Raider 456", "r a i d e r" -> "raider", "บอท_01", "บอท 02" -> "บอท"
+    return NAME_NOISE.sub("", name.casefold())[:8]
+
+def join_score(member, similar, now):
+    age = now - member.created_at.timestamp()
+    score = 2 if age < 86400 else 1 if age < 7 * 86400 else 0
+    if member.avatar is None: score += 1
+    if similar >= RAID_NAME_CLUSTER: score += 2
+    return score
+
+class JoinRaidDetector:
+    def __init__(self, max_recent=RAID_MAX_RECENT):
+        self.recent = {}  # guild_id -> deque[(ts, member_id, name_key, flagged)]
+        self.names = {}  # guild_id -> {name_key: จำนวนในหน้าต่าง}
+        self.raid_until = {}  # guild_id -> ts
+        self.held = {}  # guild_id -> deque[member_id] รอจัดการเป็นชุด
+        self.tasks = {}  # guild_id -> Task
+        self.alerts = {}  # guild_id -> Task ของ start_raid (เก็บ ref ไว้ ไม่ให้โดน GC กลาง raid)
+        self.max_recent = max_recent
+        self.stats = {"joins": 0, "flagged": 0, "handled": 0, "raids": 0}
+
+    def active(self, guild_id, now=None):
+        return self.raid_until.get(guild_id, 0) >= (now or time.time())
+
+    def record(self, member, threshold, window, now=None):
+        now = now or time.time()
+        gid = member.guild.id
+        recent = self.recent.get(gid)
+        if recent is None:
+            recent = self.recent[gid] = deque()
+            self.names[gid] = {}
+        names = self.names[gid]
+        while recent and (now - recent[0][0] > window or len(recent) >= self.max_recent):
+            key = recent.popleft()[2]
+            if names[key] > 1: names[key] -= 1
+            else: del names[key]
+
+        key = name_key(member.name)
+        similar = names.get(key, 0) if key else 0
+        names[key] = similar + 1
+        flagged = join_score(member, similar, now) >= RAID_FLAG_SCORE
+        recent.append((now, member.id, key, flagged))
+        self.stats["joins"] += 1
+        self.stats["flagged"] += flagged
+
+        started = False
+        if len(recent) >= threshold:
+            if not self.active(gid, now):
+                # เพิ่งเข้าโหมด raid -> คนที่ถูก flag ก่อนหน้าในหน้าต่างโดนด้วย
+                started = True
+                self.stats["raids"] += 1
+                self.held.setdefault(gid, deque(maxlen=self.max_recent)).extend(mid for _, mid, _, f in recent if f and mid != member.id)
+            self.raid_until[gid] = now + RAID_MODE_DURATION
+        return started, flagged
+
+    def hold(self, guild, action, member_id=None):
+        held = self.held.setdefault(guild.id, deque(maxlen=self.max_recent))
+        if member_id: held.append(member_id)
+        if held and guild.id not in self.tasks:
+            self.tasks[guild.id] = asyncio.create_task(self.drain(guild, action))
+
+    async def drain(self, guild, action):
+        try:
+            held = self.held[guild.id]
+            while held:
+                if len(held) < RAID_BATCH_SIZE: await asyncio.sleep(RAID_BATCH_DELAY)
+                batch = [held.popleft() for _ in range(min(RAID_BATCH_SIZE, len(held)))]
+                # ban/kick ใช้ Object ได้ (คนที่ออกไปแล้วก็ ban ได้), executor รวม ban เป็น bulk_ban ให้เอง
+                targets = [guild.get_member(mid) or discord.Object(mid) for mid in batch]
+                results = await asyncio.gather(*(punisher.submit(guild, t, action, "Anti-Raid") for t in targets))
+                ok = sum(r.ok for r in results)
+                self.stats["handled"] += ok
+                await send_log(guild, "🌊 Raid Batch Handled", f"Handled: **{ok}/{len(batch)}**", color=COLOR_WARN, group=f"Action: **{action}**")
+        finally:
+            del self.tasks[guild.id]
+
+    def sweep(self, now=None):
+        now = now or time.time()
+        for gid in [g for g, recent in self.recent.items() if not self.active(g, now) and (not recent or now - recent[-1][0] > RAID_MODE_DURATION)]:
+            del self.recent[gid], self.names[gid]
+            self.raid_until.pop(gid, None)
+            if not self.held.get(gid): self.held.pop(gid, None)
+
+raid_detector = JoinRaidDetector()
+
+# ==========================================
+# 📨 LOG DISPATCHER (Queue + Coalesce)
+# ==========================================
+# handler แค่โยน log เข้าคิวของห้อง log แล้วไปต่อทันที ไม่รอ Discord
+# worker ต่อห้องส่ง 10 embed ต่อข้อความ, log ซ้ำ (title + group เดียวกัน) รวมเป็น embed สรุปอันเดียว
+LOG_FLUSH_DELAY = 1.0  # เก็บ log สักพักก่อนส่งแต่ละรอบ
+LOG_EMBEDS_PER_MESSAGE = 10
+LOG_MESSAGE_CHARS = 6000  # limit ตัวอักษรรวมทุก embed ในข้อความเดียว
+LOG_QUEUE_MAX = 200  # กลุ่มที่ค้างต่อห้อง: เต็มแล้ว log ธรรมดาโดนทิ้ง, critical ไล่กลุ่มธรรมดาที่เก่าสุดออก
+LOG_GROUP_SAMPLE = 20  # จำนวนคนที่โชว์ใน embed สรุป
+
+class LogGroup:
+    __slots__ = ("title", "description", "color", "group", "critical", "count", "users", "first", "last")
+
+    def __init__(self, title, description, color, group, critical):
+        self.title, self.description, self.color, self.group, self.critical = title, description, color, group, critical
+        self.count, self.users = 0, []
+        self.first = self.last = datetime.datetime.now()
+
+    def add(self, user):
+        self.count += 1
+        self.last = datetime.datetime.now()
+        if user and len(self.users) < LOG_GROUP_SAMPLE and all(u.id != user.id for u in self.users): self.users.append(user)
+
+    def embed(self):
+        if self.count == 1:
+            embed = discord.Embed(title=self.title, description=self.description, color=self.color, timestamp=self.first)
+            if self.users:
+                user = self.users[0]
+                embed.set_author(name=f"{user} ({user.id})", icon_url=user.avatar.url if user.avatar else None)
+        elif self.group is None:
+            embed = discord.Embed(title=f"{self.title} ×{self.count}", description=f"{self.description}\n\nเกิดซ้ำ **{self.count}** ครั้ง", color=self.color, timestamp=self.last)
+        else:
+            users = " ".join(u.mention for u in self.users)
+            more = self.count - len(self.users)
+            if more > 0: users += f" +{more}"
+            embed = discord.Embed(title=f"{self.title} ×{self.count}", description=f"**{self.count}** incidents · {self.group}\nUsers: {users}", color=self.color, timestamp=self.last)
+        embed.set_footer(text="PDR Security System")
+        return embed
+
+class LogDispatcher:
+    def __init__(self):
+        self.queues = {}  # channel_id -> OrderedDict[(title, group) -> LogGroup]
+        self.channels = {}
+        self.workers = {}  # channel_id -> Task
+        self.dropped = {}  # channel_id -> ทิ้งไปกี่รายการตั้งแต่ส่งรอบก่อน
+        self.stats = {"incidents": 0, "messages": 0, "dropped": 0}
+
+    def __len__(self):
+        return sum(len(q) for q in self.queues.values())
+
+    def push(self, channel, title, description, color=COLOR_ERROR, user=None, group=None, critical=False):
+        self.stats["incidents"] += 1
+        queue = self.queues.setdefault(channel.id, OrderedDict())
+        key = (title, description if group is None else group)
+        entry = queue.get(key)
+        if entry is None:
+            if len(queue) >= LOG_QUEUE_MAX and not self.make_room(channel.id, queue, critical): return
+            entry = queue[key] = LogGroup(title, description, color, group, critical)
+        entry.add(user)
+        self.channels[channel.id] = channel
+        if channel.id not in self.workers:
+            self.workers[channel.id] = asyncio.create_task(self.worker(channel.id))
+
+    def make_room(self, channel_id, queue, critical):
+        victim = next((k for k, g in queue.items() if not g.critical), None) if critical else None
+        n = queue.pop(victim).count if victim is not None else (0 if critical else 1)
+        self.dropped[channel_id] = self.dropped.get(channel_id, 0) + n
+        self.stats["dropped"] += n
+        return critical
+
+    async def worker(self, channel_id):
+        try:
+            while self.queues.get(channel_id):
+                await asyncio.sleep(LOG_FLUSH_DELAY)
+                await self.flush(channel_id)
+        finally:
+            del self.workers[channel_id]
+            if not self.queues.get(channel_id):
+                self.queues.pop(channel_id, None)
+                self.channels.pop(channel_id, None)
+
+    async def flush(self, channel_id):
+        queue, channel = self.queues[channel_id], self.channels[channel_id]
+        embeds, size, count = [], 0, 0
+        dropped = self.dropped.pop(channel_id, 0)
+        if dropped:
+            embeds.append(discord.Embed(title="⚠️ Log Overflow", description=f"ทิ้ง log ไป **{dropped}** รายการ (คิวเต็ม)", color=COLOR_WARN))
+            size = len(embeds[0])
+        while queue and len(embeds) < LOG_EMBEDS_PER_MESSAGE:
+            key = next(iter(queue))
+            embed = queue[key].embed()
+            if embeds and size + len(embed) > LOG_MESSAGE_CHARS: break
+            count += queue.pop(key).count
+            embeds.append(embed)
+            size += len(embed)
+
+        for attempt in range(3):
+            try:
+                await channel.send(embeds=embeds)
+                self.stats["messages"] += 1
+                return
+            except discord.HTTPException as e:
+                if e.status != 429 and e.status < 500: break
+                await asyncio.sleep(getattr(e, "retry_after", None) or 2 ** attempt)
+            except Exception: break
+        self.stats["dropped"] += count  # ห้องหาย / ไม่มีสิทธิ์ -> ทิ้งรอบนี้
+
+log_dispatcher = LogDispatcher()
+
+# ==========================================
+# 📓 INCIDENT JOURNAL (Append-Only + Indexed)
+# ==========================================
+# ทุกการตรวจจับ / ลงโทษ = 1 แถว (guild, ใครทำ, ใครโดน, module, action, ผล) -> /incidents ย้อนดูได้
+# handler แค่ต่อท้าย buffer ในแรม แล้วเขียนเป็นชุดเดียว (executemany ใน transaction ของ writer)
+JOURNAL_BATCH = 500          # buffer เต็มเท่านี้ -> flush ทันที
+JOURNAL_FLUSH = 1.0          # วินาที (ดีเลย์สูงสุดกว่าจะลง disk)
+JOURNAL_RETENTION_DAYS = int(os.getenv('JOURNAL_RETENTION_DAYS', 90))
+JOURNAL_PURGE_CHUNK = 10_000 # ลบทีละก้อน ไม่ล็อก writer นาน
+JOURNAL_PAGE = 10
+REASON_MODULES = {"Anti-Spam": "anti_spam", "Anti-Invite": "anti_invite", "Anti-Word": "anti_word", "Mass Mention": "anti_mention",
+                  "Bad Nickname": "anti_link", "Anti-Raid": "anti_raid", "Anti-Flood": "anti_flood"}
+
+def reason_module(reason):
+    label, _, event = reason.partition(": ")
+    if label == "Anti-Nuke": return NUKE_MODULES.get(event, "anti_nuke")
+    return REASON_MODULES.get(label, label)
+
+class IncidentJournal:
+    def __init__(self):
+        self.buffer = []
+        self.written = 0
+        self.purged = 0
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def record(self, guild_id, module, actor_id, target_id, action, result, detail=None):
+        self.buffer.append((guild_id, time.time(), module, actor_id, target_id, action, result, detail))
+        if len(self.buffer) >= JOURNAL_BATCH: self.flush()
+
+    def flush(self):
+        # คืน concurrent Future ของชุดนี้ (ใช้ได้ทั้งใน task และ atexit)
+        rows, self.buffer = self.buffer, []
+        if not rows: return None
+        self.written += len(rows)
+        return db.append_incidents(rows)
+
+    async def drain(self):
+        # /incidents ต้องเห็นแถวที่ยังค้างใน buffer ด้วย
+        fut = self.flush()
+        if fut is not None: await asyncio.wrap_future(fut)
+
+    async def purge(self, days=JOURNAL_RETENTION_DAYS):
+        # ลบแถวเก่าทีละก้อนตามลำดับ id (index เวลา -> หา id ขอบเขตครั้งเดียว) แล้วคืนพื้นที่ให้ไฟล์
+        cutoff = await db.incident_id_at(time.time() - days * 86400)
+        if cutoff is None: cutoff = (await db.fetch("SELECT COALESCE(MAX(id), 0) + 1 FROM incidents", one=True))[0]
+        total = 0
+        while True:
+            n = await db.execute("DELETE FROM incidents WHERE id IN (SELECT id FROM incidents WHERE id < ? ORDER BY id LIMIT ?)", (cutoff, JOURNAL_PURGE_CHUNK))
+            total += n
+            if n < JOURNAL_PURGE_CHUNK: break
+            await asyncio.sleep(0)
+        if total: await asyncio.wrap_future(db.compact())
+        self.purged += total
+        return total
+
+journal = IncidentJournal()
+atexit.register(journal.flush)  # atexit รันย้อนลำดับ -> flush ก่อน db.close
+
+# ==========================================
+# 🧩 CLUSTER MODE (Multi-Process Shards)
+# ==========================================
+# supervisor แตก worker N โปรเซส แต่ละตัวถือ shard เป็นช่วงติดกัน -> guild หนึ่งอยู่ worker เดียวเสมอ
+# state ตรวจจับ (spam / nuke / raid) จึงอยู่ในแรมของ worker นั้นได้เลย ส่วน config / whitelist / backup
+# อยู่ใน SQLite ไฟล์เดียวกัน (WAL อ่านพร้อมกันหลายโปรเซสได้) + ตาราง changes ไว้บอกให้ worker อื่นล้าง cache
+CHANGE_POLL = 1.0            # วินาที (ดีเลย์สูงสุดกว่า /whitelist จะไปถึงทุก worker)
+CHANGE_RETENTION = 3600      # ลบแถว changes ที่เก่ากว่านี้
+CLUSTER_RESTART_DELAY = 1.0
+CLUSTER_MAX_BACKOFF = 60.0
+CLUSTER_STABLE_AFTER = 60.0  # รันนานเกินนี้ก่อนตาย = ไม่ใช่ crash loop -> backoff เริ่มใหม่
+
+class ChangeFeed:
+    def __init__(self):
+        self.last_id = None
+        self.applied = 0
+
+    async def poll(self):
+        if self.last_id is None:
+            # เริ่มจากแถวล่าสุด: ตอนบูต cache ยังว่าง ไม่มีอะไรให้ล้าง
+            self.last_id = await asyncio.get_running_loop().run_in_executor(db.read_pool, db.last_change_id)
+            return 0
+        rows = await db.changes_since(self.last_id)
+        if not rows: return 0
+        self.last_id = rows[-1][0]
+        # แก้ guild เดียวกันหลายครั้งในรอบเดียว -> reload ครั้งเดียว, ของที่ตัวเองเขียน cache อัปเดตไปแล้ว
+        pending = dict.fromkeys((kind, guild_id) for _, kind, guild_id, origin in rows if origin != CLUSTER_ID)
+        for kind, guild_id in pending: await self.apply(kind, guild_id)
+        self.applied += len(pending)
+        return len(pending)
+
+    async def apply(self, kind, guild_id):
+        if kind == "config":
+            # guild 0 = แม่แบบของเซิร์ฟที่ยังไม่เคยตั้งค่า -> ล้างทั้งหมด
+            if guild_id == 0: configs.cache.clear()
+            else: configs.invalidate(guild_id)
+        elif kind == "whitelist": whitelist.load_guild(guild_id, await db.guild_whitelist(guild_id))
+        elif kind == "backup": backups.latest.pop(guild_id, None)
+
+change_feed = ChangeFeed()
+
+def shard_ranges(shard_count, workers):
+    # ช่วงติดกัน ขนาดต่างกันไม่เกิน 1 (worker เกินจำนวน shard = ตัดทิ้ง)
+    workers = min(workers, shard_count)
+    return [list(range(i * shard_count // workers, (i + 1) * shard_count // workers)) for i in range(workers)]
+
+def recommended_shards(workers):
+    # ถาม Discord ว่าควรใช้กี่ shard (ไม่ได้ก็ใช้ worker ละ 1 shard)
+    try:
+        req = urllib.request.Request("https://discord.com/api/v10/gateway/bot", headers={"Authorization": f"Bot {TOKEN}"})
+        with urllib.request.urlopen(req, timeout=10) as res: shards = json.load(res)["shards"]
+    except Exception as e:
+        print(f"⚠️ Shard count lookup failed: {e}")
+        shards = workers
+    return max(shards, workers)
+
+class ClusterSupervisor:
+    def __init__(self, workers, shard_count, argv=None):
+        self.shard_count = shard_count
+        self.ranges = shard_ranges(shard_count, workers)
+        self.argv = argv or [sys.executable, os.path.abspath(__file__)]
+        self.procs = {}       # cluster_id -> Popen
+        self.started = {}     # cluster_id -> monotonic
+        self.backoff = {}     # cluster_id -> ดีเลย์รอบล่าสุด
+        self.restart_at = {}  # cluster_id -> monotonic
+        self.restarts = 0
+        self.stopping = False
+
+    def spawn(self, cluster_id):
+        shards = self.ranges[cluster_id]
+        env = {**os.environ, "CLUSTER_WORKERS": "1", "CLUSTER_ID": str(cluster_id),
+               "SHARD_COUNT": str(self.shard_count), "SHARD_IDS": ",".join(map(str, shards))}
+        proc = self.procs[cluster_id] = subprocess.Popen(self.argv, env=env)
+        self.started[cluster_id] = time.monotonic()
+        print(f"🧩 Worker {cluster_id} started (pid {proc.pid}, shards {shards[0]}-{shards[-1]}/{self.shard_count})")
+
+    def check(self):
+        now = time.monotonic()
+        for cluster_id, proc in list(self.procs.items()):
+            code = proc.poll()
+            if code is None: continue
+            del self.procs[cluster_id]
+            prev = self.backoff.get(cluster_id, 0)
+            stable = now - self.started[cluster_id] >= CLUSTER_STABLE_AFTER
+            delay = CLUSTER_RESTART_DELAY if stable or not prev else min(prev * 2, CLUSTER_MAX_BACKOFF)
+            self.backoff[cluster_id] = delay
+            self.restart_at[cluster_id] = now + delay
+            print(f"⚠️ Worker {cluster_id} exited ({code}) -> restart in {delay:.0f}s")
+        for cluster_id, at in list(self.restart_at.items()):
+            if now < at: continue
+            del self.restart_at[cluster_id]
+            self.restarts += 1
+            self.spawn(cluster_id)
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def run(self, poll=1.0):
+        for cluster_id in range(len(self.ranges)): self.spawn(cluster_id)
+        while not self.stopping:
+            self.check()
+            time.sleep(poll)
+        for proc in self.procs.values(): proc.terminate()
+        for proc in self.procs.values():
+            try: proc.wait(timeout=10)
+            except subprocess.TimeoutExpired: proc.kill()
+
+def run_cluster(workers, shard_count):
+    supervisor = ClusterSupervisor(workers, shard_count)
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    signal.signal(signal.SIGINT, supervisor.stop)
+    keep_alive()  # มีแค่ supervisor ที่ตอบ PORT หลัก
+    supervisor.run()
+
+# ==========================================
+# 🪶 LOW MEMORY MODE (Lean Intents + Cache)
+# ==========================================
+# Intents.all() + cache ปกติ = สมาชิก / presence / ข้อความของทุกเซิร์ฟอยู่ในแรม
+# LOW_MEMORY=1: เปิดเฉพาะ intent ที่ module ที่เปิดอยู่ต้องใช้, ไม่ cache สมาชิก / ข้อความ,
+# chunk สมาชิกเฉพาะตอน index ยศ (ไม่เก็บ) และดึงยศ actor ทีละคนเฉพาะเซิร์ฟที่มี whitelist แบบยศ
+MODULE_INTENTS = {
+    "anti_spam": ("guild_messages", "message_content"),
+    "anti_invite": ("guild_messages", "message_content"),
+    "anti_word": ("guild_messages", "message_content"),
+    "anti_mention": ("guild_messages",),
+    "anti_flood": ("guild_messages",),
+    "anti_nuke": ("moderation", "members"),  # audit log stream + ban, members = chunk ตอน index ยศ
+    "anti_webhook": ("moderation",),
+    "anti_role": ("moderation",),            # ไม่มี member cache -> จับจาก audit log แทน on_member_update
+    "anti_bot": ("members", "moderation"),
+    "anti_link": ("members",),
+    "anti_raid": ("members",),
 }
+BASE_INTENTS = ("guilds",)  # ยศ / ห้อง / thread (lockdown, restore, slash command)
+ACTOR_ROLE_TTL = 60
+ACTOR_ROLE_CACHE = 5_000
+
+def lean_intents(rows):
+    # รวม module ที่เปิดในทุกเซิร์ฟ (+ แม่แบบของเซิร์ฟที่ยังไม่ตั้งค่า) -> เปิด module ที่ใช้ intent ใหม่ต้องรีสตาร์ท
+    confs = dict(rows)
+    confs.setdefault(0, None)
+    intents = discord.Intents.none()
+    for name in BASE_INTENTS: setattr(intents, name, True)
+    for value in confs.values():
+        for module, mod in merge_config(json.loads(value) if value else None, default_conf)["modules"].items():
+            if not mod["enable"]: continue
+            for name in MODULE_INTENTS.get(module, ()): setattr(intents, name, True)
+    return intents
+
+def missing_intents(cfg):
+    if not LOW_MEMORY: return []
+    need = {name for module, mod in cfg["modules"].items() if mod["enable"] for name in MODULE_INTENTS.get(module, ())}
+    return sorted(name for name in need if not getattr(bot.intents, name))
+
+class MemberLite:
+    # แค่ฟิลด์ที่ WhitelistIndex.contains อ่าน (แทน Member ทั้งก้อน)
+    __slots__ = ("id", "_roles")
+
+    def __init__(self, member_id, roles):
+        self.id, self._roles = member_id, roles
+
+class ActorRoles:
+    def __init__(self, max_size=ACTOR_ROLE_CACHE, ttl=ACTOR_ROLE_TTL):
+        self.cache = OrderedDict()  # (guild_id, user_id) -> (expires, MemberLite)
+        self.max_size, self.ttl = max_size, ttl
+        self.fetches = 0
+
+    def __len__(self):
+        return len(self.cache)
+
+    def get(self, guild_id, user_id):
+        entry = self.cache.get((guild_id, user_id))
+        return entry[1] if entry and entry[0] > time.monotonic() else None
+
+    async def load(self, guild, user_id):
+        if self.get(guild.id, user_id) is not None: return
+        self.fetches += 1
+        try: roles = tuple((await guild.fetch_member(user_id))._roles)
+        except discord.HTTPException: roles = ()  # ออกจากเซิร์ฟแล้ว / ดึงไม่ได้ = ไม่มียศ
+        key = (guild.id, user_id)
+        self.cache[key] = (time.monotonic() + self.ttl, MemberLite(user_id, roles))
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_size: self.cache.popitem(last=False)
+
+    def sweep(self):
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self.cache.items() if expires <= now]: del self.cache[key]
 
-current_config = db.get_config(default_conf)
+actor_roles = ActorRoles()
 
 # ==========================================
 # 🤖 BOT SETUP & MONITORING
 # ==========================================
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix="!", intents=intents)
+if LOW_MEMORY:
+    intents = lean_intents(db.query("SELECT guild_id, value FROM guild_config"))
+    cache_options = {"member_cache_flags": discord.MemberCacheFlags.none(), "max_messages": None, "chunk_guilds_at_startup": False}
+else:
+    intents, cache_options = discord.Intents.all(), {}
+if SHARD_IDS:
+    # worker ของ cluster: ต่อ gateway เฉพาะ shard ของตัวเอง
+    bot = commands.AutoShardedBot(command_prefix="!", intents=intents, shard_ids=SHARD_IDS, shard_count=SHARD_COUNT, **cache_options)
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents, **cache_options)
 
-spam_tracker = defaultdict(list)
-nuke_tracker = defaultdict(lambda: defaultdict(list))
+spam_tracker = RateTracker()
+message_index = MessageIndex()
+PROCESS = psutil.Process(os.getpid())  # สร้างครั้งเดียว ใช้ซ้ำทุกที่
+
+metrics.gauge("pdr_rss_bytes", lambda: PROCESS.memory_info().rss)
+metrics.gauge("pdr_guilds", lambda: len(bot.guilds))
+metrics.gauge("pdr_gateway_latency_seconds", lambda: bot.latency)
+metrics.gauge("pdr_spam_tracker_keys", lambda: len(spam_tracker))
+metrics.gauge("pdr_nuke_tracker_actors", lambda: len(nuke_detector))
+metrics.gauge("pdr_message_index_users", lambda: len(message_index))
+metrics.gauge("pdr_config_cache_guilds", lambda: len(configs))
+metrics.gauge("pdr_log_queue_groups", lambda: len(log_dispatcher))
+metrics.gauge("pdr_log_dropped", lambda: log_dispatcher.stats["dropped"])
+metrics.gauge("pdr_punish_pending", lambda: len(punisher.pending))
+metrics.gauge("pdr_punish_running", lambda: len(punisher.running))
+metrics.gauge("pdr_flood_buckets", lambda: len(flood_guard.buckets))
+metrics.gauge("pdr_raid_held", lambda: sum(len(h) for h in list(raid_detector.held.values())))
+metrics.gauge("pdr_db_write_queue", lambda: db.queue.qsize())
+metrics.gauge("pdr_journal_buffered", lambda: len(journal))
+metrics.gauge("pdr_journal_written", lambda: journal.written)
+metrics.gauge("pdr_journal_purged", lambda: journal.purged)
+metrics.gauge("pdr_audit_fallbacks", lambda: audit_feed.fallbacks)
+metrics.gauge("pdr_metrics_enabled", lambda: int(metrics.enabled))
+metrics.gauge("pdr_cluster_changes_applied", lambda: change_feed.applied)
+metrics.gauge("pdr_actor_role_fetches", lambda: actor_roles.fetches)
+metrics.gauge("pdr_protection_ready_seconds", lambda: startup.ready_seconds)
+metrics.gauge("pdr_reconnect_seconds", lambda: startup.reconnect_seconds)
+metrics.gauge("pdr_reconnects", lambda: startup.reconnects)
+metrics.gauge("pdr_startup_backups_pending", lambda: startup.backups_pending)
+nuke_detector = NukeDetector()
 
 # Rate Limit Handling Variables
 STATUS_UPDATE_INTERVAL = 30
@@ -153,8 +2221,7 @@ async def update_status_task():
     try:
         # Resource Monitor
         latency = round(bot.latency * 1000)
-        process = psutil.Process(os.getpid())
-        ram_usage = process.memory_info().rss / 1024 / 1024 # MB
+        ram_usage = PROCESS.memory_info().rss / 1024 / 1024 # MB
         
         status_text = f"🛡️ PDR Security by. sxru7._ | RAM: {ram_usage:.1f}MB | Ping: {latency}ms"
         
@@ -175,60 +2242,178 @@ async def update_status_task():
 async def before_status_update():
     await bot.wait_until_ready()
 
+@tasks.loop(seconds=60)
+async def tracker_cleanup_task():
+    spam_tracker.sweep()
+    message_index.sweep()
+    nuke_detector.sweep()
+    punisher.sweep()
+    raid_detector.sweep()
+    flood_guard.sweep()
+    actor_roles.sweep()
+    if CLUSTER_ID == 0: db.write("DELETE FROM changes WHERE created_at < ?", (time.time() - CHANGE_RETENTION,))
+
+@tasks.loop(seconds=JOURNAL_FLUSH)
+async def journal_flush_task():
+    journal.flush()
+
+@tasks.loop(hours=6)
+async def journal_retention_task():
+    try:
+        n = await journal.purge()
+        if n: print(f"📓 Journal: purged {n} incidents older than {JOURNAL_RETENTION_DAYS}d")
+    except Exception as e: print(f"Journal Retention Error: {e}")
+
+@tasks.loop(seconds=CHANGE_POLL)
+async def change_feed_task():
+    try: await change_feed.poll()
+    except Exception as e: print(f"Change Feed Error: {e}")
+
 # ==========================================
 # 🛠️ HELPER FUNCTIONS
 # ==========================================
-def is_whitelisted(member):
+def is_whitelisted(member, guild=None):
     if member.id == OWNER_ID or member.id == bot.user.id: return True
-    wl = db.manage_whitelist(None, None, "list")
-    wl_ids = [item[0] for item in wl]
-    
-    if member.id in wl_ids: return True
-    if hasattr(member, "roles"):
-        for role in member.roles:
-            if role.id in wl_ids: return True
-    return False
-
-async def send_log(guild, title, description, color=COLOR_ERROR, user=None):
-    if not current_config["log_channel"]: return
-    try:
-        channel = guild.get_channel(current_config["log_channel"])
-        if channel:
-            embed = discord.Embed(title=title, description=description, color=color, timestamp=datetime.datetime.now())
-            if user: embed.set_author(name=f"{user} ({user.id})", icon_url=user.avatar.url if user.avatar else None)
-            embed.set_footer(text="PDR Security System")
-            await channel.send(embed=embed)
-    except: pass
+    guild = guild or getattr(member, "guild", None)
+    guild_id = guild.id if guild else 0
+    # LOW_MEMORY: actor จาก audit เป็น User (ไม่มียศ) -> ใช้ยศที่ resolve_actor ดึงมาเก็บไว้
+    if LOW_MEMORY and not hasattr(member, "_roles"): member = actor_roles.get(guild_id, member.id) or member
+    return whitelist.contains(guild_id, member)
+
+async def send_log(guild, title, description, color=COLOR_ERROR, user=None, group=None, critical=False):
+    # เข้าคิวอย่างเดียว (group = log ที่รวมเป็นสรุปได้, critical = ห้ามทิ้งแม้คิวเต็ม)
+    cfg = await configs.get(guild.id)
+    if not cfg["log_channel"]: return
+    channel = guild.get_channel(cfg["log_channel"])
+    if channel: log_dispatcher.push(channel, title, description, color, user, group, critical)
 
+@metrics.timed("pdr_module_seconds", "backup")
 async def create_backup(guild):
-    roles = []
-    for role in guild.roles:
-        if role.is_default(): continue
-        roles.append({
-            "name": role.name,
-            "permissions": role.permissions.value,
-            "color": role.color.value,
-            "hoist": role.hoist,
-            "mentionable": role.mentionable
-        })
-    db.backup_guild(guild.id, {"roles": roles})
-
-async def execute_punishment(member, action, reason):
-    try:
-        if action == "ban":
-            await member.ban(reason=reason)
-            return "🚫 BANNED"
-        elif action == "kick":
-            await member.kick(reason=reason)
-            return "👢 KICKED"
-        elif action == "timeout":
-            if member.bot: 
-                await member.kick(reason=reason)
-                return "👢 KICKED (Bot)"
-            await member.timeout(datetime.timedelta(minutes=10), reason=reason)
-            return "🔇 TIMEOUT"
-        return "⚠️ WARNED"
-    except: return "❌ FAILED (No Perms)"
+    cfg = await configs.get(guild.id)
+    retention = cfg["backup"]
+    res = await backups.create(guild, retention["keep"], retention["max_age_days"])
+    # สมาชิกของยศใช้แค่ตอนกู้ยศ (anti_nuke) -> LOW_MEMORY จะ chunk เฉพาะเซิร์ฟที่เปิดไว้
+    res["roles_indexed"] = await role_restorer.index(guild, chunk=cfg["modules"]["anti_nuke"]["enable"])
+    return res
+
+async def execute_punishment(member, action, reason, guild=None, priority=PRIORITY_NORMAL):
+    # guild.ban/kick ใช้ได้ทั้ง Member และ User (ผู้กระทำจาก audit log อาจไม่อยู่ใน cache)
+    return await punisher.submit(guild or member.guild, member, action, reason, priority)
+
+background = set()  # task ที่ไม่มีใคร await -> ถือ ref ไว้จนเสร็จ (loop เก็บแค่ weak ref, GC เก็บกลางทางได้)
+
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    background.add(task)
+    task.add_done_callback(background.discard)
+    return task
+
+def punish_then(member, action, reason, log):
+    # handler ไม่ต้องรอผลลงโทษ -> log(res) ตอนงานเสร็จ (journal เขียนใน PunishmentExecutor.finish อยู่แล้ว)
+    fut = punisher.submit(member.guild, member, action, reason)
+    fut.add_done_callback(lambda f: f.cancelled() or spawn(log(f.result())))
+    return fut
+
+async def resolve_actor(guild, entry):
+    actor = await lookup_actor(guild, entry)
+    # LOW_MEMORY: ไม่มี member cache -> ดึงยศ actor รายคน เฉพาะเซิร์ฟที่มี whitelist แบบยศ (ไม่ต้อง chunk ทั้งเซิร์ฟ)
+    if LOW_MEMORY and actor is not None and not hasattr(actor, "_roles") and whitelist.has_roles(guild.id):
+        await actor_roles.load(guild, actor.id)
+    return actor
+
+async def lookup_actor(guild, entry):
+    # entry จาก gateway ไม่มี user payload มาด้วย -> ใช้ cache ก่อน ค่อย fetch
+    if entry.user: return entry.user
+    if entry.user_id is None: return None
+    actor = guild.get_member(entry.user_id) or bot.get_user(entry.user_id)
+    if actor: return actor
+    try: return await bot.fetch_user(entry.user_id)
+    except discord.HTTPException: return None
+
+async def find_audit_entry(guild, action, target_id):
+    entry = await audit_feed.wait(guild.id, action, target_id)
+    if entry is None:
+        # Fallback: gateway ไม่ส่ง entry มาภายใน deadline -> ดึงจาก REST
+        audit_feed.fallbacks += 1
+        try:
+            async for e in guild.audit_logs(limit=5, action=action):
+                if e.target and e.target.id == target_id:
+                    entry = e
+                    break
+        except discord.HTTPException: pass
+    if entry is None: return None
+    return await resolve_actor(guild, entry)
+
+@metrics.timed("pdr_module_seconds", "anti_spam_cleanup")
+async def cleanup_messages(guild, user_id, reason, index=None):
+    # ลบตาม id ที่จำไว้ทุกห้องพร้อมกัน ห้องละไม่เกิน 100 ต่อ call
+    async def clean(channel, ids):
+        for i in range(0, len(ids), 100):
+            try: await channel.delete_messages([discord.Object(mid) for mid in ids[i:i + 100]], reason=reason)
+            except discord.HTTPException: pass
+
+    channels = [(guild.get_channel_or_thread(cid), ids) for cid, ids in (index or message_index).take(guild.id, user_id).items()]
+    await asyncio.gather(*(clean(channel, ids) for channel, ids in channels if channel))
+
+def dangerous_roles(roles):
+    return [r for r in roles if any(value and perm in DANGEROUS_PERMS for perm, value in r.permissions)]
+
+@metrics.timed("pdr_module_seconds", "anti_nuke")
+async def report_nuke(guild, actor, event, detail, target_id=None):
+    # ทุก handler ที่เป็นการกระทำอันตรายส่งมาที่นี่ -> คิดคะแนนรวมแล้วลงโทษเมื่อเกิน threshold
+    cfg = (await configs.get(guild.id))["modules"]
+    nuke = cfg["anti_nuke"]
+    tripped, counts = nuke_detector.record(guild.id, actor.id, event, nuke["weights"].get(event, 1), nuke["threshold"], nuke["window"])
+    module = NUKE_MODULES.get(event, "anti_nuke")
+    journal.record(guild.id, module, actor.id, target_id, event, "tripped" if tripped else "counted", detail)
+    if not tripped: return None
+
+    detected[module].inc()
+    res = await execute_punishment(guild.get_member(actor.id) or actor, cfg[module]["action"], f"Anti-Nuke: {event}", guild=guild, priority=PRIORITY_NUKE)
+    summary = ", ".join(f"{k} x{v}" for k, v in counts.items())
+    await send_log(guild, "🚨 Anti-Nuke", f"User: {actor.mention}\nTrigger: `{summary}`\n{detail}\nAction: **{res}**", user=actor, critical=True)
+    return res
+
+async def check_flood(message):
+    # ข้อความจาก webhook / บอท: เช็คแค่ถัง ไม่ผ่าน scanner (ทางด่วน ไม่ถ่วง traffic ของบอทปกติ)
+    # ข้อความตอบ slash command (webhook_id = application id ของบอท) เป็นผลจากคนกด ไม่ใช่ flood
+    if message.interaction_metadata is not None or is_whitelisted(message.author): return
+    flood = (await configs.get(message.guild.id))["modules"]["anti_flood"]
+    if not flood["enable"]: return
+    source_id = message.webhook_id or message.author.id
+    if flood_guard.hit(message.guild.id, source_id, message.channel.id, message.id, flood):
+        detected["anti_flood"].inc()
+        spawn(handle_flood(message.guild, message.channel, source_id, message.webhook_id is not None, message.author, flood["action"]))
+
+@metrics.timed("pdr_module_seconds", "anti_flood")
+async def handle_flood(guild, channel, source_id, is_webhook, author, action):
+    # 1) ตัดต้นทาง 2) ลบข้อความที่จำไว้ 3) ลงโทษคนสร้าง webhook / บอทที่ยิงเอง
+    creator = None
+    if is_webhook:
+        try:
+            webhook = await bot.fetch_webhook(source_id)
+            creator = webhook.user
+            await webhook.delete(reason="Anti-Flood")
+        except discord.HTTPException: pass
+    else:
+        creator = guild.get_member(source_id) or author
+    await cleanup_messages(guild, source_id, "Anti-Flood", index=flood_guard.index)
+
+    res = "Whitelisted" if creator and is_whitelisted(creator, guild) else "Unknown creator"
+    if creator and res != "Whitelisted":
+        res = await execute_punishment(guild.get_member(creator.id) or creator, action, "Anti-Flood", guild=guild, priority=PRIORITY_NUKE)
+    source = f"Webhook `{source_id}`" if is_webhook else f"Bot <@{source_id}>"
+    journal.record(guild.id, "anti_flood", creator.id if creator else None, source_id, "webhook_delete" if is_webhook else "flood", "detected", f"{source} in #{channel.name}")
+    await send_log(guild, "🌊 Flood Blocked", f"Source: {source} in {channel.mention}\nCreator: {creator.mention if creator else 'Unknown'}\nAction: **{res}**", user=creator, critical=True)
+
+@metrics.timed("pdr_module_seconds", "anti_raid")
+async def start_raid(guild, raid, joins):
+    journal.record(guild.id, "anti_raid", None, None, "raid", "detected", f"{joins} joins / {raid['window']}s")
+    detail = ""
+    if raid["lockdown"]:
+        res = await lockdown.lock(guild, reason="Anti-Raid")
+        detail = f"\nLockdown: **{res['ok']}/{res['total']}** ห้อง (ปลดด้วย `/unlockdown`)"
+    await send_log(guild, "🌊 Join Raid Detected", f"Joins: **{joins}** คนใน {raid['window']} วินาที\nFlagged joiners: **{raid['action']}** (เป็นชุด){detail}", critical=True)
 
 # ==========================================
 # 💻 SLASH COMMANDS
@@ -244,12 +2429,15 @@ ACTION_CHOICES = [
 @bot.tree.command(name="ping", description="เช็คสถานะ, RAM และ Ping ของบอท")
 async def cmd_ping(interaction: discord.Interaction):
     latency = round(bot.latency * 1000)
-    process = psutil.Process(os.getpid())
-    ram = process.memory_info().rss / 1024 / 1024
+    ram = PROCESS.memory_info().rss / 1024 / 1024
     
     embed = discord.Embed(title="🏓 Pong!", color=COLOR_SUCCESS)
     embed.add_field(name="Ping", value=f"`{latency}ms`", inline=True)
     embed.add_field(name="RAM Usage", value=f"`{ram:.2f}MB`", inline=True)
+    embed.add_field(name="Audit REST Fallback", value=f"`{audit_feed.fallbacks}`", inline=True)
+    embed.add_field(name="Log Queue", value=f"`{len(log_dispatcher)}` pending | `{log_dispatcher.stats['dropped']}` dropped", inline=True)
+    embed.add_field(name="Cache", value="`Low-Memory`" if LOW_MEMORY else "`Full`", inline=True)
+    embed.add_field(name="Startup", value=f"`{startup.ready_seconds:.2f}s` ready | `{startup.reconnects}` reconnects", inline=True)
     embed.set_footer(text=f"PDR Security by. sxru7._")
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
@@ -258,32 +2446,44 @@ async def cmd_ping(interaction: discord.Interaction):
 async def cmd_help(interaction: discord.Interaction):
     embed = discord.Embed(title="🛡️ PDR Security Commands", description="รายการคำสั่งทั้งหมด (Visible only to you)", color=COLOR_INFO)
     embed.add_field(name="⚙️ General", value="`/setup` - เปิดใช้งานทุกระบบ\n`/ping` - เช็คสถานะ\n`/set_log` - ตั้งห้องแจ้งเตือน", inline=False)
-    embed.add_field(name="🛡️ Protection Config", value="`/anti_spam` `/anti_nuke` `/anti_bot`\n`/anti_invite` `/anti_link_name` `/anti_mention`\n`/anti_webhook`", inline=False)
-    embed.add_field(name="🚨 Emergency", value="`/lockdown` - ปิดตายเซิร์ฟ\n`/unlockdown` - เปิดเซิร์ฟ\n`/backup` - สำรองยศ\n`/whitelist` - จัดการคนยกเว้น", inline=False)
+    embed.add_field(name="🛡️ Protection Config", value="`/anti_spam` `/anti_nuke` `/nuke_weight` `/anti_raid` `/anti_bot`\n`/anti_invite` `/anti_link_name` `/anti_mention`\n`/anti_webhook` `/anti_flood` `/anti_word` `/filter`", inline=False)
+    embed.add_field(name="🚨 Emergency", value="`/lockdown` - ปิดตายเซิร์ฟ\n`/unlockdown` - เปิดเซิร์ฟ\n`/backup` - สำรองยศ/ห้อง\n`/restore` - กู้ยศที่หายไป\n`/whitelist` - จัดการคนยกเว้น", inline=False)
+    embed.add_field(name="📓 History", value="`/incidents` - ประวัติการตรวจจับ / ลงโทษ", inline=False)
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
 # 3. Setup (Public)
 @bot.tree.command(name="setup", description="เปิดใช้งานระบบป้องกันทั้งหมด (Enable All)")
 @app_commands.checks.has_permissions(administrator=True)
 async def cmd_setup(interaction: discord.Interaction):
-    global current_config
-    for key in current_config["modules"]:
-        current_config["modules"][key]["enable"] = True
-    db.save_config(current_config)
+    cfg = await configs.get(interaction.guild.id)
+    for key in cfg["modules"]:
+        cfg["modules"][key]["enable"] = True
+    await configs.save(interaction.guild.id, cfg)
     
     embed = discord.Embed(title="🛡️ PDR Security Online", description="**Status: ACTIVE**\nAll protection modules have been enabled.", color=COLOR_SUCCESS)
-    embed.add_field(name="Modules", value="`Anti-Nuke`, `Anti-Spam`, `Anti-Bot`, `Anti-Webhook`,\n`Anti-Invite`, `Anti-Link`, `Anti-Mention`", inline=False)
+    embed.add_field(name="Modules", value="`Anti-Nuke`, `Anti-Spam`, `Anti-Bot`, `Anti-Webhook`,\n`Anti-Invite`, `Anti-Link`, `Anti-Mention`, `Anti-Word`, `Anti-Flood`", inline=False)
+    add_intent_warning(embed, cfg)
     embed.set_thumbnail(url=bot.user.avatar.url if bot.user.avatar else None)
     embed.set_footer(text="Security by. sxru7._")
     await interaction.response.send_message(embed=embed, ephemeral=False)
 
 # 4. Anti Config Commands
-async def update_config(interaction, module, status, action, name):
-    current_config["modules"][module] = {"enable": status, "action": action.value}
-    db.save_config(current_config)
+def add_intent_warning(embed, cfg):
+    # LOW_MEMORY: intent เลือกตอนบูต -> module ที่เพิ่งเปิดจะทำงานหลังรีสตาร์ท
+    missing = missing_intents(cfg)
+    if missing: embed.add_field(name="⚠️ Restart Required", value=f"Low-memory mode: รีสตาร์ทบอทเพื่อเปิด intent `{', '.join(missing)}`", inline=False)
+
+async def update_config(interaction, module, status, action, name, **settings):
+    cfg = await configs.get(interaction.guild.id)
+    mod = cfg["modules"][module]
+    mod.update(enable=status, action=action.value)
+    mod.update({k: v for k, v in settings.items() if v is not None})
+    await configs.save(interaction.guild.id, cfg)
     embed = discord.Embed(title=f"⚙️ {name} Updated", color=COLOR_INFO)
     embed.add_field(name="Status", value="✅ Enabled" if status else "❌ Disabled", inline=True)
     embed.add_field(name="Action", value=f"**{action.name}**", inline=True)
+    if "threshold" in mod: embed.add_field(name="Limit", value=f"`{mod['threshold']}` ครั้ง / `{mod['window']}` วินาที", inline=True)
+    add_intent_warning(embed, cfg)
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="anti_webhook", description="ตั้งค่าป้องกัน Webhook Spam")
@@ -293,8 +2493,8 @@ async def cmd_webhook(interaction: discord.Interaction, status: bool, action: ap
 
 @bot.tree.command(name="anti_spam", description="ตั้งค่า Anti-Spam")
 @app_commands.choices(action=ACTION_CHOICES)
-async def cmd_spam(interaction: discord.Interaction, status: bool, action: app_commands.Choice[str]):
-    await update_config(interaction, "anti_spam", status, action, "Anti-Spam")
+async def cmd_spam(interaction: discord.Interaction, status: bool, action: app_commands.Choice[str], threshold: app_commands.Range[int, 2, 50] = None, window: app_commands.Range[int, 1, 60] = None):
+    await update_config(interaction, "anti_spam", status, action, "Anti-Spam", threshold=threshold, window=window)
 
 @bot.tree.command(name="anti_invite", description="ตั้งค่า Anti-Invite")
 @app_commands.choices(action=ACTION_CHOICES)
@@ -316,34 +2516,123 @@ async def cmd_bot(interaction: discord.Interaction, status: bool, action: app_co
 async def cmd_link(interaction: discord.Interaction, status: bool, action: app_commands.Choice[str]):
     await update_config(interaction, "anti_link", status, action, "Anti-Link Name")
 
+@bot.tree.command(name="anti_word", description="ตั้งค่า Anti-Word (คำต้องห้าม / โดเมนต้องห้าม)")
+@app_commands.choices(action=ACTION_CHOICES)
+async def cmd_word(interaction: discord.Interaction, status: bool, action: app_commands.Choice[str]):
+    await update_config(interaction, "anti_word", status, action, "Anti-Word")
+
+@bot.tree.command(name="filter", description="จัดการคำต้องห้าม / โดเมนต้องห้าม")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.choices(
+    action=[app_commands.Choice(name="Add", value="add"), app_commands.Choice(name="Remove", value="remove"), app_commands.Choice(name="List", value="list")],
+    kind=[app_commands.Choice(name="Word", value="banned_words"), app_commands.Choice(name="Domain", value="blocked_domains")]
+)
+async def cmd_filter(interaction: discord.Interaction, action: app_commands.Choice[str], kind: app_commands.Choice[str], value: str = None):
+    cfg = await configs.get(interaction.guild.id)
+    entries = cfg[kind.value]
+    if action.value == "list":
+        text = ", ".join(f"`{e}`" for e in entries) or "(ว่าง)"
+        embed = discord.Embed(title=f"📜 {kind.name} Filter", description=text[:4000], color=COLOR_INFO)
+        return await interaction.response.send_message(embed=embed, ephemeral=True)
+    if not value: return await interaction.response.send_message("❌ ต้องระบุ value", ephemeral=True)
+
+    value = value.strip().lower()
+    if action.value == "add": res = value not in entries
+    else: res = value in entries
+    if res:
+        cfg[kind.value] = entries + [value] if action.value == "add" else [e for e in entries if e != value]
+        await configs.save(interaction.guild.id, cfg)
+    embed = discord.Embed(title="✅ Success" if res else "❌ Failed", description=f"Action: {action.name} {kind.name} `{value}`", color=COLOR_SUCCESS if res else COLOR_ERROR)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 @bot.tree.command(name="anti_nuke", description="ตั้งค่า Anti-Nuke")
 @app_commands.choices(action=[app_commands.Choice(name="Ban", value="ban"), app_commands.Choice(name="Kick", value="kick")])
-async def cmd_nuke(interaction: discord.Interaction, status: bool, action: app_commands.Choice[str]):
-    await update_config(interaction, "anti_nuke", status, action, "Anti-Nuke")
+async def cmd_nuke(interaction: discord.Interaction, status: bool, action: app_commands.Choice[str], threshold: app_commands.Range[int, 1, 50] = None, window: app_commands.Range[int, 1, 600] = None):
+    await update_config(interaction, "anti_nuke", status, action, "Anti-Nuke", threshold=threshold, window=window)
+
+@bot.tree.command(name="nuke_weight", description="ตั้งน้ำหนักคะแนน Anti-Nuke ของแต่ละการกระทำ")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.choices(event=[app_commands.Choice(name=name, value=name) for name in NUKE_WEIGHTS])
+async def cmd_nuke_weight(interaction: discord.Interaction, event: app_commands.Choice[str], weight: app_commands.Range[float, 0, 50]):
+    cfg = await configs.get(interaction.guild.id)
+    nuke = cfg["modules"]["anti_nuke"]
+    nuke["weights"][event.value] = weight
+    await configs.save(interaction.guild.id, cfg)
+    text = "\n".join(f"`{k}`: **{v:g}**" for k, v in nuke["weights"].items())
+    embed = discord.Embed(title="☢️ Anti-Nuke Weights", description=f"{text}\n\nThreshold: **{nuke['threshold']}** / {nuke['window']}s", color=COLOR_INFO)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="anti_raid", description="ตั้งค่า Anti-Raid (คนเข้าเซิร์ฟรัวๆ)")
+@app_commands.choices(action=ACTION_CHOICES)
+async def cmd_raid(interaction: discord.Interaction, status: bool, action: app_commands.Choice[str], threshold: app_commands.Range[int, 3, 500] = None, window: app_commands.Range[int, 1, 300] = None, lockdown: bool = None):
+    await update_config(interaction, "anti_raid", status, action, "Anti-Raid", threshold=threshold, window=window, lockdown=lockdown)
+
+@bot.tree.command(name="anti_flood", description="ตั้งค่า Anti-Flood (ข้อความรัวจาก Webhook / บอท)")
+@app_commands.choices(action=ACTION_CHOICES)
+async def cmd_flood(interaction: discord.Interaction, status: bool, action: app_commands.Choice[str], threshold: app_commands.Range[int, 3, 200] = None, window: app_commands.Range[int, 1, 60] = None, channel_threshold: app_commands.Range[int, 5, 500] = None):
+    await update_config(interaction, "anti_flood", status, action, "Anti-Flood", threshold=threshold, window=window, channel_threshold=channel_threshold)
+
+@bot.tree.command(name="metrics_toggle", description="เปิด/ปิดการเก็บ metrics (/metrics บนเว็บ)")
+async def cmd_metrics_toggle(interaction: discord.Interaction, status: bool):
+    if interaction.user.id != OWNER_ID: return await interaction.response.send_message("❌ Owner Only", ephemeral=True)
+    metrics.enabled = status
+    embed = discord.Embed(title="📈 Metrics", description="✅ Enabled" if status else "❌ Disabled", color=COLOR_INFO)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
 
 # 5. Lockdown / Backup / Whitelist
+def lockdown_progress(message, title):
+    # แก้ข้อความ progress ไม่เกินทุก 1.5 วิ (กันโดน rate limit เอง)
+    last = [0.0]
+    async def update(done, total):
+        now = time.monotonic()
+        if done < total and now - last[0] < 1.5: return
+        last[0] = now
+        try: await message.edit(embed=discord.Embed(title=title, description=f"`{done}/{total}` ห้อง", color=COLOR_WARN))
+        except discord.HTTPException: pass
+    return update
+
 @bot.tree.command(name="lockdown", description="🔒 EMERGENCY: ปิดตายเซิร์ฟเวอร์")
 @app_commands.checks.has_permissions(administrator=True)
 async def cmd_lockdown(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
-    for channel in interaction.guild.text_channels:
-        try: await channel.set_permissions(interaction.guild.default_role, send_messages=False)
-        except: pass
-    
+    message = await interaction.followup.send(embed=discord.Embed(title="🔒 Locking...", color=COLOR_WARN), wait=True)
+    res = await lockdown.lock(interaction.guild, reason=f"Lockdown by {interaction.user}", progress=lockdown_progress(message, "🔒 Locking..."))
+
     embed = discord.Embed(title="🔒 Lockdown Activated", description="Server has been locked down.", color=COLOR_WARN)
-    await interaction.followup.send(embed=embed)
-    await send_log(interaction.guild, "🔒 Lockdown Enabled", f"Admin: {interaction.user.mention}")
+    embed.add_field(name="Channels", value=f"`{res['ok']}/{res['total']}`", inline=True)
+    embed.add_field(name="Time", value=f"`{res['seconds']:.1f}s`", inline=True)
+    if res["failed"]: embed.add_field(name="Failed", value=f"`{res['failed']}`", inline=True)
+    await message.edit(embed=embed)
+    await send_log(interaction.guild, "🔒 Lockdown Enabled", f"Admin: {interaction.user.mention}\nChannels: **{res['ok']}/{res['total']}**")
 
 @bot.tree.command(name="unlockdown", description="🔓 ยกเลิก Lockdown")
 @app_commands.checks.has_permissions(administrator=True)
 async def cmd_unlockdown(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
-    for channel in interaction.guild.text_channels:
-        try: await channel.set_permissions(interaction.guild.default_role, send_messages=True)
-        except: pass
-    
+    message = await interaction.followup.send(embed=discord.Embed(title="🔓 Unlocking...", color=COLOR_WARN), wait=True)
+    res = await lockdown.unlock(interaction.guild, reason=f"Unlockdown by {interaction.user}", progress=lockdown_progress(message, "🔓 Unlocking..."))
+    if not res["total"]:
+        return await message.edit(embed=discord.Embed(title="ℹ️ No Lockdown", description="ไม่มี lockdown ที่บันทึกไว้", color=COLOR_INFO))
+
     embed = discord.Embed(title="🔓 Lockdown Lifted", description="Server is back to normal.", color=COLOR_SUCCESS)
+    embed.add_field(name="Restored", value=f"`{res['ok']}/{res['total']}`", inline=True)
+    if res["failed"]: embed.add_field(name="Failed (รัน /unlockdown ซ้ำได้)", value=f"`{res['failed']}`", inline=True)
+    await message.edit(embed=embed)
+    await send_log(interaction.guild, "🔓 Lockdown Lifted", f"Admin: {interaction.user.mention}\nChannels: **{res['ok']}/{res['total']}**", color=COLOR_SUCCESS)
+
+@bot.tree.command(name="restore", description="♻️ สร้างยศที่หายไปคืนจาก Backup (พร้อมตำแหน่ง + สมาชิก)")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(legacy="สร้างยศจาก backup ก่อนอัปเกรด (เทียบด้วยชื่อ ไม่มีสมาชิก) ที่ยังไม่มีในเซิร์ฟด้วย")
+async def cmd_restore(interaction: discord.Interaction, legacy: bool = False):
+    await interaction.response.defer(ephemeral=True)
+    res = await role_restorer.restore(interaction.guild, legacy=legacy)
+    embed = discord.Embed(title="♻️ Restore Complete", color=COLOR_SUCCESS if not res["failed"] else COLOR_WARN)
+    embed.add_field(name="Created", value=f"`{res['created']}`", inline=True)
+    embed.add_field(name="Failed", value=f"`{res['failed']}`", inline=True)
+    embed.add_field(name="Members", value=f"`{res['members']}`", inline=True)
+    embed.add_field(name="Overwrites", value=f"`{res['overwrites']}`", inline=True)
     await interaction.followup.send(embed=embed)
+    await send_log(interaction.guild, "♻️ Manual Restore", f"Admin: {interaction.user.mention}\nCreated: **{res['created']}** roles", color=COLOR_SUCCESS)
 
 @bot.tree.command(name="whitelist", description="จัดการ Whitelist")
 @app_commands.choices(action=[app_commands.Choice(name="Add", value="add"), app_commands.Choice(name="Remove", value="remove"), app_commands.Choice(name="List", value="list")])
@@ -351,184 +2640,408 @@ async def cmd_whitelist(interaction: discord.Interaction, action: app_commands.C
     if interaction.user.id != OWNER_ID: return await interaction.response.send_message("❌ Owner Only", ephemeral=True)
     
     if action.value == "list":
-        wl = db.manage_whitelist(None, None, "list")
-        embed = discord.Embed(title="📜 Whitelist Database", description=str(wl), color=COLOR_INFO)
+        wl = await db.manage_whitelist(interaction.guild.id, None, None, "list")
+        # global (0) มาจาก whitelist เดิม ใช้ได้ทุกเซิร์ฟ -> ติดป้ายไว้ (/whitelist remove ลบได้จากเซิร์ฟไหนก็ได้)
+        text = "\n".join(f"{'<@&' if ttype == 'role' else '<@'}{tid}> `{tid}`{' (global)' if gid == 0 else ''}" for gid, tid, ttype in wl)
+        embed = discord.Embed(title="📜 Whitelist Database", description=text or "(ว่าง)", color=COLOR_INFO)
         return await interaction.response.send_message(embed=embed, ephemeral=True)
 
     tid = target.id if target else role.id
     ttype = "user" if target else "role"
     
-    res = db.manage_whitelist(tid, ttype, action.value)
+    res = await db.manage_whitelist(interaction.guild.id, tid, ttype, action.value)
+    if res and action.value == "add": whitelist.add(interaction.guild.id, tid, ttype)
+    elif action.value == "remove":
+        if res is not None: whitelist.remove(res, tid)
+        res = res is not None
     embed = discord.Embed(title="✅ Success" if res else "❌ Failed", description=f"Action: {action.name} {tid}", color=COLOR_SUCCESS if res else COLOR_ERROR)
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="set_log", description="ตั้งห้อง Log")
 async def cmd_set_log(interaction: discord.Interaction, channel: discord.TextChannel):
-    current_config["log_channel"] = channel.id
-    db.save_config(current_config)
+    cfg = await configs.get(interaction.guild.id)
+    cfg["log_channel"] = channel.id
+    await configs.save(interaction.guild.id, cfg)
     embed = discord.Embed(title="📝 Log Channel Set", description=f"Channel: {channel.mention}", color=COLOR_SUCCESS)
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
-@bot.tree.command(name="backup", description="สำรองข้อมูลยศ (Manual Backup)")
+@bot.tree.command(name="backup", description="สำรองข้อมูลยศ/ห้อง (Manual Backup)")
+@app_commands.checks.has_permissions(administrator=True)
+async def cmd_backup(interaction: discord.Interaction, keep: app_commands.Range[int, 1, 500] = None, max_age_days: app_commands.Range[int, 1, 365] = None):
+    await interaction.response.defer(ephemeral=True)
+    cfg = await configs.get(interaction.guild.id)
+    if keep or max_age_days:
+        if keep: cfg["backup"]["keep"] = keep
+        if max_age_days: cfg["backup"]["max_age_days"] = max_age_days
+        await configs.save(interaction.guild.id, cfg)
+
+    res = await create_backup(interaction.guild)
+    status = {"unchanged": "♻️ ไม่มีอะไรเปลี่ยน (ไม่เขียนซ้ำ)", "delta": "🧩 Delta", "full": "📦 Full Snapshot"}[res["status"]]
+    embed = discord.Embed(title="💾 Backup Complete", description=status, color=COLOR_SUCCESS)
+    embed.add_field(name="Size", value=f"`{res['bytes'] / 1024:.1f}KB` (raw `{res['raw'] / 1024:.1f}KB`)", inline=True)
+    embed.add_field(name="Retention", value=f"`{cfg['backup']['keep']}` อัน / `{cfg['backup']['max_age_days']}` วัน", inline=True)
+    await interaction.followup.send(embed=embed)
+
+# 6. Incidents
+INCIDENT_TARGETS = {"role_delete": "<@&{}>", "channel_delete": "<#{}>", "webhook_create": "`{}`", "webhook_delete": "`{}`"}
+
+def parse_when(text):
+    # "YYYY-MM-DD" หรือ "YYYY-MM-DD HH:MM" (UTC) -> unix time
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try: return datetime.datetime.strptime(text.strip(), fmt).replace(tzinfo=datetime.timezone.utc).timestamp()
+        except ValueError: pass
+    raise ValueError(text)
+
+def incident_line(row):
+    iid, ts, module, actor_id, target_id, action, result, detail = row
+    who = f" by <@{actor_id}>" if actor_id else ""
+    target = f" → {INCIDENT_TARGETS.get(action, '<@{}>').format(target_id)}" if target_id else ""
+    note = f"\n> {detail[:80]}" if detail else ""
+    return f"`#{iid}` <t:{int(ts)}:R> **{module}** `{action}` ({result}){who}{target}{note}"
+
+@bot.tree.command(name="incidents", description="ดูประวัติการตรวจจับ / ลงโทษ (กรองตามคน, module, ช่วงเวลา)")
 @app_commands.checks.has_permissions(administrator=True)
-async def cmd_backup(interaction: discord.Interaction):
+@app_commands.describe(since="UTC: YYYY-MM-DD หรือ YYYY-MM-DD HH:MM", until="UTC: YYYY-MM-DD หรือ YYYY-MM-DD HH:MM", cursor="เลขจาก footer ของหน้าก่อน")
+@app_commands.choices(module=[app_commands.Choice(name=k, value=k) for k in default_conf["modules"]])
+async def cmd_incidents(interaction: discord.Interaction, user: discord.User = None, module: app_commands.Choice[str] = None, since: str = None, until: str = None, cursor: int = None):
+    try: start, end = (parse_when(since) if since else None), (parse_when(until) if until else None)
+    except ValueError as e: return await interaction.response.send_message(f"❌ รูปแบบเวลาไม่ถูกต้อง: `{e}`", ephemeral=True)
     await interaction.response.defer(ephemeral=True)
-    await create_backup(interaction.guild)
-    embed = discord.Embed(title="💾 Backup Complete", color=COLOR_SUCCESS)
+    await journal.drain()
+    rows = await db.incidents(interaction.guild.id, user.id if user else None, module.value if module else None, start, end, cursor, JOURNAL_PAGE + 1)
+
+    page = rows[:JOURNAL_PAGE]
+    filters = " | ".join(f for f in (user and f"User: {user.mention}", module and f"Module: `{module.value}`", since and f"Since: `{since}`", until and f"Until: `{until}`") if f)
+    text = "\n".join(incident_line(r) for r in page) or "(ไม่มีรายการ)"
+    embed = discord.Embed(title="📓 Incidents", description=f"{filters}\n\n{text}" if filters else text, color=COLOR_INFO)
+    if len(rows) > JOURNAL_PAGE: embed.set_footer(text=f"หน้าถัดไป: /incidents cursor:{page[-1][0]}")
     await interaction.followup.send(embed=embed)
 
+# ==========================================
+# 🚀 STARTUP PIPELINE (on_ready)
+# ==========================================
+# on_ready ยิงใหม่ทุกครั้งที่ gateway ต่อ session ใหม่ -> งานครั้งเดียวทำแค่ครั้งแรกของโปรเซส
+# protection พร้อม = task + config ของทุกเซิร์ฟอยู่ในแรม, ที่เหลือ (sync / backup) วิ่งเบื้องหลัง
+STARTUP_BACKUP_CONCURRENCY = 4
+STARTUP_BACKUP_STAGGER = 0.05  # วินาที (เว้นจังหวะให้ event จริงได้รันระหว่าง backup)
+
+def command_tree_hash(tree, application_id):
+    # payload เดียวกับที่ tree.sync() อัปโหลด -> hash ตรง = ฝั่ง Discord มีชุดนี้อยู่แล้ว
+    payload = sorted((cmd.to_dict(tree) for cmd in tree.get_commands()), key=lambda c: c["name"])
+    raw = json.dumps([application_id, payload], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+class StartupPipeline:
+    def __init__(self):
+        self.started = False
+        self.login_at = None               # เริ่มจับเวลาที่ setup_hook (หลัง login ก่อนต่อ gateway)
+        self.ready_seconds = math.nan      # login -> protection ready
+        self.reconnect_seconds = math.nan  # หลุด -> กลับมา (ครั้งล่าสุด)
+        self.reconnects = 0
+        self.disconnected_at = None
+        self.backed_up = set()  # guild ที่ backup แล้วในโปรเซสนี้
+        self.backups_pending = 0
+        self.synced = None  # True = sync, False = hash ตรงเลยข้าม
+        self.tasks = set()  # ถือ ref ของงานเบื้องหลัง (sync / backup) กัน GC เก็บกลางทาง
+
+    async def begin(self):
+        self.login_at = time.monotonic()
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def ready(self):
+        if self.started:
+            self.reconnected()
+            self.schedule_backups()  # เฉพาะ guild ที่เพิ่งเห็นครั้งแรก
+            return False
+        self.started = True
+        if self.login_at is None: self.login_at = time.monotonic()
+        await configs.preload([g.id for g in bot.guilds])
+        self.ready_seconds = time.monotonic() - self.login_at
+        print(f"🛡️ Protection ready in {self.ready_seconds:.2f}s ({len(bot.guilds)} guilds)")
+        # command tree เป็นของทั้งแอป -> ใน cluster ให้ worker 0 sync คนเดียว
+        if CLUSTER_ID <= 0: self.spawn(self.sync_commands())
+        self.schedule_backups()
+        return True
+
+    def disconnected(self):
+        if self.disconnected_at is None: self.disconnected_at = time.monotonic()
+
+    def reconnected(self):
+        if self.disconnected_at is None: return
+        self.reconnects += 1
+        self.reconnect_seconds = time.monotonic() - self.disconnected_at
+        self.disconnected_at = None
+
+    async def sync_commands(self):
+        digest = command_tree_hash(bot.tree, bot.application_id)
+        if await db.get_setting("command_tree_hash") == digest:
+            self.synced = False
+            print("✅ Slash Commands unchanged (skip sync)")
+            return
+        try:
+            await bot.tree.sync()
+            await db.set_setting("command_tree_hash", digest)
+            self.synced = True
+            print("✅ Slash Commands Synced")
+        except Exception as e:
+            print(f"❌ Sync Error: {e}")
+
+    def schedule_backups(self):
+        guilds = [g for g in bot.guilds if g.id not in self.backed_up]
+        if not guilds: return
+        self.backed_up.update(g.id for g in guilds)
+        self.backups_pending += len(guilds)
+        self.spawn(self.run_backups(guilds))
+
+    async def run_backups(self, guilds):
+        sem = asyncio.Semaphore(STARTUP_BACKUP_CONCURRENCY)
+
+        async def backup(guild):
+            async with sem:
+                try: await create_backup(guild)
+                except Exception as e:
+                    self.backed_up.discard(guild.id)  # ลองใหม่ตอน reconnect ครั้งหน้า
+                    print(f"Backup Error ({guild.id}): {e}")
+                finally: self.backups_pending -= 1
+                await asyncio.sleep(STARTUP_BACKUP_STAGGER)
+
+        await asyncio.gather(*(backup(g) for g in guilds))
+
+startup = StartupPipeline()
+bot.setup_hook = startup.begin  # discord.py เรียกหลัง login ก่อนเปิด gateway
+
 # ==========================================
 # 🚨 EVENT HANDLERS (LOGIC)
 # ==========================================
 
 @bot.event
+@metrics.timed("pdr_handler_seconds", "on_ready")
 async def on_ready():
-    print(f"🔥 Bot Online: {bot.user}")
-    print("------------------------------")
+    if not startup.started:
+        print(f"🔥 Bot Online: {bot.user}")
+        print("------------------------------")
     if not update_status_task.is_running():
         update_status_task.start()
-    
-    try:
-        await bot.tree.sync()
-        print("✅ Slash Commands Synced")
-    except Exception as e:
-        print(f"❌ Sync Error: {e}")
-        
-    for guild in bot.guilds: await create_backup(guild)
+    if not tracker_cleanup_task.is_running():
+        tracker_cleanup_task.start()
+    if not journal_flush_task.is_running():
+        journal_flush_task.start()
+    if CLUSTER_ID <= 0 and not journal_retention_task.is_running():
+        journal_retention_task.start()
+    if CLUSTER_ID >= 0 and not change_feed_task.is_running():
+        change_feed_task.start()
+    await startup.ready()
+
+@bot.event
+async def on_disconnect():
+    startup.disconnected()
+
+@bot.event
+async def on_resumed():
+    startup.reconnected()
 
 @bot.event
+@metrics.timed("pdr_handler_seconds", "on_message")
 async def on_message(message):
-    if message.author.bot or is_whitelisted(message.author): return
-    cfg = current_config["modules"]
+    if message.guild is None: return
+    if message.author.bot or message.webhook_id: return await check_flood(message)
+    if is_whitelisted(message.author): return
+    cfg = (await configs.get(message.guild.id))["modules"]
+    hits = configs.scanner(message.guild.id).scan_message(message.content)
 
     # Anti-Invite
-    if cfg["anti_invite"]["enable"] and re.search(DISCORD_INVITE_PATTERN, message.content, re.IGNORECASE):
+    if "anti_invite" in hits:
+        detected["anti_invite"].inc()
         await message.delete()
-        res = await execute_punishment(message.author, cfg["anti_invite"]["action"], "Anti-Invite")
-        await send_log(message.guild, "🚫 Invite Blocked", f"User: {message.author.mention}\nAction: **{res}**", user=message.author)
+        punish_then(message.author, cfg["anti_invite"]["action"], "Anti-Invite",
+                    lambda res: send_log(message.guild, "🚫 Invite Blocked", f"User: {message.author.mention}\nAction: **{res}**", user=message.author, group=f"{message.channel.mention} · **{res}**"))
+        return
+
+    # Anti-Word (คำต้องห้าม / โดเมนต้องห้าม)
+    if "banned_word" in hits or "blocked_domain" in hits:
+        detected["anti_word"].inc()
+        await message.delete()
+        rules = ", ".join(sorted(hits - {"anti_invite"}))
+        punish_then(message.author, cfg["anti_word"]["action"], "Anti-Word",
+                    lambda res: send_log(message.guild, "🤬 Filtered Content", f"User: {message.author.mention}\nRule: `{rules}`\nAction: **{res}**", user=message.author, group=f"{message.channel.mention} · `{rules}` · **{res}**"))
         return
     
     # Anti-Mention
     if cfg["anti_mention"]["enable"] and message.mention_everyone:
+        detected["anti_mention"].inc()
         await message.delete()
-        res = await execute_punishment(message.author, cfg["anti_mention"]["action"], "Mass Mention")
-        await send_log(message.guild, "⚠️ Mass Mention", f"User: {message.author.mention}\nAction: **{res}**", user=message.author)
+        punish_then(message.author, cfg["anti_mention"]["action"], "Mass Mention",
+                    lambda res: send_log(message.guild, "⚠️ Mass Mention", f"User: {message.author.mention}\nAction: **{res}**", user=message.author, group=f"{message.channel.mention} · **{res}**"))
         return
 
     # Anti-Spam
-    if cfg["anti_spam"]["enable"]:
+    spam = cfg["anti_spam"]
+    if spam["enable"]:
         uid = message.author.id
-        now = datetime.datetime.now()
-        spam_tracker[uid].append(now)
-        spam_tracker[uid] = [t for t in spam_tracker[uid] if (now - t).total_seconds() < SPAM_TIME]
-        
-        if len(spam_tracker[uid]) >= SPAM_THRESHOLD:
-            try: await message.channel.purge(limit=SPAM_THRESHOLD, check=lambda m: m.author.id == uid)
-            except: pass
-            
-            res = await execute_punishment(message.author, cfg["anti_spam"]["action"], "Anti-Spam")
-            await send_log(message.guild, "🔇 Spam Detected", f"User: {message.author.mention}\nAction: **{res}**", user=message.author)
-            spam_tracker[uid] = []
+        key = (message.guild.id, uid)
+        message_index.add(message.guild.id, uid, message.channel.id, message.id)
+        if spam_tracker.hit(key, spam["threshold"], spam["window"]):
+            spam_tracker.reset(key)
+            detected["anti_spam"].inc()
+            spawn(cleanup_messages(message.guild, uid, "Anti-Spam"))
+
+            punish_then(message.author, spam["action"], "Anti-Spam",
+                        lambda res: send_log(message.guild, "🔇 Spam Detected", f"User: {message.author.mention}\nAction: **{res}**", user=message.author, group=f"{message.channel.mention} · **{res}**"))
 
     await bot.process_commands(message)
 
-# 🔥 Anti-Webhook Logic
+# 🔥 Audit Log Stream (kick / webhook ไม่มี raw event ที่เชื่อถือได้ -> ใช้ audit entry ตรงๆ)
 @bot.event
-async def on_webhooks_update(channel):
-    if not current_config["modules"]["anti_webhook"]["enable"]: return
-    await asyncio.sleep(0.5) 
-    async for entry in channel.guild.audit_logs(limit=1, action=discord.AuditLogAction.webhook_create):
-        if is_whitelisted(entry.user): return
-        
-        webhooks = await channel.webhooks()
-        for wh in webhooks:
-            if wh.user.id == entry.user.id:
-                try: await wh.delete(reason="Anti-Webhook")
-                except: pass
-        
-        res = await execute_punishment(entry.user, current_config["modules"]["anti_webhook"]["action"], "Anti-Webhook")
-        await send_log(channel.guild, "🎣 Anti-Webhook", f"Creator: {entry.user.mention}\nAction: **{res}**", user=entry.user)
-        break
+@metrics.timed("pdr_handler_seconds", "on_audit_log_entry_create")
+async def on_audit_log_entry_create(entry):
+    audit_feed.push(entry)
+    if entry.action == discord.AuditLogAction.kick: await handle_kick(entry)
+    elif entry.action == discord.AuditLogAction.webhook_create: await handle_webhook_create(entry)
+    elif LOW_MEMORY and entry.action == discord.AuditLogAction.member_role_update: await handle_role_grant(entry)
+
+@metrics.timed("pdr_module_seconds", "anti_nuke_kick")
+async def handle_kick(entry):
+    guild = entry.guild
+    if not (await configs.get(guild.id))["modules"]["anti_nuke"]["enable"]: return
+    actor = await resolve_actor(guild, entry)
+    if actor is None or is_whitelisted(actor, guild): return
+    await report_nuke(guild, actor, "kick", f"Kicked: <@{entry.target.id}>", entry.target.id)
+
+# 🔥 Anti-Webhook Logic
+@metrics.timed("pdr_module_seconds", "anti_webhook")
+async def handle_webhook_create(entry):
+    guild = entry.guild
+    if not (await configs.get(guild.id))["modules"]["anti_webhook"]["enable"]: return
+    actor = await resolve_actor(guild, entry)
+    if actor is None or is_whitelisted(actor, guild): return
+
+    try:
+        webhook = await bot.fetch_webhook(entry.target.id)
+        await webhook.delete(reason="Anti-Webhook")
+    except discord.HTTPException: pass
+
+    channel = getattr(entry.after, "channel", None)
+    await report_nuke(guild, actor, "webhook_create", f"Channel: {channel.mention if channel else 'Unknown'}", entry.target.id)
+
+# 🔥 Anti-Role (LOW_MEMORY: สมาชิกไม่อยู่ใน cache -> on_member_update ไม่ยิง ใช้ audit entry แทน)
+@metrics.timed("pdr_module_seconds", "anti_role")
+async def handle_role_grant(entry):
+    guild = entry.guild
+    if not (await configs.get(guild.id))["modules"]["anti_role"]["enable"]: return
+    added = (guild.get_role(r.id) for r in getattr(entry.after, "roles", None) or ())
+    new_roles = dangerous_roles(r for r in added if r)
+    if not new_roles: return
+
+    actor = await resolve_actor(guild, entry)
+    if actor is None or is_whitelisted(actor, guild): return
+    for role in new_roles:
+        try: await bot.http.remove_role(guild.id, entry.target.id, role.id, reason="Anti-Role")
+        except discord.HTTPException: pass
+    await report_nuke(guild, actor, "role_grant", f"Gave {', '.join(r.name for r in new_roles)} to <@{entry.target.id}>", entry.target.id)
 
 # 🔥 Auto-Recovery Role
 @bot.event
+@metrics.timed("pdr_handler_seconds", "on_guild_role_delete")
 async def on_guild_role_delete(role):
-    await asyncio.sleep(0.5)
-    async for entry in role.guild.audit_logs(limit=1, action=discord.AuditLogAction.role_delete):
-        if is_whitelisted(entry.user): return
-        
-        try: await role.guild.ban(entry.user, reason="Deleting Roles")
-        except: pass
-        
-        await send_log(role.guild, "🚨 Role Deleted", f"User: {entry.user.mention}\nRole: {role.name}\nAction: **BANNED**")
-        break
-    
-    backup = db.get_backup(role.guild.id)
-    if backup:
-        role_data = next((r for r in backup["roles"] if r["name"] == role.name), None)
-        if role_data:
-            try:
-                await role.guild.create_role(name=role_data["name"], permissions=discord.Permissions(role_data["permissions"]), color=discord.Color(role_data["color"]), hoist=role_data["hoist"], mentionable=role_data["mentionable"])
-            except: pass
+    # กู้ยศทำงานเสมอ (เหมือนเดิม) -> ปิด anti_nuke แค่หยุดนับคะแนน/ลงโทษ
+    actor = await find_audit_entry(role.guild, discord.AuditLogAction.role_delete, role.id)
+    if actor and is_whitelisted(actor, role.guild):
+        await role_restorer.forget(role.guild.id, role.id)
+        return
+    if actor is None:
+        # หา audit ไม่เจอ = ยืนยันไม่ได้ว่าโดน nuke -> ไม่กู้เอง เก็บ index ไว้ให้แอดมินตัดสิน
+        role_restorer.hold(role.guild.id, role.id)
+        await send_log(role.guild, "♻️ Role Deleted (Unverified)", f"Role: {role.name}\nไม่พบคนลบใน audit log -> ไม่กู้อัตโนมัติ\nใช้ `/restore` ภายใน 24 ชม. ถ้าต้องการกู้", color=COLOR_WARN)
+        return
+
+    role_restorer.schedule(role.guild, role.id)
+    if (await configs.get(role.guild.id))["modules"]["anti_nuke"]["enable"]:
+        await report_nuke(role.guild, actor, "role_delete", f"Role: {role.name}", role.id)
 
 @bot.event
+@metrics.timed("pdr_handler_seconds", "on_guild_channel_delete")
+async def on_guild_channel_delete(channel):
+    if not (await configs.get(channel.guild.id))["modules"]["anti_nuke"]["enable"]: return
+    actor = await find_audit_entry(channel.guild, discord.AuditLogAction.channel_delete, channel.id)
+    if actor is None or is_whitelisted(actor, channel.guild): return
+    await report_nuke(channel.guild, actor, "channel_delete", f"Channel: #{channel.name}", channel.id)
+
+@bot.event
+@metrics.timed("pdr_handler_seconds", "on_member_join")
 async def on_member_join(member):
+    cfg = (await configs.get(member.guild.id))["modules"]
+
+    # Anti-Raid (ช่วง raid คนที่ถูก flag ไปจัดการเป็นชุด ไม่ต้องผ่าน handler ด้านล่าง)
+    raid = cfg["anti_raid"]
+    if raid["enable"] and not member.bot and not is_whitelisted(member):
+        started, flagged = raid_detector.record(member, raid["threshold"], raid["window"])
+        if started:
+            detected["anti_raid"].inc()
+            gid = member.guild.id
+            task = raid_detector.alerts[gid] = asyncio.create_task(start_raid(member.guild, raid, len(raid_detector.recent[gid])))
+            task.add_done_callback(lambda _: raid_detector.alerts.pop(gid, None))
+        if raid_detector.active(member.guild.id):
+            raid_detector.hold(member.guild, raid["action"], member.id if flagged else None)
+            if flagged: return
+
     # Anti-Link Name
-    if current_config["modules"]["anti_link"]["enable"] and not is_whitelisted(member):
-        if re.search(URL_PATTERN, member.display_name, re.IGNORECASE):
+    if cfg["anti_link"]["enable"] and not is_whitelisted(member):
+        if "anti_link" in configs.scanner(member.guild.id).scan_name(member.display_name):
+            detected["anti_link"].inc()
             try: await member.edit(nick=f"Moderated-{member.discriminator}")
             except: pass
-            res = await execute_punishment(member, current_config["modules"]["anti_link"]["action"], "Bad Nickname")
-            await send_log(member.guild, "⚠️ Bad Name", f"User: {member.mention}\nAction: **{res}**")
+            punish_then(member, cfg["anti_link"]["action"], "Bad Nickname",
+                        lambda res: send_log(member.guild, "⚠️ Bad Name", f"User: {member.mention}\nAction: **{res}**", user=member, group=f"**{res}**"))
 
     # Anti-Bot
-    if current_config["modules"]["anti_bot"]["enable"] and member.bot:
-        await asyncio.sleep(0.5)
-        async for entry in member.guild.audit_logs(limit=1, action=discord.AuditLogAction.bot_add):
-            if not is_whitelisted(entry.user):
-                try: await member.kick()
-                except: pass
-                res = await execute_punishment(entry.user, current_config["modules"]["anti_bot"]["action"], "Unauthorized Bot")
-                await send_log(member.guild, "🤖 Bot Added", f"Bot: {member.mention}\nAdded by: {entry.user.mention}\nAction: **{res}**")
-            break
+    if cfg["anti_bot"]["enable"] and member.bot:
+        actor = await find_audit_entry(member.guild, discord.AuditLogAction.bot_add, member.id)
+        if actor and not is_whitelisted(actor, member.guild):
+            try: await member.kick()
+            except: pass
+            await report_nuke(member.guild, actor, "bot_add", f"Bot: {member.mention}", member.id)
 
 @bot.event
+@metrics.timed("pdr_handler_seconds", "on_member_ban")
 async def on_member_ban(guild, user):
-    if not current_config["modules"]["anti_nuke"]["enable"]: return
-    await asyncio.sleep(0.5)
-    async for entry in guild.audit_logs(limit=1, action=discord.AuditLogAction.ban):
-        if is_whitelisted(entry.user): return
-        key = f"{guild.id}-{entry.user.id}-ban"
-        nuke_tracker[key][entry.user.id].append(datetime.datetime.now())
-        if len(nuke_tracker[key][entry.user.id]) >= NUKE_THRESHOLD:
-            try: await guild.ban(entry.user, reason="Anti-Nuke: Mass Ban")
-            except: pass
-            await send_log(guild, "🚨 Anti-Nuke", f"Banned {entry.user.mention} for Mass Ban")
-        break
+    if not (await configs.get(guild.id))["modules"]["anti_nuke"]["enable"]: return
+    actor = await find_audit_entry(guild, discord.AuditLogAction.ban, user.id)
+    if actor is None or is_whitelisted(actor, guild): return
+    await report_nuke(guild, actor, "ban", f"Banned: {user}", user.id)
 
 @bot.event
+@metrics.timed("pdr_handler_seconds", "on_member_update")
 async def on_member_update(before, after):
-    if not current_config["modules"]["anti_role"]["enable"]: return
     if len(before.roles) < len(after.roles):
-        new_roles = [r for r in after.roles if r not in before.roles]
-        dangerous = ["administrator", "manage_guild", "ban_members"]
-        for role in new_roles:
-            if any(value and perm in dangerous for perm, value in role.permissions):
-                async for entry in after.guild.audit_logs(limit=1, action=discord.AuditLogAction.member_role_update):
-                    if not is_whitelisted(entry.user):
-                        try: await after.remove_roles(role)
-                        except: pass
-                        try: await after.guild.ban(entry.user, reason="Anti-Role Security")
-                        except: pass
-                        await send_log(after.guild, "🚨 Anti-Role", f"Banned {entry.user.mention} for giving Admin.")
-                    break
+        if not (await configs.get(after.guild.id))["modules"]["anti_role"]["enable"]: return
+        new_roles = dangerous_roles(r for r in after.roles if r not in before.roles)
+        if not new_roles: return
+
+        actor = await find_audit_entry(after.guild, discord.AuditLogAction.member_role_update, after.id)
+        if actor is None or is_whitelisted(actor, after.guild): return
+        try: await after.remove_roles(*new_roles)
+        except: pass
+        await report_nuke(after.guild, actor, "role_grant", f"Gave {', '.join(r.name for r in new_roles)} to {after.mention}", after.id)
 
 # ==========================================
 # 🏁 RUNNER
 # ==========================================
+def stop_worker(*_):
+    raise KeyboardInterrupt  # bot.run ปิดตัวเรียบร้อย -> atexit flush DB
+
 if __name__ == "__main__":
-    if TOKEN:
-        keep_alive() # Run Flask
+    if TOKEN and CLUSTER_WORKERS > 1 and CLUSTER_ID < 0:
+        run_cluster(CLUSTER_WORKERS, SHARD_COUNT or recommended_shards(CLUSTER_WORKERS))
+    elif TOKEN:
+        if CLUSTER_ID >= 0:
+            signal.signal(signal.SIGTERM, stop_worker)
+            keep_alive(int(os.environ.get('PORT', 8080)) + 1 + CLUSTER_ID)  # /metrics ของ worker นี้
+        else: keep_alive() # Run Flask
         bot.run(TOKEN)
     else:
         print("❌ Error: TOKEN not found in .env or Environment Variables")
@@ -0,0 +1,419 @@
+# ==========================================
+# 🎬 PDR Security Offline Event Replay
+# ==========================================
+# เล่น event ปลอมเข้า handler จริงของ main.py (on_message / on_member_join / on_guild_channel_delete ...)
+# ไม่ต่อเน็ต ไม่ใช้ token: guild / member / channel / message / audit log / HTTP เป็นของปลอมทั้งหมด
+# ใช้งาน: python replay.py [scenario ...] [--latency วินาที] [--json ไฟล์] [--fail-p99 ms]
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import traceback
+from collections import defaultdict
+from types import SimpleNamespace
+
+os.environ.setdefault("DB_FILE", os.path.join(tempfile.mkdtemp(prefix="pdr-replay-"), "replay.db"))
+os.environ.setdefault("METRICS", "0")
+
+import discord
+import main
+
+BOT_ID = 900_000_000_000_000_001
+SCENARIOS = {}
+
+def scenario(name):
+    def wrap(fn):
+        SCENARIOS[name] = fn
+        return fn
+    return wrap
+
+def snowflake(seq, at=0.0):
+    return (int((START + at) * 1000) - discord.utils.DISCORD_EPOCH) << 22 | (seq & 0x3FFFFF)
+
+class ReplayClock:
+    # main.time ถูกแทนด้วยตัวนี้: handler เห็นเวลาตาม trace (เริ่มที่ START) แต่ replay เร็วเท่าที่ CPU ไหว
+    def __init__(self):
+        self.offset = 0.0
+
+    def time(self): return time.time() + self.offset
+    def monotonic(self): return time.monotonic() + self.offset
+
+    def __getattr__(self, name):
+        return getattr(time, name)  # perf_counter ฯลฯ ใช้เวลาจริง
+
+START = time.time()
+clock = ReplayClock()
+
+# ==========================================
+# 🧪 FAKE DISCORD
+# ==========================================
+class FakeHTTP:
+    # ทุก call ที่บอทจะยิงไป Discord มาผ่านที่นี่: นับ route + จำลอง latency
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = defaultdict(int)
+
+    async def call(self, route):
+        self.calls[route] += 1
+        if self.latency: await asyncio.sleep(self.latency)
+        else: await asyncio.sleep(0)
+
+class FakeRole:
+    def __init__(self, guild, role_id, name, position, permissions=0):
+        self.guild, self.id, self.name, self.position = guild, role_id, name, position
+        self.permissions = discord.Permissions(permissions)
+        self.color = discord.Color(0)
+        self.hoist = self.mentionable = self.managed = False
+        self.members = []
+
+    def is_default(self):
+        return self.position == 0
+
+class FakeMember:
+    def __init__(self, guild, member_id, name, created_at, avatar=True, bot=False, roles=()):
+        self.guild, self.id, self.name, self.display_name = guild, member_id, name, name
+        self.bot, self.created_at = bot, created_at
+        self.avatar = SimpleNamespace(url=f"https://cdn.invalid/{member_id}.png") if avatar else None
+        self._roles = [r.id for r in roles]
+        self.roles = list(roles)
+        self.discriminator = "0"
+        self.mention = f"<@{member_id}>"
+
+    def __str__(self):
+        return self.name
+
+    async def timeout(self, duration, reason=None): await self.guild.http.call("PATCH member (timeout)")
+    async def edit(self, **kwargs): await self.guild.http.call("PATCH member")
+    async def kick(self, reason=None): await self.guild.kick(self, reason=reason)
+    async def add_roles(self, *roles, reason=None): await self.guild.http.call("PATCH member (roles)")
+    async def remove_roles(self, *roles, reason=None): await self.guild.http.call("PATCH member (roles)")
+
+class FakeChannel:
+    def __init__(self, guild, channel_id, name, ctype=discord.ChannelType.text):
+        self.guild, self.id, self.name, self.type = guild, channel_id, name, ctype
+        self.mention = f"<#{channel_id}>"
+        self.overwrites = {}
+
+    async def send(self, content=None, embed=None, embeds=None):
+        await self.guild.http.call("POST message")
+        self.guild.log_messages += 1
+
+    async def delete_messages(self, messages, reason=None):
+        await self.guild.http.call("POST bulk-delete" if len(messages) > 1 else "DELETE message")
+
+    async def set_permissions(self, target, overwrite=None, reason=None):
+        await self.guild.http.call("PUT channel permissions")
+
+    def overwrites_for(self, target):
+        return discord.PermissionOverwrite()
+
+class FakeMessage:
+    def __init__(self, message_id, author, channel, content, mention_everyone=False, webhook_id=None, interaction_metadata=None):
+        self.id, self.author, self.channel, self.guild = message_id, author, channel, channel.guild
+        self.content, self.mention_everyone, self.webhook_id = content, mention_everyone, webhook_id
+        self.interaction_metadata = interaction_metadata
+        self._state = main.bot._connection  # bot.process_commands สร้าง Context จาก message
+
+    async def delete(self): await self.guild.http.call("DELETE message")
+
+class FakeWebhook:
+    def __init__(self, guild, webhook_id, creator):
+        self.guild, self.id, self.user = guild, webhook_id, creator
+        self.author = FakeMember(guild, webhook_id, f"hook-{webhook_id}", creator.created_at, bot=True)  # ไม่อยู่ใน member list
+        WEBHOOKS[webhook_id] = self
+
+    async def delete(self, reason=None):
+        await self.guild.http.call("DELETE webhook")
+        WEBHOOKS.pop(self.id, None)
+
+WEBHOOKS = {}
+
+async def fetch_webhook(webhook_id):
+    webhook = WEBHOOKS.get(webhook_id)
+    if webhook is None: raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Webhook")
+    await webhook.guild.http.call("GET webhook")
+    return webhook
+
+class FakeGuild:
+    def __init__(self, guild_id, http, n_members=300, n_channels=10, n_roles=20):
+        self.id, self.name, self.http = guild_id, f"replay-{guild_id}", http
+        self.roles = [FakeRole(self, guild_id, "@everyone", 0)] + [FakeRole(self, guild_id + 1 + i, f"role-{i}", i + 1) for i in range(n_roles)]
+        self.default_role = self.roles[0]
+        self.channels = [FakeChannel(self, guild_id + 1_000 + i, f"chat-{i}") for i in range(n_channels)]
+        self.log_channel = FakeChannel(self, guild_id + 999, "security-log")
+        self.threads, self.audit, self.log_messages = [], [], 0
+        self.me = SimpleNamespace(top_role=SimpleNamespace(position=n_roles + 10))
+        self.members = {}
+        old = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=400)
+        for i in range(n_members): self.add_member(FakeMember(self, guild_id + 10_000 + i, f"member{i}", old))
+
+    def add_member(self, member):
+        self.members[member.id] = member
+        return member
+
+    def get_member(self, member_id): return self.members.get(member_id)
+    def get_role(self, role_id): return next((r for r in self.roles if r.id == role_id), None)
+
+    def get_channel(self, channel_id):
+        if channel_id == self.log_channel.id: return self.log_channel
+        return next((c for c in self.channels if c.id == channel_id), None)
+    get_channel_or_thread = get_channel
+
+    async def ban(self, user, reason=None, delete_message_seconds=None): await self.http.call("PUT ban")
+    async def kick(self, user, reason=None): await self.http.call("DELETE member")
+
+    async def bulk_ban(self, users, reason=None, delete_message_seconds=0):
+        await self.http.call("POST bulk-ban")
+        return SimpleNamespace(banned=[discord.Object(u.id) for u in users], failed=[])
+
+    async def audit_logs(self, limit=100, action=None):
+        await self.http.call("GET audit-logs")
+        for entry in reversed(self.audit[-limit:]):
+            if action is None or entry.action == action: yield entry
+
+    async def create_role(self, **kwargs):
+        await self.http.call("POST role")
+        return discord.Object(random.getrandbits(60))
+
+    async def edit_role_positions(self, positions, reason=None): await self.http.call("PATCH role positions")
+
+def audit_entry(guild, action, target, actor):
+    entry = SimpleNamespace(guild=guild, action=action, target=target, user=actor, user_id=actor.id)
+    guild.audit.append(entry)
+    return entry
+
+def make_guild(guild_id, http, enable=()):
+    guild = FakeGuild(guild_id, http)
+    cfg = main.merge_config({}, main.default_conf)
+    for module in enable: cfg["modules"][module]["enable"] = True  # โมดูลที่ปิดไว้เป็นค่าเริ่มต้น
+    cfg["log_channel"] = guild.log_channel.id
+    main.configs.put(guild.id, cfg)
+    return guild
+
+# ==========================================
+# 📜 SCENARIOS (แต่ละอันคืน guild + list ของ (วินาทีใน trace, handler, args))
+# ==========================================
+WORDS = "hello gg lol nice ok thanks anyone playing tonight what time is the event see you later brb".split()
+
+@scenario("normal")
+def normal_chat(rng, http):
+    guild = make_guild(100_000, http)
+    members = list(guild.members.values())
+    events = []
+    for i in range(5_000):  # ~30 นาที
+        at = i * 0.36
+        author = rng.choice(members)
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 12)))
+        events.append((at, "on_message", (FakeMessage(snowflake(i, at), author, rng.choice(guild.channels), text),)))
+    return guild, events
+
+@scenario("spam_raid")
+def spam_raid(rng, http):
+    guild = make_guild(200_000, http)
+    members = list(guild.members.values())
+    young = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=2)
+    raiders = [guild.add_member(FakeMember(guild, 200_500_000 + i, f"spammer{i}", young, avatar=False)) for i in range(200)]
+    events, seq = [], 0
+    for burst in range(8):  # ทุกคนรัวข้อความละ ~0.8 วิ
+        for i, raider in enumerate(raiders):
+            seq += 1
+            at = burst * 0.8 + i * 0.004
+            text = "JOIN discord.gg/freenitro NOW" if rng.random() < 0.2 else "BUY CHEAP NITRO " * rng.randint(1, 4)
+            events.append((at, "on_message", (FakeMessage(snowflake(seq, at), raider, rng.choice(guild.channels), text),)))
+            if rng.random() < 0.25:  # คนปกติคุยแทรก
+                seq += 1
+                events.append((at, "on_message", (FakeMessage(snowflake(seq, at), rng.choice(members), rng.choice(guild.channels), "wtf is this spam"),)))
+    return guild, events
+
+@scenario("join_raid")
+def join_raid(rng, http):
+    guild = make_guild(300_000, http)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    events = []
+    for i in range(1_050):  # 1,000 raiders / นาที
+        if i % 21 == 0:  # คนปกติปนมา
+            member = FakeMember(guild, 300_500_000 + i, f"{rng.choice(WORDS)}{rng.choice(WORDS)}", now - datetime.timedelta(days=rng.randint(30, 2000)))
+        else:
+            member = FakeMember(guild, 300_500_000 + i, f"raider_{rng.randint(0, 99999)}", now - datetime.timedelta(hours=rng.randint(1, 20)), avatar=False)
+        events.append((i * 0.057, "on_member_join", (guild.add_member(member),)))
+    return guild, events
+
+@scenario("webhook_flood")
+def webhook_flood(rng, http):
+    guild = make_guild(500_000, http, enable=("anti_flood",))
+    members = list(guild.members.values())
+    old = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=900)
+    rogue = guild.add_member(FakeMember(guild, 500_500_000, "rogue-mod", old))
+    helper = guild.add_member(FakeMember(guild, 500_600_000, "ticket-bot", old, bot=True))
+    hooks = [FakeWebhook(guild, 500_700_000 + i, rogue) for i in range(3)]
+    target = guild.channels[0]
+    events, seq = [], 0
+
+    music = guild.add_member(FakeMember(guild, 500_650_000, "music-bot", old, bot=True))
+
+    def post(at, author, text, webhook_id=None, channel=None, interaction_metadata=None):
+        nonlocal seq
+        seq += 1
+        events.append((at, "on_message", (FakeMessage(snowflake(seq, at), author, channel or rng.choice(guild.channels), text, webhook_id=webhook_id, interaction_metadata=interaction_metadata),)))
+
+    for i in range(40): post(i * 0.5, rng.choice(members), " ".join(rng.choice(WORDS) for _ in range(5)))
+    for i in range(10): post(i * 2.0, helper, f"ticket #{i} opened")  # บอทปกติ ต้องไม่โดน
+    for i in range(30):  # คนกด slash command พร้อมกัน -> บอทตอบรัว (webhook_id = application id) ต้องไม่โดน
+        post(1 + i * 0.1, music, f"now playing #{i}", webhook_id=music.id, interaction_metadata=SimpleNamespace(id=i, user=rng.choice(members)))
+    for hook in hooks:  # webhook หลุด 3 ตัว รุมห้องเดียว ~50 ข้อความ/วิ
+        for i in range(200): post(5 + i * 0.02 + rng.uniform(0, 0.01), hook.author, "@everyone FREE NITRO", webhook_id=hook.id, channel=target)
+    events.sort(key=lambda e: e[0])
+    return guild, events
+
+@scenario("nuke")
+def nuke(rng, http):
+    guild = make_guild(400_000, http)
+    old = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=900)
+    rogues = [guild.add_member(FakeMember(guild, 400_500_000 + i, f"rogue-admin{i}", old)) for i in range(3)]
+    trusted = guild.add_member(FakeMember(guild, 400_600_000, "trusted-admin", old))
+    main.whitelist.add(guild.id, trusted.id, "user")
+    A = discord.AuditLogAction
+    events = []
+
+    def destroy(actor, kind, n):
+        for _ in range(n):
+            at = rng.uniform(0, 5)
+            if kind == "channel":
+                target = FakeChannel(guild, random.getrandbits(60), "deleted-channel")
+                events.append((at, "on_guild_channel_delete", (target,)))
+                action = A.channel_delete
+            elif kind == "role":
+                target = FakeRole(guild, random.getrandbits(60), "deleted-role", 5)
+                events.append((at, "on_guild_role_delete", (target,)))
+                action = A.role_delete
+            else:
+                target = discord.Object(random.getrandbits(60))
+                events.append((at, "on_member_ban", (guild, target)))
+                action = A.ban
+            # audit entry มาทีหลัง raw event เสมอ (กรณีที่ช้าที่สุดของ correlator)
+            events.append((at + rng.uniform(0.01, 0.3), "on_audit_log_entry_create", (audit_entry(guild, action, target, actor),)))
+
+    destroy(trusted, "channel", 5)
+    for rogue in rogues:
+        destroy(rogue, "channel", 15)
+        destroy(rogue, "role", 10)
+        destroy(rogue, "ban", 10)
+    events.sort(key=lambda e: e[0])  # หลายคนทำพร้อมกัน / audit entry ตามหลัง raw event
+    return guild, events
+
+# ==========================================
+# ▶️ RUNNER
+# ==========================================
+def reset_state():
+    # state ทุกตัวของ main เป็นของใหม่ต่อ scenario (handler อ่าน global ตอนเรียก)
+    main.spam_tracker = main.RateTracker()
+    main.nuke_detector = main.NukeDetector()
+    main.message_index = main.MessageIndex()
+    main.audit_feed = main.AuditCorrelator()
+    main.punisher = main.PunishmentExecutor()
+    main.log_dispatcher = main.LogDispatcher()
+    main.raid_detector = main.JoinRaidDetector()
+    main.role_restorer = main.RoleRestorer()
+    main.journal = main.IncidentJournal()
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+async def drain():
+    # รองานเบื้องหลัง (log flush, raid batch, cleanup, role restore) ให้จบ ยกเว้น worker ของ executor ที่วนตลอด
+    while True:
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task() and t not in main.punisher.workers]
+        if not tasks: return
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def replay(name, latency, seed=16, batch=50):
+    reset_state()
+    http = FakeHTTP(latency)
+    guild, events = SCENARIOS[name](random.Random(seed), http)
+    latencies, errors = defaultdict(list), defaultdict(int)
+
+    async def run(handler, args):
+        start = time.perf_counter()
+        try: await getattr(main, handler)(*args)
+        except Exception:
+            if not errors: traceback.print_exc()
+            errors[handler] += 1
+        latencies[handler].append(time.perf_counter() - start)
+
+    begin = time.perf_counter()
+    tasks = []
+    for i, (at, handler, args) in enumerate(events):
+        # เหมือน gateway: ทุก event เป็น task ของตัวเอง มาทีละชุด, นาฬิกาของ main เดินตาม trace
+        clock.offset = (START + at) - time.time()
+        tasks.append(asyncio.create_task(run(handler, args)))
+        if i % batch == batch - 1: await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    handled = time.perf_counter() - begin
+    await drain()
+    await main.journal.drain()
+    total = time.perf_counter() - begin
+    for worker in main.punisher.workers: worker.cancel()
+
+    every = sorted(t for ts in latencies.values() for t in ts)
+    return {
+        "scenario": name,
+        "events": len(events),
+        "seconds": round(handled, 4),
+        "drained_seconds": round(total, 4),
+        "events_per_second": round(len(events) / handled, 1),
+        "p50_ms": round(percentile(every, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(every, 0.99) * 1000, 3),
+        "handlers": {h: {"n": len(ts), "p50_ms": round(percentile(sorted(ts), 0.5) * 1000, 3), "p99_ms": round(percentile(sorted(ts), 0.99) * 1000, 3)} for h, ts in latencies.items()},
+        "api_calls": dict(sorted(http.calls.items())),
+        "api_total": sum(http.calls.values()),
+        "punish": dict(main.punisher.stats),
+        "log_messages": guild.log_messages,
+        "incidents": main.journal.written,
+        "errors": dict(errors),
+        "rss_bytes": main.PROCESS.memory_info().rss,
+    }
+
+def report(res):
+    print(f"🎬 {res['scenario']}: {res['events']:,} events in {res['seconds']:.2f}s -> {res['events_per_second']:,.0f} events/s  (background drained at {res['drained_seconds']:.2f}s)")
+    print(f"   latency p50={res['p50_ms']:.2f}ms p99={res['p99_ms']:.2f}ms")
+    for handler, h in res["handlers"].items():
+        print(f"   {handler:<26} n={h['n']:<6} p50={h['p50_ms']:.2f}ms p99={h['p99_ms']:.2f}ms")
+    print(f"   API calls={res['api_total']} {res['api_calls']}")
+    print(f"   punish={res['punish']}  log messages={res['log_messages']}  incidents={res['incidents']}" + (f"  ❌ errors={res['errors']}" if res["errors"] else ""))
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="PDR Security offline event replay")
+    parser.add_argument("scenarios", nargs="*", help=f"available: {', '.join(SCENARIOS)}")
+    parser.add_argument("--latency", type=float, default=0.0, help="latency ต่อ API call ของ fake HTTP (วินาที)")
+    parser.add_argument("--json", help="เขียนผลเป็น JSON (เก็บไว้เทียบ regression)")
+    parser.add_argument("--repeat", type=int, default=1, help="รันแต่ละ scenario ซ้ำกี่รอบ (ใช้วัด throughput ต่อโปรเซส)")
+    parser.add_argument("--quiet", action="store_true", help="ไม่พิมพ์ผลทีละ scenario")
+    parser.add_argument("--fail-p99", type=float, help="exit 1 ถ้า p99 (ms) ของ scenario ไหนเกินค่านี้")
+    args = parser.parse_args()
+
+    main.bot._connection.user = SimpleNamespace(id=BOT_ID)  # is_whitelisted เช็ค bot.user.id
+    main.bot.fetch_webhook = fetch_webhook
+    main.time = clock
+    results, failed = [], False
+    for name in (args.scenarios or list(SCENARIOS)) * args.repeat:
+        if name not in SCENARIOS:
+            print(f"❌ Unknown scenario: {name} (available: {', '.join(SCENARIOS)})")
+            failed = True
+            continue
+        res = asyncio.run(replay(name, args.latency))
+        if not args.quiet: report(res)
+        results.append(res)
+        if res["errors"] or (args.fail_p99 is not None and res["p99_ms"] > args.fail_p99): failed = True
+
+    if args.json:
+        with open(args.json, "w") as f: json.dump(results, f, indent=2, ensure_ascii=False)
+    main.db.close()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main_cli()
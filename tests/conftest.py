@@ -0,0 +1,8 @@
+# main สร้าง Database ตอน import -> ชี้ไปไฟล์ชั่วคราว ไม่แตะ protection.db จริง
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("DB_FILE", os.path.join(tempfile.mkdtemp(prefix="pdr-test-"), "test.db"))
+os.environ.setdefault("METRICS", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,26 @@
+import asyncio
+from concurrent.futures import Future
+
+import main
+
+def test_cancelled_write_does_not_kill_writer(tmp_path):
+    db = main.Database(str(tmp_path / "cancel.db"))
+    try:
+        fut = Future()
+        fut.cancel()  # เหมือนงานที่ await db.execute() แล้วโดน cancel ก่อน writer หยิบ
+        db.queue.put(("INSERT INTO config (key, value) VALUES ('cancelled', '1')", (), False, fut))
+        assert db.write("INSERT INTO config (key, value) VALUES ('after', '1')").result(timeout=5)
+        assert db.query("SELECT key FROM config ORDER BY key") == [("after",)]
+    finally: db.close()
+
+def test_cancelled_execute_then_next_write_returns(tmp_path):
+    db = main.Database(str(tmp_path / "cancel.db"))
+
+    async def run():
+        task = asyncio.create_task(db.execute("INSERT INTO config (key, value) VALUES ('a', '1')"))
+        await asyncio.sleep(0)
+        task.cancel()
+        return await asyncio.wait_for(db.execute("INSERT OR REPLACE INTO config (key, value) VALUES ('b', '1')"), 5)
+
+    try: assert asyncio.run(run())
+    finally: db.close()
@@ -0,0 +1,18 @@
+import asyncio
+from types import SimpleNamespace
+
+import main
+
+def test_flood_guard_is_opt_in():
+    assert main.default_conf["modules"]["anti_flood"]["enable"] is False
+    assert main.merge_config({}, main.default_conf)["modules"]["anti_flood"]["enable"] is False
+
+def test_interaction_responses_skip_flood_guard(monkeypatch):
+    hits = []
+    monkeypatch.setattr(main.flood_guard, "hit", lambda *args: hits.append(args))
+    bot = SimpleNamespace(id=42, bot=True)
+    guild, channel = SimpleNamespace(id=1), SimpleNamespace(id=2)
+    for i in range(50):  # บอทตอบ slash command รัว ๆ (webhook_id = application id)
+        message = SimpleNamespace(id=i, author=bot, guild=guild, channel=channel, webhook_id=bot.id, interaction_metadata=SimpleNamespace(id=i))
+        asyncio.run(main.check_flood(message))
+    assert hits == []
@@ -0,0 +1,21 @@
+import main
+
+def test_action_and_detection_labels_share_module_names():
+    for reason, module in (("Anti-Spam", "anti_spam"), ("Mass Mention", "anti_mention"), ("Bad Nickname", "anti_link"),
+                           ("Anti-Nuke: webhook_create", "anti_webhook"), ("Anti-Nuke: ban", "anti_nuke")):
+        assert main.reason_module(reason) == module
+        assert module in main.detected
+
+def test_bound_children_render_and_respect_toggle():
+    m = main.Metrics()
+    c, h = m.counter("pdr_detections_total", ("anti_spam",)), m.histogram("pdr_module_seconds", ("anti_spam",))
+    c.inc()
+    h.observe(0.0003)
+    m.enabled = False
+    c.inc()
+    h.observe(0.0003)
+    m.inc("pdr_actions_total", ("anti_spam", "ban", "ok"))
+    text = m.render()
+    assert 'pdr_detections_total{module="anti_spam"} 1' in text
+    assert 'pdr_module_seconds_bucket{module="anti_spam",le="0.0005"} 1' in text
+    assert "pdr_actions_total" not in text
@@ -0,0 +1,58 @@
+import json
+import sqlite3
+import zlib
+
+import main
+
+def legacy_db(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE backups (guild_id INTEGER, data TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)")
+    conn.executemany("INSERT INTO backups VALUES (?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+def role(name):
+    return {"name": name, "permissions": 8, "color": 0, "hoist": False, "mentionable": False}
+
+def test_legacy_backups_become_latest_full_snapshot(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    legacy_db(path, [(1, json.dumps({"roles": [role("old")]}), "2025-01-01 00:00:00"),
+                     (1, json.dumps({"roles": [role("Mod")]}), "2025-02-01 00:00:00")])
+    db = main.Database(path)
+    try:
+        rows = db.query("SELECT guild_id, base_id, data FROM snapshots")
+        assert len(rows) == 1 and rows[0][:2] == (1, None)
+        assert [r["name"] for r in json.loads(zlib.decompress(rows[0][2]))["roles"].values()] == ["Mod"]
+        assert not db.query("SELECT name FROM sqlite_master WHERE name LIKE 'backups%'")
+    finally: db.close()
+
+def test_unreadable_legacy_backups_are_kept(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    legacy_db(path, [(1, json.dumps({"roles": [role("Mod")]}), "2025-02-01 00:00:00"), (2, "garbage", "2025-02-01 00:00:00")])
+    db = main.Database(path)
+    try:
+        assert db.query("SELECT guild_id FROM snapshots") == [(1,)]
+        assert db.query("SELECT COUNT(*) FROM backups_legacy") == [(2,)]
+    finally: db.close()
+
+def test_legacy_file_is_converted_to_incremental_vacuum(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    legacy_db(path, [])
+    auto_vacuum = lambda: sqlite3.connect(path).execute("PRAGMA auto_vacuum").fetchone()[0]
+    assert auto_vacuum() == 0  # ไฟล์เก่า: PRAGMA ตอน connect ไม่มีผล
+    main.Database(path).close()
+    assert auto_vacuum() == 2
+
+def test_compact_runs_on_writer_between_writes(tmp_path):
+    path = str(tmp_path / "compact.db")
+    db = main.Database(path)
+    try:
+        blob = b"x" * 4000
+        db.write("INSERT INTO config (key, value) VALUES (?, ?)", [(f"k{i}", blob) for i in range(3000)], many=True).result()
+        db.write("DELETE FROM config").result()
+        assert db.query("PRAGMA freelist_count")[0][0] > main.DB_VACUUM_PAGES  # ต้องวนหลายรอบ
+        done = db.compact()
+        writes = [db.write("INSERT INTO config (key, value) VALUES (?, ?)", (f"w{i}", "1")) for i in range(20)]
+        assert done.result(timeout=30) and all(w.result(timeout=30) for w in writes)
+        assert sqlite3.connect(path).execute("PRAGMA freelist_count").fetchone()[0] == 0
+    finally: db.close()
@@ -0,0 +1,26 @@
+import asyncio
+from types import SimpleNamespace
+
+import main
+
+def test_punish_then_returns_before_punishment_and_logs_result(monkeypatch):
+    executor = main.PunishmentExecutor()
+    monkeypatch.setattr(main, "punisher", executor)
+    calls, logs = [], []
+
+    async def timeout(duration, reason=None):
+        await asyncio.sleep(0.05)  # API ช้า / ติดคิว
+        calls.append(reason)
+
+    async def log(res): logs.append(str(res))
+
+    async def run():
+        member = SimpleNamespace(id=5, bot=False, guild=SimpleNamespace(id=1), timeout=timeout)
+        fut = main.punish_then(member, "timeout", "Anti-Spam", log)
+        assert not fut.done() and not logs  # handler ไปต่อได้เลย
+        await fut
+        while main.background: await asyncio.sleep(0)
+        for w in executor.workers: w.cancel()
+
+    asyncio.run(run())
+    assert calls == ["Anti-Spam"] and len(logs) == 1 and "TIMEOUT" in logs[0].upper()
@@ -0,0 +1,20 @@
+import datetime
+from types import SimpleNamespace
+
+import main
+
+def test_name_key_latin():
+    assert main.name_key("raider_123") == main.name_key("Raider 456") == main.name_key("r a i d e r") == "raider"
+
+def test_name_key_keeps_non_latin_names():
+    assert main.name_key("บอท_01") == main.name_key("บอท 02") == "บอท"
+    assert main.name_key("สมชาย") != main.name_key("มานี")
+    assert main.name_key("Дмитрий99") == "дмитрий"
+
+def test_non_latin_clones_are_flagged():
+    detector = main.JoinRaidDetector()
+    guild = SimpleNamespace(id=1)
+    now = 1_000_000
+    created = datetime.datetime.fromtimestamp(now - 3 * 86400, datetime.timezone.utc)  # อายุ 3 วัน + ไม่มีรูป = ยังไม่ถึงเกณฑ์เอง
+    flags = [detector.record(SimpleNamespace(id=i, name=f"ปั่น{i}", guild=guild, avatar=None, created_at=created), 100, 60, now=now + i)[1] for i in range(5)]
+    assert flags == [False, False, True, True, True]
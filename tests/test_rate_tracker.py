@@ -0,0 +1,53 @@
+import main
+
+def hits(tracker, key, times, threshold=5, window=5):
+    return [tracker.hit(key, threshold, window, now=t) for t in times]
+
+def test_trips_on_threshold_within_window():
+    tracker = main.RateTracker()
+    assert hits(tracker, "a", [0, 1, 2, 3, 4]) == [False, False, False, False, True]
+
+def test_window_expiry():
+    tracker = main.RateTracker()
+    # 5 hits spread over 5s: the oldest falls out of the window just as the 5th arrives
+    assert hits(tracker, "a", [0, 1.25, 2.5, 3.75, 5.0]) == [False] * 5
+    # but the last 5 (1.25 .. 5.5) fit
+    assert tracker.hit("a", 5, 5, now=5.5) is True
+
+def test_only_last_threshold_hits_count():
+    tracker = main.RateTracker()
+    hits(tracker, "a", range(0, 100, 10))  # slow for a long time
+    assert hits(tracker, "a", [100.1, 100.2, 100.3, 100.4, 100.5]) == [False, False, False, False, True]
+
+def test_threshold_change_reuses_key():
+    tracker = main.RateTracker()
+    hits(tracker, "a", [0, 0.1, 0.2])
+    assert tracker.hit("a", 3, 5, now=0.3) is True
+    assert tracker.hit("a", 10, 5, now=0.4) is False
+
+def test_keys_are_independent_and_reset():
+    tracker = main.RateTracker()
+    hits(tracker, "a", [0, 0.1, 0.2, 0.3])
+    assert tracker.hit("b", 5, 5, now=0.4) is False
+    tracker.reset("a")
+    assert tracker.hit("a", 5, 5, now=0.5) is False
+
+def test_evicts_least_recently_used_at_capacity():
+    tracker = main.RateTracker(max_keys=3)
+    for i, key in enumerate("abc"): tracker.hit(key, 5, 5, now=i)
+    tracker.hit("a", 5, 5, now=3)  # a is now most recent
+    tracker.hit("d", 5, 5, now=4)
+    assert list(tracker.windows) == ["c", "a", "d"]
+
+def test_sweep_drops_idle_keys_only():
+    tracker = main.RateTracker(idle_after=60)
+    tracker.hit("old", 5, 5, now=0)
+    tracker.hit("new", 5, 5, now=100)
+    assert tracker.sweep(now=120) == 1
+    assert list(tracker.windows) == ["new"]
+    assert tracker.sweep(now=120) == 0
+
+def test_evicts_in_batches():
+    tracker = main.RateTracker(max_keys=32)
+    for i in range(33): tracker.hit(i, 5, 5, now=i)
+    assert len(tracker) == 31 and 0 not in tracker.windows and 1 not in tracker.windows
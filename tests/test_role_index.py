@@ -0,0 +1,76 @@
+import asyncio
+from types import SimpleNamespace
+
+import main
+
+def fake_role(role_id, name):
+    return SimpleNamespace(id=role_id, name=name, permissions=SimpleNamespace(value=8), color=SimpleNamespace(value=0), hoist=False,
+                           mentionable=False, position=1, managed=False, is_default=lambda: False)
+
+def fake_guild(guild_id, roles):
+    return SimpleNamespace(id=guild_id, roles=roles, members=[], chunked=True)
+
+def indexed(guild_id):
+    return asyncio.run(main.db.role_snapshot_hashes(guild_id)).keys()
+
+def test_index_drops_roles_that_no_longer_exist():
+    restorer = main.RoleRestorer()
+    a, b = fake_role(11, "a"), fake_role(12, "b")
+    asyncio.run(restorer.index(fake_guild(501, [a, b])))
+    assert set(indexed(501)) == {11, 12}
+    asyncio.run(restorer.index(fake_guild(501, [a])))  # b ถูกลบตอนบอทออฟไลน์
+    assert set(indexed(501)) == {11}
+
+def test_index_keeps_pending_and_held_roles():
+    restorer = main.RoleRestorer()
+    roles = [fake_role(21, "a"), fake_role(22, "b"), fake_role(23, "c")]
+    asyncio.run(restorer.index(fake_guild(502, roles)))
+    restorer.pending[502] = {22}
+    restorer.hold(502, 23)
+    asyncio.run(restorer.index(fake_guild(502, roles[:1])))
+    assert set(indexed(502)) == {21, 22, 23}
+
+    restorer.pending.clear()
+    restorer.held[502][23] -= main.RESTORE_HOLD + 1  # หมดเวลาเก็บ
+    asyncio.run(restorer.index(fake_guild(502, roles[:1])))
+    assert set(indexed(502)) == {21}
+
+def test_restore_falls_back_to_backup_and_reapplies_overwrites():
+    restorer = main.RoleRestorer()
+    data = {"name": "Mod", "permissions": 8, "color": 0, "hoist": False, "mentionable": False, "position": 3}
+    state = {"roles": {"31": data}, "channels": {"900": {"name": "staff", "overwrites": {"31": ["role", 1024, 2048], "5": ["member", 1, 0]}}}}
+    asyncio.run(main.db.add_snapshot(503, "h", None, main.pack(state)))  # ยศ 31 สร้างหลัง index รอบล่าสุด -> มีแค่ใน backup
+    created, overwrites = [], []
+
+    async def create_role(**kwargs):
+        created.append(kwargs["name"])
+        return main.discord.Object(777)
+
+    async def edit_role_positions(positions, reason=None): pass
+
+    async def set_permissions(target, overwrite=None, reason=None): overwrites.append((target.id, overwrite.pair()[0].value, overwrite.pair()[1].value))
+
+    channel = SimpleNamespace(id=900, set_permissions=set_permissions)
+    guild = SimpleNamespace(id=503, roles=[], members=[], create_role=create_role, edit_role_positions=edit_role_positions,
+                            me=SimpleNamespace(top_role=SimpleNamespace(position=10)), get_channel={900: channel}.get, get_member=lambda _: None)
+    res = asyncio.run(restorer.restore(guild, {31}))
+    assert created == ["Mod"] and res["created"] == 1
+    assert overwrites == [(777, 1024, 2048)] and res["overwrites"] == 1
+
+def test_manual_restore_can_recreate_legacy_roles_by_name():
+    legacy = lambda name: {"name": name, "permissions": 8, "color": 0, "hoist": False, "mentionable": False, "position": None}
+    state = {"roles": {"legacy-0": legacy("Mod"), "legacy-1": legacy("VIP"), "legacy-2": legacy("VIP")}, "channels": {}}
+    asyncio.run(main.db.add_snapshot(504, "legacy", None, main.pack(state)))  # แบบที่ migrate_backups สร้าง
+    created = []
+
+    async def create_role(**kwargs):
+        created.append(kwargs["name"])
+        return main.discord.Object(800 + len(created))
+
+    async def edit_role_positions(positions, reason=None): raise AssertionError("legacy roles have no position")
+
+    guild = SimpleNamespace(id=504, roles=[fake_role(41, "Mod")], members=[], create_role=create_role, edit_role_positions=edit_role_positions,
+                            me=None, get_channel=lambda _: None, get_member=lambda _: None)
+    assert asyncio.run(main.RoleRestorer().restore(guild))["created"] == 0  # ไม่ขอ -> ไม่แตะ backup เก่า
+    res = asyncio.run(main.RoleRestorer().restore(guild, legacy=True))
+    assert created == ["VIP"] and res["created"] == 1
@@ -0,0 +1,27 @@
+import copy
+
+import main
+
+def scanner(words=(), domains=()):
+    cfg = copy.deepcopy(main.default_conf)
+    cfg["banned_words"], cfg["blocked_domains"] = list(words), list(domains)
+    return main.ContentScanner(cfg)
+
+def test_all_rules_in_one_pass():
+    s = scanner(words=["scam"], domains=["evil.com"])
+    assert s.scan_message("SCAM at evil.com and discord.gg/abc") == {"banned_word", "blocked_domain", "anti_invite"}
+
+def test_domain_needs_boundary():
+    s = scanner(domains=["evil.com"])
+    assert s.scan_message("go to notevil.com") == set()
+    assert s.scan_message("go to evil.com.") == {"blocked_domain"}
+
+def test_rejected_domain_falls_back_to_shorter_word():
+    s = scanner(words=["evil"], domains=["evil.com"])
+    assert s.scan_message("evil.company") == {"banned_word"}
+    assert s.scan_message("evil.com") == {"blocked_domain"}
+
+def test_name_rules():
+    s = scanner()
+    assert s.scan_name("Visit https://x.y") == {"anti_link"}
+    assert s.scan_name("plain name") == set()
@@ -0,0 +1,19 @@
+import asyncio
+
+import main
+
+def test_remove_falls_back_to_global_entry(tmp_path):
+    db = main.Database(str(tmp_path / "wl.db"))
+
+    async def run():
+        await db.execute("INSERT INTO whitelist (guild_id, id, type) VALUES (0, 7, 'user')")  # แถวที่ย้ายมาจาก whitelist เดิม
+        await db.manage_whitelist(1, 8, "user", "add")
+        listed = await db.manage_whitelist(1, None, None, "list")
+        return listed, [await db.manage_whitelist(1, tid, "user", "remove") for tid in (8, 7, 7)]
+
+    try:
+        listed, removed = asyncio.run(run())
+        assert sorted(listed) == [(0, 7, "user"), (1, 8, "user")]
+        assert removed == [1, 0, None]
+        assert db.query("SELECT * FROM whitelist") == []
+    finally: db.close()